@@ -217,6 +217,10 @@ class AstakosClient(object):
     def api_commissions_action(self):
         return join_urls(self.api_commissions, "action")
 
+    @property
+    def api_commissions_batch(self):
+        return join_urls(self.api_commissions, "batch")
+
     @property
     def api_feedback(self):
         return join_urls(self.account_prefix, "feedback")
@@ -851,6 +855,33 @@ class AstakosClient(object):
                                   headers=req_headers, body=req_body,
                                   method="POST")
 
+    # ----------------------------------
+    # do a POST to ``API_COMMISSIONS_BATCH``
+    def issue_commissions(self, commissions):
+        """Issue many commissions at once
+
+        Keyword arguments:
+        commissions -- commission requests (list of dicts), each with the
+                       "provisions" and optionally the "name", "force" and
+                       "auto_accept" of a commission
+
+        All commissions are issued in one transaction. In case of success
+        return a list with a dict for each commission, in the given order:
+        either {"serial": <commission's id>, "accepted": <bool>}, or the
+        fault that the commission failed with (e.g. "overLimit").
+        Otherwise raise an AstakosClientException.
+
+        """
+        check_input("issue_commissions", self.logger,
+                    commissions=commissions)
+
+        req_headers = {'content-type': 'application/json'}
+        req_body = parse_request({"commissions": commissions}, self.logger)
+        response = self._call_astakos(self.api_commissions_batch,
+                                      headers=req_headers, body=req_body,
+                                      method="POST")
+        return response["commissions"]
+
     # ----------------------------
     # do a GET to ``API_PROJECTS``
     def get_projects(self, name=None, state=None, owner=None, mode=None):
@@ -184,6 +184,17 @@ commission_description = {
             "quantity": 536870912
         }]}
 
+issue_commissions_req = {
+    "commissions": [
+        {"provisions": commission_request["provisions"],
+         "auto_accept": True},
+        {"provisions": commission_request["provisions"]}]}
+
+issue_commissions_rep = {
+    "commissions": [
+        {"serial": 57, "accepted": True},
+        commission_failure_response]}
+
 resolve_commissions_req = {
     "accept": [56, 57],
     "reject": [56, 58, 59]}
@@ -379,6 +390,12 @@ def _req_commission(conn, method, url, **kwargs):
                     return ("", json.dumps(resolve_commissions_rep), 200)
                 else:
                     return _request_status_400(conn, method, url, **kwargs)
+            elif serial == "batch":
+                # Issue multiple commissions
+                if body == issue_commissions_req:
+                    return ("", json.dumps(issue_commissions_rep), 200)
+                else:
+                    return _request_status_400(conn, method, url, **kwargs)
             else:
                 # Issue action for one commission
                 if serial != str(57):
@@ -913,6 +930,18 @@ class TestCommissions(unittest.TestCase):
             self.fail("Shouldn't raise Exception %s" % err)
         self.assertEqual(result, resolve_commissions_rep)
 
+    # ----------------------------------
+    def test_issue_commissions(self):
+        """Test function call of issue_commissions"""
+        global token, auth_url
+        try:
+            client = AstakosClient(token['id'], auth_url)
+            result = client.issue_commissions(
+                issue_commissions_req["commissions"])
+        except Exception as err:
+            self.fail("Shouldn't raise Exception %s" % err)
+        self.assertEqual(result, issue_commissions_rep["commissions"])
+
 
 # ----------------------------
 # Run tests
@@ -14,13 +14,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import hashlib
+import mmap
 import os
 
 from binascii import hexlify
+from multiprocessing import Pool, cpu_count
 
 from progress.bar import IncrementalBar
 
 
+# The number of blocks that each hashing process hashes at a time.
+HASH_CHUNK_BLOCKS = 16
+
+
 def file_read_iterator(fp, size=1024):
     while True:
         data = fp.read(size)
@@ -29,6 +35,27 @@ def file_read_iterator(fp, size=1024):
         yield data
 
 
+def hash_blocks(args):
+    """Return the hashes of count blocks of a file, from block start on.
+
+    args is a (path, blocksize, blockhash, start, count) tuple, since
+    Pool.imap passes a single argument.
+    """
+    path, blocksize, blockhash, start, count = args
+    hashes = []
+    with open(path, 'rb') as fp:
+        m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for i in xrange(start, start + count):
+                block = m[i * blocksize:(i + 1) * blocksize]
+                h = hashlib.new(blockhash)
+                h.update(block.rstrip('\x00'))
+                hashes.append(h.digest())
+        finally:
+            m.close()
+    return hashes
+
+
 class HashMap(list):
 
     def __init__(self, blocksize, blockhash):
@@ -59,16 +86,42 @@ class HashMap(list):
             h = [self._hash_raw(h[x] + h[x + 1]) for x in range(0, len(h), 2)]
         return h[0]
 
-    def load(self, fp):
+    def load(self, fp, processes=None):
+        """Hash the blocks of a file.
+
+        Files of more than HASH_CHUNK_BLOCKS blocks are hashed by a pool of
+        processes (by default, one per CPU), each mapping the file in memory.
+        """
         self.size = 0
         file_size = os.fstat(fp.fileno()).st_size
         nblocks = 1 + (file_size - 1) // self.blocksize
         bar = IncrementalBar('Computing', max=nblocks)
         bar.suffix = '%(percent).1f%% - %(eta)ds'
+        if processes is None:
+            processes = cpu_count()
+        if processes > 1 and nblocks > HASH_CHUNK_BLOCKS:
+            self._load_parallel(fp.name, nblocks, processes, bar)
+            self.size = file_size
+            return
         for block in bar.iter(file_read_iterator(fp, self.blocksize)):
             self.append(self._hash_block(block))
             self.size += len(block)
 
+    def _load_parallel(self, path, nblocks, processes, bar):
+        chunks = [(path, self.blocksize, self.blockhash, start,
+                   min(HASH_CHUNK_BLOCKS, nblocks - start))
+                  for start in xrange(0, nblocks, HASH_CHUNK_BLOCKS)]
+        pool = Pool(processes)
+        try:
+            for hashes in pool.imap(hash_blocks, chunks):
+                self.extend(hashes)
+                bar.next(len(hashes))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        bar.finish()
+
 
 def merkle(path, blocksize=4194304, blockhash='sha256'):
     hashes = HashMap(blocksize, blockhash)
@@ -13,19 +13,46 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import mmap
 import os
 import types
 import json
 
 from hashmap import HashMap
-from binascii import hexlify, unhexlify
+from binascii import hexlify
 from cStringIO import StringIO
 from client import Fault
+from multiprocessing.pool import ThreadPool
 
 from progress.bar import IncrementalBar
 
+# The number of blocks transferred concurrently. Each transfer uses its own
+# connection and keeps at most one block in memory.
+DEFAULT_CONCURRENCY = 4
 
-def upload(client, path, container, prefix, name=None, mimetype=None):
+
+def pwrite(path, data, offset):
+    """Write data at offset, without sharing a file position with others."""
+    with open(path, 'r+b') as fp:
+        fp.seek(offset)
+        fp.write(data)
+
+
+def run_concurrently(func, args, concurrency, bar):
+    """Call func for each of args from a pool of threads."""
+    pool = ThreadPool(concurrency)
+    try:
+        for _ in pool.imap_unordered(func, args):
+            bar.next()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    bar.finish()
+
+
+def upload(client, path, container, prefix, name=None, mimetype=None,
+           concurrency=DEFAULT_CONCURRENCY):
 
     meta = client.retrieve_container_metadata(container)
     blocksize = int(meta['x-container-block-size'])
@@ -56,21 +83,33 @@ def upload(client, path, container, prefix, name=None, mimetype=None):
     if '' in missing:
         del missing[missing.index(''):]
 
+    offsets = {}
+    for i, h in enumerate(map['hashes']):
+        offsets.setdefault(h, i * blocksize)
+    missing = [h for h in set(missing) if h in offsets]
+
     bar = IncrementalBar('Uploading', max=len(missing))
     bar.suffix = '%(percent).1f%% - %(eta)ds'
-    with open(path) as fp:
-        for hash in missing:
-            offset = hashes.index(unhexlify(hash)) * blocksize
-            fp.seek(offset)
-            block = fp.read(blocksize)
-            client.update_container_data(container, StringIO(block))
-            bar.next()
-    bar.finish()
+    if missing:
+        with open(path, 'rb') as fp:
+            m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                def upload_block(hash):
+                    offset = offsets[hash]
+                    block = m[offset:offset + blocksize]
+                    client.update_container_data(container, StringIO(block))
+
+                run_concurrently(upload_block, missing, concurrency, bar)
+            finally:
+                m.close()
+    else:
+        bar.finish()
 
     return client.create_object_by_hashmap(container, object, map, **kwargs)
 
 
-def download(client, container, object, path):
+def download(client, container, object, path,
+             concurrency=DEFAULT_CONCURRENCY):
 
     res = client.retrieve_object_hashmap(container, object)
     blocksize = int(res['block_size'])
@@ -79,24 +118,27 @@ def download(client, container, object, path):
     map = res['hashes']
 
     if os.path.exists(path):
-        h = HashMap(blocksize, blockhash)
-        h.load(open(path))
-        hashes = [hexlify(x) for x in h]
+        local_map = HashMap(blocksize, blockhash)
+        local_map.load(open(path))
+        hashes = [hexlify(x) for x in local_map]
     else:
         open(path, 'w').close()     # Create an empty file
         hashes = []
 
-    with open(path, 'a+') as fp:
-        if bytes != 0:
-            for i, h in enumerate(map):
-                if i < len(hashes) and h == hashes[i]:
-                    continue
-                start = i * blocksize
-                end = '' if i == len(map) - 1 else ((i + 1) * blocksize) - 1
-                data = client.retrieve_object(
-                    container, object, range='bytes=%s-%s' % (start, end))
-                if i != len(map) - 1:
-                    data += (blocksize - len(data)) * '\x00'
-                fp.seek(start)
-                fp.write(data)
+    def download_block(i):
+        start = i * blocksize
+        end = '' if i == len(map) - 1 else ((i + 1) * blocksize) - 1
+        data = client.retrieve_object(
+            container, object, range='bytes=%s-%s' % (start, end))
+        if i != len(map) - 1:
+            data += (blocksize - len(data)) * '\x00'
+        pwrite(path, data, start)
+
+    if bytes != 0:
+        missing = [i for i, h in enumerate(map)
+                   if i >= len(hashes) or h != hashes[i]]
+        bar = IncrementalBar('Downloading', max=len(missing))
+        bar.suffix = '%(percent).1f%% - %(eta)ds'
+        run_concurrently(download_block, missing, concurrency, bar)
+    with open(path, 'r+b') as fp:
         fp.truncate(bytes)
@@ -43,8 +43,9 @@ def get_network_details_href(ip_log):
     return create_details_href('network', network.name, network.pk)
 
 
-def get_user_details_href(ip_log):
-    user = AstakosUser.objects.get(uuid=ip_log.user_id)
+def get_user_details_href(ip_log, user=None):
+    if user is None:
+        user = AstakosUser.objects.get(uuid=ip_log.user_id)
     return create_details_href('user', user.realname, user.email, user.uuid)
 
 
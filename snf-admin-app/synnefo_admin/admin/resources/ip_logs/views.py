@@ -39,6 +39,7 @@ class IPLogJSONView(AdminJSONView):
     fields = ('address', 'user_id', 'server_id', 'network_id', 'action',
               'action_date', 'action_reason')
     filters = IPLogFilterSet
+    user_field = 'user_id'
 
     # This is a rather hackish method of plugging ourselves after
     # get_queryset()
@@ -47,11 +48,15 @@ class IPLogJSONView(AdminJSONView):
         self.qs = _filter_public_ip_log(self.qs)
         return AdminJSONView.set_object_list(self)
 
+    def get_extra_data(self, qs):
+        qs = self.fetch_users(qs)
+        return [self.get_extra_data_row(row) for row in qs]
+
     def get_extra_data_row(self, inst):
         extra_dict = OrderedDict()
         extra_dict['user_info'] = {
             'display_name': "User",
-            'value': get_user_details_href(inst),
+            'value': get_user_details_href(inst, self.get_user(inst.user_id)),
             'visible': True,
         }
         extra_dict['id'] = {
@@ -49,19 +49,24 @@ def get_ip_or_404(query):
         raise AdminHttp404(msg)
 
 
-def get_contact_email(inst):
+def get_contact_email(inst, user=None):
     if inst.userid:
-        return AstakosUser.objects.get(uuid=inst.userid).email
+        if user is None:
+            user = AstakosUser.objects.get(uuid=inst.userid)
+        return user.email
 
 
-def get_contact_name(inst):
+def get_contact_name(inst, user=None):
     if inst.userid:
-        return AstakosUser.objects.get(uuid=inst.userid).realname
+        if user is None:
+            user = AstakosUser.objects.get(uuid=inst.userid)
+        return user.realname
 
 
-def get_user_details_href(ip):
+def get_user_details_href(ip, user=None):
     if ip.userid:
-        user = AstakosUser.objects.get(uuid=ip.userid)
+        if user is None:
+            user = AstakosUser.objects.get(uuid=ip.userid)
         return create_details_href('user', user.realname, user.email, user.uuid)
     else:
         return "-"
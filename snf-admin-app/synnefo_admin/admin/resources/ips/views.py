@@ -60,9 +60,9 @@ class IPJSONView(AdminJSONView):
         return row
 
     def get_extra_data(self, qs):
-        # FIXME: The `contact_name`, `contact_email` fields will cripple our db
         if self.form.cleaned_data['iDisplayLength'] < 0:
             qs = qs.only('pk', 'address', 'floating_ip', 'created', 'userid',)
+        qs = self.fetch_users(qs)
         return [self.get_extra_data_row(row) for row in qs]
 
     def get_extra_data_row(self, inst):
@@ -99,12 +99,14 @@ class IPJSONView(AdminJSONView):
         }
         extra_dict['contact_email'] = {
             'display_name': "Contact email",
-            'value': escape(get_contact_email(inst)),
+            'value': escape(get_contact_email(inst,
+                                              self.users.get(inst.userid))),
             'visible': False,
         }
         extra_dict['contact_name'] = {
             'display_name': "Contact name",
-            'value': escape(get_contact_name(inst)),
+            'value': escape(get_contact_name(inst,
+                                             self.users.get(inst.userid))),
             'visible': False,
         }
 
@@ -123,7 +125,8 @@ class IPJSONView(AdminJSONView):
         extra_dict = OrderedDict()
         extra_dict['user_info'] = {
             'display_name': "Owner",
-            'value': get_user_details_href(inst),
+            'value': get_user_details_href(inst,
+                                           self.users.get(inst.userid)),
             'visible': True,
         }
         extra_dict['vm_info'] = {
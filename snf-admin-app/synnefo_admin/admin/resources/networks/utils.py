@@ -31,23 +31,28 @@ def get_network_or_404(query):
             "No Network was found that matches this query: %s\n" % query)
 
 
-def get_contact_email(inst):
+def get_contact_email(inst, user=None):
     if inst.userid:
-        return AstakosUser.objects.get(uuid=inst.userid).email
+        if user is None:
+            user = AstakosUser.objects.get(uuid=inst.userid)
+        return user.email
     else:
         return "-"
 
 
-def get_contact_name(inst):
+def get_contact_name(inst, user=None):
     if inst.userid:
-        return AstakosUser.objects.get(uuid=inst.userid).realname
+        if user is None:
+            user = AstakosUser.objects.get(uuid=inst.userid)
+        return user.realname
     else:
         return "-"
 
 
-def get_user_details_href(inst):
+def get_user_details_href(inst, user=None):
     if inst.userid:
-        user = AstakosUser.objects.get(uuid=inst.userid)
+        if user is None:
+            user = AstakosUser.objects.get(uuid=inst.userid)
         return create_details_href('user', user.realname, user.email, user.uuid)
     else:
         return "-"
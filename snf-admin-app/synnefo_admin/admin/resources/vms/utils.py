@@ -37,6 +37,7 @@ def get_flavor_info(vm):
             str(vm.flavor.volume_type.disk_template))
 
 
-def get_user_details_href(vm):
-    user = AstakosUser.objects.get(uuid=vm.userid)
+def get_user_details_href(vm, user=None):
+    if user is None:
+        user = AstakosUser.objects.get(uuid=vm.userid)
     return create_details_href('user', user.realname, user.email, user.uuid)
@@ -51,10 +51,10 @@ class VMJSONView(AdminJSONView):
     filters = VMFilterSet
 
     def get_extra_data(self, qs):
-        # FIXME: The `contact_name`, `contact_email` fields will cripple our db
         if self.form.cleaned_data['iDisplayLength'] < 0:
             qs = qs.only('pk', 'name', 'operstate', 'suspended', 'id',
                          'deleted', 'task', 'userid')
+        qs = self.fetch_users(qs)
         return [self.get_extra_data_row(row) for row in qs]
 
     def get_extra_data_row(self, inst):
@@ -63,6 +63,7 @@ class VMJSONView(AdminJSONView):
         else:
             extra_dict = OrderedDict()
 
+        user = self.get_user(inst.userid)
         extra_dict['allowed_actions'] = {
             'display_name': "",
             'value': get_allowed_actions(cached_actions, inst,
@@ -91,12 +92,12 @@ class VMJSONView(AdminJSONView):
         }
         extra_dict['contact_email'] = {
             'display_name': "Contact email",
-            'value': escape(AstakosUser.objects.get(uuid=inst.userid).email),
+            'value': escape(user.email),
             'visible': False,
         }
         extra_dict['contact_name'] = {
             'display_name': "Contact name",
-            'value': escape(AstakosUser.objects.get(uuid=inst.userid).realname),
+            'value': escape(user.realname),
             'visible': False,
         }
 
@@ -115,7 +116,8 @@ class VMJSONView(AdminJSONView):
         extra_dict = OrderedDict()
         extra_dict['user_info'] = {
             'display_name': "Owner",
-            'value': get_user_details_href(inst),
+            'value': get_user_details_href(inst,
+                                           self.get_user(inst.userid)),
             'visible': True,
         }
         extra_dict['image_id'] = {
@@ -31,8 +31,9 @@ def get_volume_or_404(query):
             "No Volume was found that matches this query: %s\n" % query)
 
 
-def get_user_details_href(volume):
-    user = AstakosUser.objects.get(uuid=volume.userid)
+def get_user_details_href(volume, user=None):
+    if user is None:
+        user = AstakosUser.objects.get(uuid=volume.userid)
     return create_details_href('user', user.realname, user.email, user.uuid)
 
 
@@ -16,6 +16,8 @@
 from eztables.views import DatatablesView
 from django.utils.html import escape
 
+from astakos.im.models import AstakosUser
+
 
 def escape_row(row):
     """Escape a whole row using Django's escape function."""
@@ -31,6 +33,29 @@ class AdminJSONView(DatatablesView):
     from it.
     """
 
+    # The attribute of the listed objects that holds their owner's UUID
+    user_field = 'userid'
+    users = {}
+
+    def fetch_users(self, rows):
+        """Fetch the owners of a page of rows with a single query.
+
+        Return the rows as a list. The owners are then returned by get_user.
+        """
+        rows = list(rows)
+        uuids = set(getattr(row, self.user_field) for row in rows)
+        uuids.discard(None)
+        users = AstakosUser.objects.filter(uuid__in=uuids)
+        self.users = dict((user.uuid, user) for user in users)
+        return rows
+
+    def get_user(self, uuid):
+        """Return the owner with this UUID."""
+        user = self.users.get(uuid)
+        if user is None:
+            user = AstakosUser.objects.get(uuid=uuid)
+        return user
+
     def format_data_rows(self, rows):
         if hasattr(self, 'format_data_row'):
             rows = [escape_row(self.format_data_row(row)) for row in rows]
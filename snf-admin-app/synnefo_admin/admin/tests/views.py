@@ -22,6 +22,7 @@ from django.core.urlresolvers import reverse
 
 from synnefo_admin.admin.exceptions import AdminHttp404
 from synnefo_admin.admin import views
+from synnefo_admin.admin.tables import AdminJSONView
 from synnefo_admin import admin_settings
 
 from .common import (for_all_views, AuthClient, get_user_mock,
@@ -57,6 +58,21 @@ class TestAdminViewsUnit(unittest.TestCase):
         self.assertEqual(cm3.exception.message,
                          "No category found with this name: %s" % gib)
 
+    @mock.patch("synnefo_admin.admin.tables.AstakosUser")
+    def test_fetch_users(self, user_model):
+        """Test if the owners of a page are fetched with one query."""
+        users = [mock.Mock(uuid="uuid1"), mock.Mock(uuid="uuid2")]
+        user_model.objects.filter.return_value = users
+        rows = [mock.Mock(userid=uuid)
+                for uuid in ("uuid1", "uuid2", "uuid1", None)]
+
+        view = AdminJSONView()
+        self.assertEqual(view.fetch_users(iter(rows)), rows)
+        user_model.objects.filter.assert_called_once_with(
+            uuid__in=set(["uuid1", "uuid2"]))
+        self.assertIs(view.get_user("uuid2"), users[1])
+        self.assertFalse(user_model.objects.get.called)
+
 
 @mock.patch("astakosclient.AstakosClient", new=AstakosClientMock)
 @mock.patch("snf_django.lib.astakos.get_user", new=get_user_mock)
@@ -139,24 +139,7 @@ def issue_commission(request):
     check_is_dict(input_data)
 
     client_key = unicode(request.component_instance)
-    provisions = input_data.get('provisions')
-    if provisions is None:
-        raise BadRequest("Provisions are missing.")
-    if not isinstance(provisions, list):
-        raise BadRequest("Provisions should be a list.")
-
-    provisions = _provisions_to_list(provisions)
-    force = input_data.get('force', False)
-    if not isinstance(force, bool):
-        raise BadRequest('"force" option should be a boolean.')
-
-    auto_accept = input_data.get('auto_accept', False)
-    if not isinstance(auto_accept, bool):
-        raise BadRequest('"auto_accept" option should be a boolean.')
-
-    name = input_data.get('name', "")
-    if not isinstance(name, basestring):
-        raise BadRequest("Commission name should be a string.")
+    provisions, name, force, auto_accept = _commission_to_tuple(input_data)
 
     try:
         result = _issue_commission(clientkey=client_key,
@@ -167,28 +150,92 @@ def issue_commission(request):
         data = {"serial": result}
         status_code = 201
     except (qh_exception.NoCapacityError,
-            qh_exception.NoQuantityError) as e:
+            qh_exception.NoQuantityError,
+            qh_exception.NoHoldingError,
+            qh_exception.InvalidDataError) as e:
+        status_code, data = commissionCF(e)
+
+    return json_response(data, status_code=status_code)
+
+
+def commissionCF(e):
+    if isinstance(e, (qh_exception.NoCapacityError,
+                      qh_exception.NoQuantityError)):
         status_code = 413
         body = {"message": e.message,
                 "code": status_code,
                 "data": e.data,
                 }
-        data = {"overLimit": body}
-    except qh_exception.NoHoldingError as e:
+        return status_code, {"overLimit": body}
+    if isinstance(e, qh_exception.NoHoldingError):
         status_code = 404
         body = {"message": e.message,
                 "code": status_code,
                 "data": e.data,
                 }
-        data = {"itemNotFound": body}
-    except qh_exception.InvalidDataError as e:
+        return status_code, {"itemNotFound": body}
+    if isinstance(e, qh_exception.InvalidDataError):
         status_code = 400
         body = {"message": e.message,
                 "code": status_code,
                 }
-        data = {"badRequest": body}
+        return status_code, {"badRequest": body}
+    raise e
 
-    return json_response(data, status_code=status_code)
+
+def _commission_to_tuple(commission):
+    check_is_dict(commission)
+    provisions = commission.get('provisions')
+    if provisions is None:
+        raise BadRequest("Provisions are missing.")
+    if not isinstance(provisions, list):
+        raise BadRequest("Provisions should be a list.")
+
+    provisions = _provisions_to_list(provisions)
+    force = commission.get('force', False)
+    if not isinstance(force, bool):
+        raise BadRequest('"force" option should be a boolean.')
+
+    auto_accept = commission.get('auto_accept', False)
+    if not isinstance(auto_accept, bool):
+        raise BadRequest('"auto_accept" option should be a boolean.')
+
+    name = commission.get('name', "")
+    if not isinstance(name, basestring):
+        raise BadRequest("Commission name should be a string.")
+
+    return provisions, name, force, auto_accept
+
+
+@csrf_exempt
+@api.api_method(http_method='POST', token_required=True, user_required=False)
+@component_from_token
+@transaction.atomic
+def issue_commissions(request):
+    input_data = utils.get_json_body(request)
+    check_is_dict(input_data)
+
+    client_key = unicode(request.component_instance)
+    commissions = input_data.get('commissions')
+    if commissions is None:
+        raise BadRequest("Commissions are missing.")
+    if not isinstance(commissions, list):
+        raise BadRequest("Commissions should be a list.")
+
+    commissions = [_commission_to_tuple(c) for c in commissions]
+    results = qh.issue_commissions(clientkey=client_key,
+                                   commissions=commissions)
+
+    data = []
+    for (provisions, name, force, accept), result in \
+            zip(commissions, results):
+        if isinstance(result, qh_exception.QuotaholderError):
+            status_code, fault = commissionCF(result)
+            data.append(fault)
+        else:
+            data.append({"serial": result, "accepted": accept})
+
+    return json_response({"commissions": data})
 
 
 @transaction.atomic
@@ -18,6 +18,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import ugettext as _
 
 from snf_django.lib.api import faults
+from snf_django.lib.tokencache import invalidate_token
 
 from astakos.im import models
 from astakos.im import functions
@@ -380,6 +381,9 @@ class ActivationBackend(object):
         user.is_active = False
         user.deactivated_reason = reason
         user.save()
+        if user.auth_token:
+            # Do not let the services accept the token from their cache
+            invalidate_token(user.auth_token)
         functions.suspend_user_projects(user, reason=PROJECT_SUSPENSION_REASON)
         logger.info("User deactivated: %s", user.log_display)
         return ActivationResult(self.Result.DEACTIVATED)
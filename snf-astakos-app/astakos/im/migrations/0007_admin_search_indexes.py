@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from snf_django.lib.db import search_indexes
+
+# The fields that the admin dashboard searches, with the expression that
+# Django compares for their lookups, see snf_django.lib.db.search_indexes.
+# The indexes are skipped if the pg_trgm extension is not enabled, and can
+# be created later with 'snf-manage search-indexes-create-astakos'.
+SEARCH_INDEXES = [
+    ("auth", "User", "first_name", "UPPER(%s::text)"),
+    ("auth", "User", "last_name", "UPPER(%s::text)"),
+    ("auth", "User", "email", "UPPER(%s::text)"),
+    ("im", "AstakosUser", "uuid", "UPPER(%s::text)"),
+    ("im", "Project", "id", "UPPER(%s::text)"),
+    ("im", "Project", "realname", "UPPER(%s::text)"),
+    ("im", "Project", "description", "UPPER(%s::text)"),
+    ("im", "Project", "uuid", "UPPER(%s::text)"),
+    ("im", "Project", "homepage", "UPPER(%s::text)"),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    created = search_indexes.create_search_indexes(
+        schema_editor.connection, SEARCH_INDEXES, apps.get_model)
+    if created is None:
+        print(search_indexes.PG_TRGM_WARNING %
+              "search-indexes-create-astakos")
+
+
+def drop_search_indexes(apps, schema_editor):
+    search_indexes.drop_search_indexes(schema_editor.connection,
+                                       SEARCH_INDEXES, apps.get_model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('im', '0006_astakosuser_default_project_data'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
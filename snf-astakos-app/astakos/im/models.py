@@ -28,7 +28,7 @@ from django.db import models
 from astakos.im import transaction
 from django.contrib.auth.models import User, UserManager, Group, Permission
 from django.utils.translation import ugettext as _
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, m2m_changed
 from django.contrib.contenttypes.models import ContentType
 
 from django.db.models import Q
@@ -40,6 +40,7 @@ from django.utils.importlib import import_module
 from django.utils.safestring import mark_safe
 
 from synnefo.lib.utils import dict_merge
+from snf_django.lib.tokencache import invalidate_token
 
 from astakos.im import settings as astakos_settings
 from astakos.im import auth_providers as auth
@@ -571,6 +572,9 @@ class AstakosUser(User):
         else:
             raise ValueError('Could not generate a token')
 
+        if self.auth_token:
+            # Do not let the services accept the old token from their cache
+            invalidate_token(self.auth_token)
         self.auth_token = new_token
         self.auth_token_created = datetime.now()
         self.auth_token_expires = self.auth_token_created + \
@@ -2251,3 +2255,27 @@ def renew_token(sender, instance, **kwargs):
     if not instance.auth_token:
         instance.renew_token()
 pre_save.connect(renew_token, sender=Component)
+
+
+def invalidate_role_tokens(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """Revoke the cached tokens of the users whose groups have changed.
+
+    The groups are the roles in the user info that the services cache for a
+    token.
+
+    """
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        users = [instance.pk]
+    elif pk_set is not None:
+        users = pk_set
+    else:
+        users = instance.user_set.values_list("pk", flat=True)
+    tokens = AstakosUser.objects.filter(pk__in=list(users))\
+        .values_list("auth_token", flat=True)
+    for token in tokens:
+        if token:
+            invalidate_token(token)
+m2m_changed.connect(invalidate_role_tokens, sender=AstakosUser.groups.through)
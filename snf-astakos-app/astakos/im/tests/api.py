@@ -415,6 +415,59 @@ class QuotaAPITest(TransactionTestCase):
                         content_type='application/json', **s1_headers)
         self.assertEqual(r.status_code, 400)
 
+        # batch
+        r = client.get(u('quotas'), **headers)
+        r12 = json.loads(r.content)[user.uuid][resource12['name']]
+
+        def provision(resource, quantity):
+            return {"holder": "user:" + user.uuid,
+                    "source": "project:" + user.uuid,
+                    "resource": resource,
+                    "quantity": quantity}
+
+        batch_request = {"commissions": [
+            {"auto_accept": True,
+             "provisions": [provision(resource12['name'], 1)]},
+            {"provisions": [provision(resource11['name'], 1)]},
+            {"provisions": [provision("non existent", 1)]},
+            {"name": "pending",
+             "provisions": [provision(resource12['name'], 2)]},
+        ]}
+        post_data = json.dumps(batch_request)
+        r = client.post(u('commissions/batch'), post_data,
+                        content_type='application/json', **s1_headers)
+        self.assertEqual(r.status_code, 200)
+        body = json.loads(r.content)["commissions"]
+        self.assertEqual(len(body), 4)
+        self.assertTrue(body[0]["accepted"])
+        self.assertEqual(body[1]["overLimit"]["code"], 413)
+        self.assertEqual(body[2]["itemNotFound"]["code"], 404)
+        self.assertFalse(body[3]["accepted"])
+
+        r = client.get(u('commissions/' + str(body[0]["serial"])),
+                       **s1_headers)
+        self.assertEqual(r.status_code, 404)
+        r = client.get(u('commissions/' + str(body[3]["serial"])),
+                       **s1_headers)
+        self.assertEqual(r.status_code, 200)
+
+        r = client.get(u('quotas'), **headers)
+        base_quota = json.loads(r.content)[user.uuid]
+        self.assertEqual(base_quota[resource11['name']]['usage'], 102)
+        self.assertEqual(base_quota[resource12['name']]['usage'],
+                         r12['usage'] + 3)
+        self.assertEqual(base_quota[resource12['name']]['pending'],
+                         r12['pending'] + 2)
+
+        r = client.post(u('commissions/batch'), json.dumps({}),
+                        content_type='application/json', **s1_headers)
+        self.assertEqual(r.status_code, 400)
+
+        batch_request = {"commissions": [{"provisions": "dummy"}]}
+        r = client.post(u('commissions/batch'), json.dumps(batch_request),
+                        content_type='application/json', **s1_headers)
+        self.assertEqual(r.status_code, 400)
+
 
 class TokensApiTest(TestCase):
     def setUp(self):
@@ -21,7 +21,11 @@ from astakos.im.auth import make_local_user
 from astakos.im.functions import enable_base_project
 from astakos.im.models import AstakosUser
 from snf_django.lib.api import faults
+from snf_django.lib.tokencache import TokenCache
+from snf_django.lib.utils import retrieve_user
+from astakosclient.errors import Unauthorized
 from django.core import mail
+from mock import patch
 
 
 class TestUserActions(TestCase):
@@ -179,6 +183,43 @@ class TestUserActions(TestCase):
         res = activate(self.user1)
         self.assertTrue(res.is_error())
 
+    def test_deactivation_revokes_token(self):
+        """Test that a cached token is rejected after deactivation."""
+        verify(self.user1, self.user1.verification_code)
+        accept(self.user1)
+        token = self.user1.auth_token
+        user_info = {"access": {"user": {"id": self.user1.uuid}}}
+        with patch("snf_django.lib.tokencache._token_cache",
+                   TokenCache(ttl=60)), \
+                patch("snf_django.lib.utils.AstakosClient") as client:
+            authenticate = client.return_value.authenticate
+            authenticate.return_value = user_info
+            self.assertEqual(retrieve_user(token, "http://astakos"),
+                             user_info)
+            # Cached
+            self.assertEqual(retrieve_user(token, "http://astakos"),
+                             user_info)
+            self.assertEqual(authenticate.call_count, 1)
+
+            # Astakos rejects the token of an inactive user
+            authenticate.side_effect = Unauthorized("Invalid token")
+            res = deactivate(self.user1)
+            self.assertFalse(res.is_error())
+            self.assertRaises(Unauthorized, retrieve_user, token,
+                              "http://astakos")
+
+    def test_group_change_revokes_token(self):
+        """Test that a cached token is revoked when the roles change."""
+        cache = TokenCache(ttl=60)
+        token = self.user1.auth_token
+        with patch("snf_django.lib.tokencache._token_cache", cache):
+            cache.set(token, {"access": {}})
+            self.user1.add_group("admins")
+            self.assertEqual(cache.get(token), None)
+            cache.set(token, {"access": {}})
+            self.user1.groups.clear()
+            self.assertEqual(cache.get(token), None)
+
     def test_exceptions(self):
         """Test if exceptions are raised properly."""
         # For an unverified user, run validate_user_action and check if
@@ -64,25 +64,34 @@ def delete_quota(keys):
                                resource=resource).delete()
 
 
-def _get_holdings_for_update(holding_keys, resource=None, delete=False):
-    flt = Q(resource=resource) if resource is not None else Q()
-    holders = set(holder for (holder, source, resource) in holding_keys)
-    objs = Holding.objects.filter(flt, holder__in=holders).order_by('pk')
-    hs = objs.select_for_update()
+HOLDING_LOCK_CHUNK = 1000
 
+
+def _get_holdings_for_update(holding_keys):
+    """Lock and return the holdings with the given keys.
+
+    Only the rows of the requested keys are locked, always in primary key
+    order, so that concurrent transactions that touch the same holdings
+    cannot deadlock.
+
+    """
     keys = set(holding_keys)
-    holdings = {}
-    put_back = []
-    for h in hs:
-        key = h.holder, h.source, h.resource
-        if key in keys:
-            holdings[key] = h
-        else:
-            put_back.append(h)
+    if not keys:
+        return {}
+    holders = set(holder for (holder, source, resource) in keys)
+    resources = set(resource for (holder, source, resource) in keys)
+    candidates = Holding.objects.filter(holder__in=holders,
+                                        resource__in=resources)
+    pks = sorted(pk for (pk, holder, source, resource) in
+                 candidates.values_list('pk', 'holder', 'source', 'resource')
+                 if (holder, source, resource) in keys)
 
-    if delete:
-        objs.delete()
-        Holding.objects.bulk_create(put_back)
+    holdings = {}
+    for i in range(0, len(pks), HOLDING_LOCK_CHUNK):
+        chunk = pks[i:i + HOLDING_LOCK_CHUNK]
+        hs = Holding.objects.filter(pk__in=chunk).order_by('pk')
+        for h in hs.select_for_update():
+            holdings[(h.holder, h.source, h.resource)] = h
     return holdings
 
 
@@ -96,29 +105,29 @@ def _mkProvision(key, quantity):
 
 
 def set_quota(quotas, resource=None):
-    holding_keys = [key for (key, limit) in quotas]
-    holdings = _get_holdings_for_update(
-        holding_keys, resource=resource, delete=True)
-
-    new_holdings = {}
+    limits = {}
     for key, limit in quotas:
-        holder, source, res = key
-        if resource is not None and resource != res:
+        if resource is not None and resource != key[2]:
             continue
-        h = Holding(holder=holder,
-                    source=source,
-                    resource=res,
-                    limit=limit)
+        limits[key] = limit
+    holdings = _get_holdings_for_update(limits.keys())
+
+    new_holdings = []
+    for key, limit in limits.iteritems():
         try:
-            h_old = holdings[key]
-            h.usage_min = h_old.usage_min
-            h.usage_max = h_old.usage_max
-            h.id = h_old.id
+            h = holdings[key]
         except KeyError:
-            pass
-        new_holdings[key] = h
+            holder, source, res = key
+            new_holdings.append(Holding(holder=holder,
+                                        source=source,
+                                        resource=res,
+                                        limit=limit))
+            continue
+        if h.limit != limit:
+            h.limit = limit
+            h.save(update_fields=['limit'])
 
-    Holding.objects.bulk_create(new_holdings.values())
+    Holding.objects.bulk_create(new_holdings)
 
 
 def _merge_same_keys(provisions):
@@ -129,13 +138,10 @@ def _merge_same_keys(provisions):
     return tuples
 
 
-def issue_commission(clientkey, provisions, name="", force=False):
+def _issue_commission(clientkey, provisions, name, force, accept, holdings):
     operations = Operations()
     provisions_to_create = []
 
-    provisions = _merge_same_keys(provisions)
-    keys = [key for (key, value) in provisions]
-    holdings = _get_holdings_for_update(keys)
     try:
         for key, quantity in provisions:
             # Target
@@ -170,9 +176,62 @@ def issue_commission(clientkey, provisions, name="", force=False):
                             source=source,
                             resource=resource,
                             quantity=quantity))
-    Provision.objects.bulk_create(ps)
 
-    return commission.serial
+    if not accept:
+        Provision.objects.bulk_create(ps)
+        return commission.serial
+
+    # Accept the commission right away, without storing its provisions
+    log_datetime = datetime.now()
+    plog = []
+    for pv in ps:
+        h = holdings[pv.holding_key()]
+        if pv.quantity >= 0:
+            finalize(Import, h, pv.quantity)
+        else:  # release
+            finalize(Release, h, -pv.quantity)
+        plog.append(
+            _log_provision(commission, pv, h, log_datetime, 'ACCEPT:'))
+    ProvisionLog.objects.bulk_create(plog)
+    serial = commission.serial
+    commission.delete()
+    return serial
+
+
+def issue_commission(clientkey, provisions, name="", force=False):
+    provisions = _merge_same_keys(provisions)
+    keys = [key for (key, value) in provisions]
+    holdings = _get_holdings_for_update(keys)
+    return _issue_commission(clientkey, provisions, name, force, False,
+                             holdings)
+
+
+def issue_commissions(clientkey, commissions):
+    """Issue many commissions, locking the holdings of all of them once.
+
+    Each commission is a (provisions, name, force, accept) tuple and, if
+    'accept' is set, it is accepted as soon as it is issued. Return a list
+    with the serial of each commission, or the QuotaholderError that it
+    failed with, in the order of 'commissions'. A failed commission does not
+    affect the holdings.
+
+    """
+    commissions = [(_merge_same_keys(provisions), name, force, accept)
+                   for (provisions, name, force, accept) in commissions]
+    keys = [key for (provisions, name, force, accept) in commissions
+            for (key, value) in provisions]
+    holdings = _get_holdings_for_update(keys)
+
+    results = []
+    for provisions, name, force, accept in commissions:
+        try:
+            serial = _issue_commission(clientkey, provisions, name, force,
+                                       accept, holdings)
+        except QuotaholderError as e:
+            results.append(e)
+        else:
+            results.append(serial)
+    return results
 
 
 def _log_provision(commission, provision, holding, log_datetime, reason):
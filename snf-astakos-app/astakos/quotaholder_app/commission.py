@@ -77,12 +77,12 @@ class Import(Operation):
                                   usage=usage_max)
 
         holding.usage_max = new_usage_max
-        holding.save()
+        holding.save(update_fields=['usage_max'])
 
     @classmethod
     def _finalize(cls, holding, quantity):
         holding.usage_min += quantity
-        holding.save()
+        holding.save(update_fields=['usage_min'])
 
 
 class Release(Operation):
@@ -104,12 +104,12 @@ class Release(Operation):
                                   usage=usage_min)
 
         holding.usage_min = new_usage_min
-        holding.save()
+        holding.save(update_fields=['usage_min'])
 
     @classmethod
     def _finalize(cls, holding, quantity):
         holding.usage_max -= quantity
-        holding.save()
+        holding.save(update_fields=['usage_max'])
 
 
 class Operations(object):
@@ -260,3 +260,28 @@ class QuotaholderTest(TestCase):
         r = qh.get_quota(holders=[holder])
         self.assertEqual(r, {(holder, source, resource1): (limit2, 1, 1),
                              (holder, source, resource2): (22, 2, 2)})
+
+        h1 = models.Holding.objects.get(resource=resource1)
+        qh.set_quota([((holder, source, resource1), limit1),
+                      ((holder, source, resource2), limit1),
+                      ((holder, None, resource1), limit1)],
+                     resource=resource1)
+        r = qh.get_quota(holders=[holder])
+        self.assertEqual(r, {(holder, source, resource1): (limit1, 1, 1),
+                             (holder, source, resource2): (22, 2, 2),
+                             (holder, None, resource1): (limit1, 0, 0)})
+        # Holdings are updated in place
+        self.assertEqual(models.Holding.objects.get(
+            holder=holder, source=source, resource=resource1).pk, h1.pk)
+
+    def test_040_lock_keys(self):
+        holder = 'h0'
+        keys = [(holder, 'system', 'r1'), (holder, 'system', 'r2'),
+                (holder, None, 'r1'), ('h1', 'system', 'r1')]
+        qh.set_quota([(key, 10) for key in keys])
+        holdings = qh._get_holdings_for_update(
+            [(holder, None, 'r1'), (holder, 'system', 'r2'),
+             (holder, 'other', 'r2')])
+        self.assertEqual(set(holdings.keys()),
+                         set([(holder, None, 'r1'), (holder, 'system', 'r2')]))
+        self.assertEqual(qh._get_holdings_for_update([]), {})
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010-2017 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the contention of concurrent commissions against one project.
+
+A number of threads issue and accept commissions for the same project
+holder, each thread on its own resource, the way Pithos uploads and
+Cyclades VM creations of the same project do. Commissions on different
+resources lock different holdings, so the throughput should grow with the
+number of threads, unless '--same-resource' is given.
+"""
+
+import os
+import threading
+import uuid
+from optparse import OptionParser
+from time import time
+
+path = os.path.dirname(os.path.realpath(__file__))
+os.environ['SYNNEFO_SETTINGS_DIR'] = path + '/settings'
+os.environ['DJANGO_SETTINGS_MODULE'] = 'synnefo.settings'
+
+import django
+django.setup()
+
+from django.db import close_connection
+
+from astakos.im import transaction
+import astakos.quotaholder_app.callpoint as qh
+
+CLIENTKEY = 'bench'
+
+
+@transaction.atomic
+def set_quota(holder, resources):
+    qh.set_quota([((holder, holder, resource), 2 ** 62)
+                  for resource in resources])
+
+
+@transaction.atomic
+def delete_quota(holder, resources):
+    qh.delete_quota([(holder, holder, resource) for resource in resources])
+
+
+@transaction.atomic
+def issue(holder, resource):
+    provisions = [((holder, holder, resource), 1)]
+    return qh.issue_commission(CLIENTKEY, provisions, name='bench')
+
+
+@transaction.atomic
+def accept(serial):
+    qh.resolve_pending_commission(CLIENTKEY, serial)
+
+
+class CommissionT(threading.Thread):
+    def __init__(self, holder, resource, repeat):
+        self.holder = holder
+        self.resource = resource
+        self.repeat = repeat
+        threading.Thread.__init__(self)
+
+    def run(self):
+        try:
+            for i in xrange(self.repeat):
+                accept(issue(self.holder, self.resource))
+        finally:
+            close_connection()
+
+
+def bench(threads, repeat, same_resource):
+    holder = 'bench-%s' % uuid.uuid4()
+    if same_resource:
+        resources = ['bench.resource']
+    else:
+        resources = ['bench.resource%d' % i for i in range(threads)]
+    set_quota(holder, resources)
+    try:
+        ts = [CommissionT(holder, resources[i % len(resources)], repeat)
+              for i in range(threads)]
+        start = time()
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        elapsed = time() - start
+    finally:
+        delete_quota(holder, resources)
+
+    count = threads * repeat
+    print "%3d threads: %6d commissions in %7.2f s, %8.1f commissions/s" % \
+        (threads, count, elapsed, count / elapsed)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--threads',
+                      dest='threads',
+                      type='int',
+                      action='append',
+                      help="Number of concurrent threads to measure"
+                           " (may be given many times, default=1,2,4,8)")
+    parser.add_option('--repeat',
+                      dest='repeat',
+                      type='int',
+                      default=100,
+                      help="Commissions per thread (default=100)")
+    parser.add_option('--same-resource',
+                      action='store_true',
+                      dest='same_resource',
+                      default=False,
+                      help="Issue all commissions on one resource")
+
+    (options, args) = parser.parse_args()
+
+    for threads in options.threads or [1, 2, 4, 8]:
+        bench(threads, options.repeat, options.same_resource)
+
+
+if __name__ == "__main__":
+    main()
@@ -193,6 +193,10 @@ class AMQPHaighaClient():
 
         logger.debug('Published message %s with id %s', body, mid)
 
+    def basic_publish_batch(self, exchange, messages):
+        for routing_key, body in messages:
+            self.basic_publish(exchange, routing_key, body)
+
     @reconnect_decorator
     def get_confirms(self):
         self.connection.read_frames()
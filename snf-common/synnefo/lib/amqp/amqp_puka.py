@@ -39,16 +39,21 @@ def reconnect_decorator(func):
     """
     Decorator for persistent connection with one or more AMQP brokers.
 
+    Reconnecting opens a new channel, so the generation of the client is
+    increased and the delivery tags of the messages received before are stale.
+
     """
     @wraps(func)
     def wrapper(self, *args, **kwargs):
         try:
             if self.client is None or self.client.sd is None:
+                self.generation += 1
                 self.connect()
             return func(self, *args, **kwargs)
         except (socket_error, spec_exceptions.ConnectionForced) as e:
             self.log.error('Connection Closed while in %s: %s', func.__name__,
                            e)
+            self.generation += 1
             self.connect()
 
     return wrapper
@@ -76,6 +81,10 @@ class AMQPPukaClient(object):
 
         self.connection = None
         self.channel = None
+        self.client = None
+        # Increased on every reconnection. Messages received in a previous
+        # generation cannot be acknowledged, since their channel is closed.
+        self.generation = 0
         self.consumers = {}
         self.unacked = OrderedDict()
         self.unsend = OrderedDict()
@@ -163,6 +172,7 @@ class AMQPPukaClient(object):
 
     @reconnect_decorator
     def reconnect(self, timeout=None):
+        self.generation += 1
         try:
             self.close(timeout=timeout)
         except:
@@ -264,6 +274,27 @@ class AMQPPukaClient(object):
         if self.confirms:
             self.get_confirms()
 
+    @reconnect_decorator
+    def basic_publish_batch(self, exchange, messages):
+        """Publish a batch of (routing_key, body) messages.
+
+        Like 'basic_publish_multi', but each message has its own routing key
+        and publisher confirmations are only waited for when more than
+        'confirm_buffer' messages are unacked.
+
+        """
+        for routing_key, body in messages:
+            self.unsend[body] = (exchange, routing_key)
+
+        for routing_key, body in messages:
+            self._publish(exchange, routing_key, body, headers={})
+            self.unsend.pop(body)
+
+        self.flush_buffer()
+
+        if self.confirms and len(self.unacked) >= self.confirm_buffer:
+            self.get_confirms()
+
     def _publish(self, exchange, routing_key, body, headers={}):
         # Persisent messages by default!
         headers['delivery_mode'] = 2
@@ -342,6 +373,7 @@ class AMQPPukaClient(object):
         def handle_delivery(promise, msg):
             """Hide promises and messages without body"""
             if 'body' in msg:
+                msg['generation'] = self.generation
                 callback(self, msg)
             else:
                 self.log.debug("Message without body %s" % msg)
@@ -386,13 +418,28 @@ class AMQPPukaClient(object):
         else:
             return result
 
+    def _is_stale(self, message):
+        """Check if a message was received before the last reconnection.
+
+        The broker redelivers such a message, so it must not be acknowledged
+        with the delivery tag of the closed channel.
+
+        """
+        if message.get('generation', self.generation) == self.generation:
+            return False
+        self.log.debug("Ignoring stale delivery tag %s",
+                       message.get('delivery_tag'))
+        return True
+
     @reconnect_decorator
     def basic_ack(self, message):
-        self.client.basic_ack(message)
+        if not self._is_stale(message):
+            self.client.basic_ack(message)
 
     @reconnect_decorator
     def basic_nack(self, message):
-        self.client.basic_ack(message)
+        if not self._is_stale(message):
+            self.client.basic_ack(message)
 
     @reconnect_decorator
     def basic_reject(self, message, requeue=False):
@@ -402,7 +449,8 @@ class AMQPPukaClient(object):
         with the queue, the message will be routed to the dead letter exchange.
 
         """
-        self.client.basic_reject(message, requeue=requeue)
+        if not self._is_stale(message):
+            self.client.basic_reject(message, requeue=requeue)
 
     def close(self, timeout=None):
         """Check that messages have been send and close the connection."""
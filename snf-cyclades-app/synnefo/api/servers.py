@@ -15,6 +15,7 @@
 
 from django.conf import settings
 from django.conf.urls import patterns
+from django.db.models import Max, Prefetch
 
 from synnefo.db import transaction
 from django.http import HttpResponse
@@ -31,7 +32,9 @@ from synnefo.lib.services import get_service_path
 from synnefo.api import util
 from synnefo.api.util import (VM_PASSWORD_CACHE, feature_enabled, check_tag,
                               make_tag, COMPUTE_API_TAG_USER_PREFIX)
-from synnefo.db.models import (VirtualMachine, VirtualMachineMetadata)
+from synnefo.db.models import (VirtualMachine, VirtualMachineMetadata,
+                               VirtualMachineTag, VirtualMachineDiagnostic,
+                               Volume)
 from synnefo.logic import servers, utils as logic_utils, server_attachments
 from synnefo.volume.util import get_volume, snapshots_enabled_for_user
 from synnefo import cyclades_settings
@@ -251,8 +254,13 @@ def vm_to_dict(vm, detail=False):
         metadata = dict((m.meta_key, m.meta_value) for m in vm.metadata.all())
         d['metadata'] = metadata
         prefix = COMPUTE_API_TAG_USER_PREFIX
-        d['tags'] = [db_tag.tag.split(prefix, 1)[1] for db_tag in vm.tags.
-                     filter(tag__startswith=prefix, status='ACTIVE')]
+        # 'user_tags', 'active_volumes' and 'last_diagnostic' are set by
+        # 'prefetch_server_details' when listing servers
+        if hasattr(vm, "user_tags"):
+            db_tags = vm.user_tags
+        else:
+            db_tags = vm.tags.filter(tag__startswith=prefix, status='ACTIVE')
+        d['tags'] = [db_tag.tag.split(prefix, 1)[1] for db_tag in db_tags]
 
         nics = vm.nics.all()
         active_nics = filter(lambda nic: nic.state == "ACTIVE", nics)
@@ -261,11 +269,17 @@ def vm_to_dict(vm, detail=False):
         d['attachments'] = attachments
         d['addresses'] = attachments_to_addresses(attachments)
 
-        d['volumes'] = [v.id for v in vm.volumes.filter(deleted=False)
-                                                .order_by('id')]
+        if hasattr(vm, "active_volumes"):
+            volumes = vm.active_volumes
+        else:
+            volumes = vm.volumes.filter(deleted=False).order_by('id')
+        d['volumes'] = [v.id for v in volumes]
 
         # include the latest vm diagnostic, if set
-        diagnostic = vm.get_last_diagnostic()
+        if hasattr(vm, "last_diagnostic"):
+            diagnostic = vm.last_diagnostic
+        else:
+            diagnostic = vm.get_last_diagnostic()
         if diagnostic:
             d['diagnostics'] = diagnostics_to_dict([diagnostic])
         else:
@@ -287,6 +301,39 @@ def vm_to_dict(vm, detail=False):
     return d
 
 
+def prefetch_server_details(vms):
+    """Fetch the related objects needed by 'vm_to_dict' in bulk.
+
+    Return a list of the VirtualMachine objects of the 'vms' QuerySet, with
+    their NICs, IPs, metadata, user tags, volumes and latest diagnostic
+    fetched in a fixed number of queries, independent of the number of VMs.
+
+    """
+    prefix = COMPUTE_API_TAG_USER_PREFIX
+    user_tags = VirtualMachineTag.objects.filter(tag__startswith=prefix,
+                                                 status="ACTIVE")
+    active_volumes = Volume.objects.filter(deleted=False).order_by("id")
+    vms = list(vms.prefetch_related(
+        "nics__ips", "metadata",
+        Prefetch("tags", queryset=user_tags, to_attr="user_tags"),
+        Prefetch("volumes", queryset=active_volumes,
+                 to_attr="active_volumes")))
+    if not vms:
+        return vms
+
+    # The latest diagnostic of each VM is the one with the greatest ID. The
+    # empty 'order_by' drops the default ordering from the GROUP BY clause.
+    last_ids = VirtualMachineDiagnostic.objects\
+        .filter(machine__in=[vm.id for vm in vms])\
+        .order_by().values("machine").annotate(last_id=Max("id"))
+    last_ids = [d["last_id"] for d in last_ids]
+    diagnostics = VirtualMachineDiagnostic.objects.filter(id__in=last_ids)
+    diagnostics = dict((d.machine_id, d) for d in diagnostics)
+    for vm in vms:
+        vm.last_diagnostic = diagnostics.get(vm.id)
+    return vms
+
+
 def get_server_public_ip(vm_nics, version=4):
     """Get the first public IP address of a server.
 
@@ -408,13 +455,12 @@ def list_servers(request, detail=False):
     #                       overLimit (413)
 
     user_vms = VMPolicy.filter_list(request.credentials)
-    if detail:
-        user_vms = user_vms.prefetch_related("nics__ips", "metadata")
-
     user_vms = utils.filter_modified_since(request, objects=user_vms)
+    user_vms = user_vms.order_by('id')
+    if detail:
+        user_vms = prefetch_server_details(user_vms)
 
-    servers_dict = [vm_to_dict(server, detail)
-                    for server in user_vms.order_by('id')]
+    servers_dict = [vm_to_dict(server, detail) for server in user_vms]
 
     if request.serialization == 'xml':
         data = render_to_string('list_servers.xml', {
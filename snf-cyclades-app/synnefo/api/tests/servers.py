@@ -21,8 +21,11 @@ from copy import deepcopy
 from snf_django.utils.testing import (BaseAPITest, mocked_quotaholder,
                                       override_settings)
 from django.test.utils import override_settings as django_override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from synnefo.db.models import (VirtualMachine, VirtualMachineMetadata,
-                               IPAddress, NetworkInterface, Volume)
+                               IPAddress, NetworkInterface, Volume,
+                               VirtualMachineDiagnostic)
 from synnefo.db import models_factory as mfactory
 from synnefo.userdata import models_factory as keymfactory
 from synnefo.logic.servers import server_created
@@ -113,6 +116,39 @@ class ServerAPITest(ComputeAPITest):
             self.assertEqual(api_vm['status'], get_rsapi_state(db_vm))
             self.assertSuccess(response)
 
+    def _create_detailed_vm(self, userid):
+        vm = mfactory.VirtualMachineFactory(userid=userid)
+        mfactory.IPv4AddressFactory(nic__machine=vm)
+        mfactory.VirtualMachineMetadataFactory(vm=vm)
+        mfactory.VirtualMachineTagFactory(vm=vm)
+        mfactory.VolumeFactory(userid=userid, machine=vm)
+        VirtualMachineDiagnostic.objects.create_debug(vm, message="old")
+        VirtualMachineDiagnostic.objects.create_debug(vm, message="new")
+        return vm
+
+    def test_server_list_detail_queries(self):
+        """Test that the queries do not grow with the number of servers."""
+        user = "detail_user"
+        num_queries = []
+        for _ in range(2):
+            self._create_detailed_vm(user)
+            self._create_detailed_vm(user)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.myget('servers/detail', user)
+            self.assertSuccess(response)
+            num_queries.append(len(queries))
+        self.assertEqual(num_queries[0], num_queries[1])
+
+        servers = json.loads(response.content)['servers']
+        self.assertEqual(len(servers), 4)
+        for api_vm in servers:
+            self.assertEqual(len(api_vm["tags"]), 1)
+            self.assertEqual(len(api_vm["volumes"]), 1)
+            self.assertEqual(len(api_vm["metadata"]), 1)
+            self.assertEqual(len(api_vm["attachments"]), 1)
+            self.assertEqual([d["message"] for d in api_vm["diagnostics"]],
+                             ["new"])
+
     def test_server_detail(self):
         """Test if a server details are returned."""
         db_vm = self.vm2
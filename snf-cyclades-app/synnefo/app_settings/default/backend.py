@@ -48,7 +48,9 @@ BACKEND_FILTER_ALLOCATOR_FILTERS = [
     'synnefo.logic.allocators.filter_default.DefaultFilter'
 ]
 
-# Refresh backend statistics timeout, in minutes, used in backend allocation
+# Refresh backend statistics timeout, in minutes, used in backend allocation.
+# Outdated backends are refreshed in the background, without delaying the
+# allocation.
 BACKEND_REFRESH_MIN = 15
 
 # Maximum number of NICs per Ganeti instance. This value must be less or equal
@@ -50,3 +50,15 @@ DISPATCHER_LOGGING_SETUP = {
 #    'level': 'INFO',
 #   'propagate': False
 #}
+
+# Number of worker processes that handle the messages of the Ganeti
+# backends. Messages for the same instance or network are handled in order by
+# the same worker. With 0, all messages are handled by the main snf-dispatcher
+# process.
+DISPATCHER_WORKERS = 0
+
+# Seconds for which snf-dispatcher holds the build progress messages of the
+# instances, so that only the latest progress of each instance is written
+# to the DB, in batches. Other messages of an instance are still handled
+# in order. With 0, every progress message is handled.
+DISPATCHER_PROGRESS_COALESCE_WINDOW = 0
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db', '0015_vm_tag_feature'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IPPoolSegment',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('index', models.IntegerField()),
+                ('size', models.IntegerField()),
+                ('available_map', models.TextField(default=b'')),
+                ('reserved_map', models.TextField(default=b'')),
+                ('free', models.IntegerField(default=0)),
+                ('pool_table', models.ForeignKey(related_name='segments', to='db.IPPoolTable')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ippoolsegment',
+            unique_together=set([('pool_table', 'index')]),
+        ),
+    ]
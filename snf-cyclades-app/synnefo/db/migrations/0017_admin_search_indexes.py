@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from snf_django.lib.db import search_indexes
+
+# The fields that the admin dashboard searches, with the expression that
+# Django compares for their lookups, see snf_django.lib.db.search_indexes.
+# The indexes are skipped if the pg_trgm extension is not enabled, and can
+# be created later with 'snf-manage search-indexes-create-cyclades'.
+SEARCH_INDEXES = [
+    ("db", "VirtualMachine", "id", "%s::text"),
+    ("db", "VirtualMachine", "name", "UPPER(%s::text)"),
+    ("db", "VirtualMachine", "imageid", "UPPER(%s::text)"),
+    ("db", "Volume", "id", "UPPER(%s::text)"),
+    ("db", "Volume", "name", "UPPER(%s::text)"),
+    ("db", "Volume", "description", "UPPER(%s::text)"),
+    ("db", "Network", "id", "UPPER(%s::text)"),
+    ("db", "Network", "name", "UPPER(%s::text)"),
+    ("db", "IPAddress", "address", "UPPER(%s::text)"),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    created = search_indexes.create_search_indexes(
+        schema_editor.connection, SEARCH_INDEXES, apps.get_model)
+    if created is None:
+        print(search_indexes.PG_TRGM_WARNING %
+              "search-indexes-create-cyclades")
+
+
+def drop_search_indexes(apps, schema_editor):
+    search_indexes.drop_search_indexes(schema_editor.connection,
+                                       SEARCH_INDEXES, apps.get_model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db', '0016_ippool_segments'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
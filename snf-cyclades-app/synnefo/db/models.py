@@ -20,6 +20,7 @@ from django.conf import settings
 from django.db import models
 
 import utils
+import ipaddr
 from contextlib import contextmanager
 from hashlib import sha1
 from snf_django.lib.api import faults
@@ -818,10 +819,11 @@ class Subnet(models.Model):
         return msg % (self.id, self.network_id, self.cidr)
 
     def get_ip_pools(self, locked=True):
-        ip_pools = self.ip_pools
+        ip_pools = self.ip_pools.order_by("id")
         if locked:
             ip_pools = ip_pools.select_for_update()
-        return map(lambda ip_pool: ip_pool.pool, ip_pools.all())
+        return map(lambda ip_pool: ip_pool.load_pool(locked=locked),
+                   ip_pools.all())
 
 
 class BackendNetwork(models.Model):
@@ -947,10 +949,8 @@ class IPAddress(models.Model):
         """Release the IPv4 address."""
         if self.ipversion == 4:
             for pool_row in self.subnet.ip_pools.all():
-                ip_pool = pool_row.pool
-                if ip_pool.contains(self.address):
-                    ip_pool.put(self.address)
-                    ip_pool.save()
+                if pool_row.contains(self.address):
+                    pool_row.release(self.address)
                     return
             log.error("Cannot release address %s of NIC %s. Address does not"
                       " belong to any of the IP pools of the subnet %s !",
@@ -1127,6 +1127,14 @@ class MacPrefixPoolTable(PoolTable):
 
 
 class IPPoolTable(PoolTable):
+    """Pool of the IPv4 addresses of a subnet.
+
+    The maps of the pool are stored in fixed-size segments (IPPoolSegment),
+    so that allocating or releasing an address locks and updates only the
+    segment of the address. Pools that have not been split into segments
+    yet keep their maps in the row, and are split on their next save.
+
+    """
     manager = pools.IPPool
 
     subnet = models.ForeignKey('Subnet', related_name="ip_pools",
@@ -1139,6 +1147,183 @@ class IPPoolTable(PoolTable):
     def __unicode__(self):
         return u"<IPv4AdressPool, Subnet: %s>" % self.subnet_id
 
+    @property
+    def pool(self):
+        return self.load_pool()
+
+    def load_pool(self, locked=False):
+        """Return the manager of the whole pool.
+
+        If 'locked' is set, the segments of the pool are locked, so that the
+        pool can be modified.
+
+        """
+        segments = self.segments.order_by("index")
+        if locked:
+            segments = segments.select_for_update()
+        segments = list(segments)
+        if segments:
+            self.available_map = pools.join_segment_maps(
+                [segment.available_map for segment in segments])
+            self.reserved_map = pools.join_segment_maps(
+                [segment.reserved_map for segment in segments])
+        return self.manager(self)
+
+    def save(self, *args, **kwargs):
+        maps = None
+        if self.available_map:
+            maps = (self.available_map, self.reserved_map)
+            self.available_map = ""
+            self.reserved_map = ""
+        super(IPPoolTable, self).save(*args, **kwargs)
+        if maps is not None:
+            self._save_segments(*maps)
+
+    def _save_segments(self, available_map, reserved_map):
+        """Store the maps of the pool to its segments.
+
+        Only the segments whose maps have changed are updated.
+
+        """
+        segments = dict((segment.index, segment) for segment in
+                        self.segments.select_for_update())
+        new_segments = []
+        maps = pools.split_pool_maps(available_map, reserved_map, self.size)
+        for index, (size, available, reserved, free) in enumerate(maps):
+            segment = segments.pop(index, None)
+            if segment is None:
+                new_segments.append(
+                    IPPoolSegment(pool_table=self, index=index, size=size,
+                                  available_map=available,
+                                  reserved_map=reserved, free=free))
+            elif (segment.size != size or
+                  segment.available_map != available or
+                  segment.reserved_map != reserved):
+                IPPoolSegment.objects.filter(id=segment.id)\
+                                     .update(size=size,
+                                             available_map=available,
+                                             reserved_map=reserved,
+                                             free=free)
+        IPPoolSegment.objects.bulk_create(new_segments)
+        if segments:
+            IPPoolSegment.objects.filter(
+                id__in=[stale.id for stale in segments.values()]).delete()
+
+    def contains(self, address):
+        try:
+            self._get_index(address)
+        except pools.InvalidValue:
+            return False
+        return True
+
+    def _get_index(self, address):
+        try:
+            addr = ipaddr.IPAddress(address)
+        except ValueError:
+            raise pools.InvalidValue("Invalid IP address")
+        net = ipaddr.IPNetwork(self.subnet.cidr)
+        index = int(addr) - int(net.network) - int(self.offset)
+        if addr not in net or index < 0 or index >= self.size:
+            raise pools.InvalidValue("%s does not belong to pool." % address)
+        return index
+
+    def _get_segment(self, address):
+        """Return the locked segment that contains an address."""
+        index = self._get_index(address) // pools.SEGMENT_SIZE
+        return self.segments.select_for_update().get(index=index)
+
+    def _update_pool(self, action):
+        """Lock and update the whole pool, e.g. to split it to segments."""
+        pool_row = IPPoolTable.objects.select_for_update().get(id=self.id)
+        pool = pool_row.load_pool(locked=True)
+        value = action(pool)
+        pool.save()
+        return value
+
+    def allocate(self, address=None):
+        """Allocate an address, or the first available one, from the pool.
+
+        Only the segment of the address is locked. Without an address, the
+        segments are tried in order, skipping the ones that have no
+        available addresses, according to their 'free' count.
+
+        """
+        if not self.segments.exists():
+            return self._update_pool(lambda pool: pool.get(value=address))
+        if address is not None:
+            pool = self._get_segment(address).pool
+            value = pool.get(value=address)
+            pool.save()
+            return value
+        segment_ids = self.segments.filter(free__gt=0).order_by("index")\
+                                   .values_list("id", flat=True)
+        for segment_id in segment_ids:
+            pool = self.segments.select_for_update().get(id=segment_id).pool
+            if pool.empty():
+                # Allocated by a concurrent transaction
+                continue
+            value = pool.get()
+            pool.save()
+            return value
+        raise pools.EmptyPool
+
+    def release(self, address, external=False):
+        """Return an address to the pool, locking only its segment."""
+        if not self.segments.exists():
+            return self._update_pool(
+                lambda pool: pool.put(address, external=external))
+        pool = self._get_segment(address).pool
+        pool.put(address, external=external)
+        pool.save()
+
+
+class IPPoolSegment(models.Model):
+    """A fixed-size segment of an IPPoolTable.
+
+    The segment provides the attributes of a pool table for its range of
+    addresses, so that it can be managed by an IPPool.
+
+    """
+    pool_table = models.ForeignKey(IPPoolTable, related_name="segments",
+                                   on_delete=models.CASCADE)
+    index = models.IntegerField(null=False)
+    size = models.IntegerField(null=False)
+    available_map = models.TextField(default="", null=False)
+    reserved_map = models.TextField(default="", null=False)
+    # Number of available addresses, to skip full segments when allocating
+    free = models.IntegerField(null=False, default=0)
+
+    class Meta:
+        unique_together = ("pool_table", "index")
+
+    def __str__(self):
+        return self.__unicode__()
+
+    def __unicode__(self):
+        return u"<IPv4AdressPoolSegment %s, Subnet: %s>" % \
+            (self.index, self.pool_table.subnet_id)
+
+    @property
+    def subnet(self):
+        return self.pool_table.subnet
+
+    @property
+    def base(self):
+        return self.pool_table.base
+
+    @property
+    def offset(self):
+        return self.pool_table.offset + self.index * pools.SEGMENT_SIZE
+
+    @property
+    def pool(self):
+        return pools.IPPool(self)
+
+    def save(self, *args, **kwargs):
+        self.free = pools.count_available(self.available_map,
+                                          self.reserved_map, self.size)
+        super(IPPoolSegment, self).save(*args, **kwargs)
+
 
 @contextmanager
 def pooled_rapi_client(obj):
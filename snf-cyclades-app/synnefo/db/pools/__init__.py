@@ -20,6 +20,10 @@ import ipaddr
 AVAILABLE = True
 UNAVAILABLE = False
 
+# Number of values in each segment of a segmented pool. Must be a multiple of
+# 8, so that only the last segment of a pool is padded.
+SEGMENT_SIZE = 1024
+
 
 class PoolManager(object):
     """PoolManager for DB PoolTable models.
@@ -247,6 +251,46 @@ def _bitarray_from_string(bitarray_):
 def _bitarray_to_string(bitarray_):
     return b64encode(bitarray_.tobytes())
 
+
+def join_segment_maps(segment_maps):
+    """Join the maps of consecutive segments to the map of the whole pool."""
+    ba = bitarray()
+    for segment_map in segment_maps:
+        ba.frombytes(b64decode(segment_map))
+    return _bitarray_to_string(ba)
+
+
+def split_pool_maps(available_map, reserved_map, pool_size,
+                    segment_size=SEGMENT_SIZE):
+    """Split the maps of a pool to the maps of its segments.
+
+    Return a (size, available_map, reserved_map, free) tuple for each
+    segment, where 'free' is the number of available values in the segment.
+    The padding of the pool ends up in its last segment.
+
+    """
+    assert(segment_size % 8 == 0)
+    available = _bitarray_from_string(available_map)
+    reserved = _bitarray_from_string(reserved_map)
+    segments = []
+    for start in xrange(0, pool_size, segment_size):
+        end = start + segment_size
+        size = min(segment_size, pool_size - start)
+        free = (available[start:end] & reserved[start:end])[:size]\
+            .count(AVAILABLE)
+        segments.append((size,
+                         _bitarray_to_string(available[start:end]),
+                         _bitarray_to_string(reserved[start:end]),
+                         free))
+    return segments
+
+
+def count_available(available_map, reserved_map, size):
+    """Return the number of available values of a pool, given its maps."""
+    pool = (_bitarray_from_string(available_map) &
+            _bitarray_from_string(reserved_map))
+    return pool[:size].count(AVAILABLE)
+
 ##
 ## Custom pools
 ##
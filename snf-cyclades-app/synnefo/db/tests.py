@@ -26,7 +26,8 @@ from synnefo.db.pools.tests import *
 from synnefo.db.models import *
 
 from synnefo.db import models_factory as mfact
-from synnefo.db.pools import IPPool, EmptyPool
+from synnefo.db.pools import (IPPool, EmptyPool, ValueNotAvailable,
+                              InvalidValue)
 from synnefo.db import transaction as cyclades_transaction
 
 from django.db import IntegrityError
@@ -200,6 +201,32 @@ class NetworkTest(TestCase):
         pool = net1.get_ip_pools()[0]
         self.assertTrue(pool.is_available('192.168.2.12'))
 
+    def test_segmented_pool(self):
+        net1 = mfact.NetworkWithSubnetFactory(subnet__cidr='10.0.0.0/21',
+                                              subnet__pool__size=2045)
+        pool_row = net1.subnets.get(ipversion=4).ip_pools.get()
+        self.assertFalse(pool_row.segments.exists())
+        # The first allocation splits the pool to segments
+        self.assertEqual(pool_row.allocate(), '10.0.0.2')
+        self.assertEqual(pool_row.allocate('10.0.5.3'), '10.0.5.3')
+        segments = list(pool_row.segments.order_by("index"))
+        self.assertEqual([s.size for s in segments], [1024, 1021])
+        self.assertEqual([s.free for s in segments], [1023, 1020])
+        pool = net1.get_ip_pools()[0]
+        self.assertFalse(pool.is_available('10.0.5.3'))
+        self.assertEqual(pool.count_available(), 2043)
+        self.assertRaises(ValueNotAvailable, pool_row.allocate, '10.0.0.2')
+        self.assertRaises(InvalidValue, pool_row.allocate, '10.0.8.2')
+        pool_row.release('10.0.5.3')
+        self.assertEqual(pool_row.segments.get(index=1).free, 1021)
+        self.assertTrue(net1.get_ip_pools()[0].is_available('10.0.5.3'))
+        # Full segments are skipped
+        pool = pool_row.segments.get(index=0).pool
+        while not pool.empty():
+            pool.get()
+        pool.save()
+        self.assertEqual(pool_row.allocate(), '10.0.4.2')
+
 
 class BackendNetworkTest(TestCase):
     def test_mac_prefix(self):
@@ -1529,6 +1529,26 @@ def get_instances(backend, bulk=True):
         return c.GetInstances(bulk=bulk)
 
 
+# Status of a field with a normal value, in the results of a Ganeti query
+QUERY_RS_NORMAL = 0
+
+
+def query_instances(backend, fields):
+    """Get only the given fields of the instances of a backend.
+
+    Yield a dict for each instance, mapping the fields to their values.
+    Fields that have no value for an instance, e.g. hypervisor parameters of
+    another hypervisor, are left out.
+
+    """
+    with pooled_rapi_client(backend) as c:
+        result = c.Query("instance", fields)
+    names = [field["name"] for field in result["fields"]]
+    for row in result["data"]:
+        yield dict((name, value) for name, (status, value) in zip(names, row)
+                   if status == QUERY_RS_NORMAL)
+
+
 def get_nodes(backend, bulk=True):
     with pooled_rapi_client(backend) as c:
         return c.GetNodes(bulk=bulk)
@@ -1615,7 +1635,9 @@ def get_available_disk_templates(backend):
 def update_backend_disk_templates(backend):
     disk_templates = get_available_disk_templates(backend)
     backend.disk_templates = disk_templates
-    backend.save()
+    # Do not overwrite the resources that are concurrently reserved by
+    # allocations, which do not lock the backend
+    backend.save(update_fields=["disk_templates", "hash"])
 
 
 #
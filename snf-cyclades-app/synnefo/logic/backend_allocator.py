@@ -15,9 +15,12 @@
 
 import logging
 import datetime
+import threading
 from django.utils import importlib
 
 from django.conf import settings
+from django.db import connections
+from django.db.models import F
 from synnefo.db.models import Backend
 from synnefo.logic import backend as backend_mod
 
@@ -36,9 +39,11 @@ class BackendAllocator():
     def allocate(self, userid, project, flavor):
         """Allocate a vm of the specified flavor to a backend.
 
-        Warning!!: An explicit commit is required after calling this function,
-        in order to release the locks acquired by the get_available_backends
-        function.
+        The backends are not locked. The allocation strategy runs on a
+        snapshot of the backend statistics, and the resources of the chosen
+        backend are reserved with a conditional update of its row. If the
+        resources of the chosen backend have been used up by a concurrent
+        allocation, the next best backend is tried.
 
         """
 
@@ -59,36 +64,37 @@ class BackendAllocator():
         backends = get_available_backends()
 
         # Remove unnecessary backends based on the filtering strategy
-        filtered_backends = self.strategy_mod.filter_backends(backends, vm)
+        backends = self.strategy_mod.filter_backends(backends, vm)
 
-        # Lock the backends that may host the VM
-        backend_ids = [b.pk for b in filtered_backends]
-        backends = list(Backend.objects.select_for_update()
-                        .filter(pk__in=backend_ids))
-
-        # Note: Is this really needed to be performed every time ?
-        # Perhaps we could have a backend-synchronize command for these ?
         # Update the disk_templates if there are empty.
         update_backends_disk_templates(backends)
         backends = filter_backends_by_disk_template(backends, flavor)
 
-        # Update the backend stats if it is needed
+        # Refresh the outdated backend stats, without waiting for them
         refresh_backends_stats(backends)
 
-        if not backends:
-            return None
-
         # Find the best backend to host the vm, based on the allocation
-        # strategy
-        backend = self.strategy_mod.allocate(backends, vm)
-
-        log.info("Allocated VM %r, in backend %s", vm, backend)
+        # strategy, and reserve its resources
+        candidates = list(backends)
+        while candidates:
+            backend = self.strategy_mod.allocate(candidates, vm)
+            if reserve_backend_resources(backend, vm):
+                log.info("Allocated VM %r, in backend %s", vm, backend)
+                return backend
+            candidates.remove(backend)
+
+        # None of the backends has enough free resources, according to the
+        # conservative stats in DB. Since a backend may actually be able to
+        # host the vm, fall back to reducing the resources of the best one.
+        candidates = list(backends)
+        while candidates:
+            backend = self.strategy_mod.allocate(candidates, vm)
+            if reduce_backend_resources(backend, vm):
+                log.info("Allocated VM %r, in backend %s", vm, backend)
+                return backend
+            candidates.remove(backend)
 
-        # Reduce the free resources of the selected backend by the size of
-        # the vm
-        reduce_backend_resources(backend, vm)
-
-        return backend
+        return None
 
 
 def get_available_backends():
@@ -138,28 +144,75 @@ def flavor_disk(flavor):
         return flavor.disk * 1024
 
 
+def reserve_backend_resources(backend, vm):
+    """Reserve the resources of a vm in a backend.
+
+    The free resources of the backend are reduced by the size of the vm, only
+    if the backend is still available and can host the vm, as checked by the
+    default allocator filter. Only the row of the backend is locked, by the
+    update itself. Return whether the resources were reserved.
+
+    """
+    # Like the allocator filter, consider each VM having 4 virtual CPUs and a
+    # max vcpu/cpu ratio of 3, i.e. require 3 * ctotal > 4 * (pinst_cnt + 1).
+    # For non-negative integers, this is the same as comparing ctotal with
+    # the truncated integer division of the database.
+    updated = Backend.objects.filter(pk=backend.pk, offline=False,
+                                     drained=False, mfree__gt=vm['ram'],
+                                     dfree__gt=vm['disk'],
+                                     ctotal__gt=(F('pinst_cnt') + 1) * 4 / 3)\
+                             .update(mfree=F('mfree') - vm['ram'],
+                                     dfree=F('dfree') - vm['disk'],
+                                     pinst_cnt=F('pinst_cnt') + 1)
+    if not updated:
+        return False
+
+    backend.mfree -= vm['ram']
+    backend.dfree -= vm['disk']
+    backend.pinst_cnt += 1
+    return True
+
+
 def reduce_backend_resources(backend, vm):
     """ Conservatively update the resources of a backend.
 
     Reduce the free resources of the backend by the size of the of the vm that
-    will host. This is an underestimation of the backend capabilities.
+    will host. This is an underestimation of the backend capabilities. Return
+    False if the backend is not available anymore.
 
     """
 
+    backends = Backend.objects.filter(pk=backend.pk, offline=False,
+                                      drained=False)
+    # The first update locks the row, so the next ones see its latest values
+    if not backends.update(pinst_cnt=F('pinst_cnt') + 1):
+        return False
+    for field, size in (('mfree', vm['ram']), ('dfree', vm['disk'])):
+        if not backends.filter(**{field + '__gte': size})\
+                       .update(**{field: F(field) - size}):
+            backends.update(**{field: 0})
+
     new_mfree = backend.mfree - vm['ram']
     new_dfree = backend.dfree - vm['disk']
     backend.mfree = 0 if new_mfree < 0 else new_mfree
     backend.dfree = 0 if new_dfree < 0 else new_dfree
     backend.pinst_cnt += 1
+    return True
+
 
-    backend.save()
+# IDs of the backends whose stats are being refreshed by this process
+_refreshing_backends = set()
+_refreshing_lock = threading.Lock()
 
 
 def refresh_backends_stats(backends):
     """ Refresh the statistics of the backends.
 
     Set db backend state to the actual state of the backend, if
-    BACKEND_REFRESH_MIN time has passed.
+    BACKEND_REFRESH_MIN time has passed. The stats are refreshed by background
+    threads, so that the allocation does not wait for the backends. The
+    periodic 'snf-manage backend-update-status --interval' keeps the stats
+    fresh without relying on allocations.
 
     """
 
@@ -167,9 +220,47 @@ def refresh_backends_stats(backends):
     delta = datetime.timedelta(minutes=settings.BACKEND_REFRESH_MIN)
     for b in backends:
         if now > b.updated + delta:
+            with _refreshing_lock:
+                if b.pk in _refreshing_backends:
+                    continue
+                _refreshing_backends.add(b.pk)
             log.debug("Updating resources of backend %r. Last Updated %r",
                       b, b.updated)
-            backend_mod.update_backend_resources(b)
+            t = threading.Thread(target=_refresh_backend_stats, args=(b.pk,))
+            t.daemon = True
+            t.start()
+
+
+def _refresh_backend_stats(backend_id):
+    try:
+        update_backend_stats(backend_id)
+    except Exception:
+        log.exception("Failed to update resources of backend %s", backend_id)
+    finally:
+        with _refreshing_lock:
+            _refreshing_backends.discard(backend_id)
+        for connection in connections.all():
+            connection.close()
+
+
+def update_backend_stats(backend_id):
+    """Update the disk templates and the resources of a backend.
+
+    The backend is queried without holding any lock, so that allocations are
+    not blocked by the RAPI calls. The new stats are then applied with a
+    single update of the row.
+
+    """
+    backend = Backend.objects.get(pk=backend_id)
+    disk_templates = backend_mod.get_available_disk_templates(backend)
+    resources = backend_mod.get_physical_resources(backend)
+    resources["updated"] = datetime.datetime.now()
+    Backend.objects.filter(pk=backend_id)\
+                   .update(disk_templates=disk_templates, **resources)
+    backend.disk_templates = disk_templates
+    for field, value in resources.items():
+        setattr(backend, field, value)
+    return backend
 
 
 def get_backend_for_user(userid):
@@ -321,6 +321,50 @@ def update_build_progress(vm, msg, event_time, atomic_context=None):
               msg['instance'])
 
 
+def update_build_progress_batch(client, messages):
+    """Process a batch of 'image-copy-progress' messages.
+
+    The build progress of all the instances is updated in one transaction.
+    If the batch fails, e.g. due to a malformed message, its messages are
+    processed one by one by 'update_build_progress'.
+
+    """
+    try:
+        msgs = [json.loads(message["body"]) for message in messages]
+        _update_build_progress_batch(msgs)
+    except Exception as e:
+        log.warning("Failed to process a batch of %d progress messages: %s."
+                    " Processing them one by one.", len(messages), e)
+        for message in messages:
+            update_build_progress(client, message)
+        return
+    for message in messages:
+        client.basic_ack(message)
+
+
+@transaction.atomic
+def _update_build_progress_batch(msgs):
+    log.debug("Processing batch of ganeti-create-progress msgs: %s", msgs)
+    progress = {}
+    for msg in msgs:
+        if msg["type"] != "image-copy-progress":
+            raise ValueError("Message is of unexpected type %s" % msg["type"])
+        vm_id = utils.id_from_instance_name(msg["instance"])
+        progress[vm_id] = (merge_time(msg["event_time"]), msg["progress"])
+
+    # Lock the VMs in a fixed order, to avoid deadlocks
+    vms = VirtualMachine.objects.select_for_update()\
+                                .filter(id__in=progress.keys(), deleted=False)\
+                                .order_by("id")
+    for vm in vms:
+        event_time, percentage = progress[vm.id]
+        if vm.backendtime and event_time <= vm.backendtime:
+            continue
+        backend_mod.process_create_progress(vm, event_time, percentage)
+
+    log.info("Processed %d ganeti-create-progress msgs", len(msgs))
+
+
 @handle_message_delivery
 @transaction.atomic()
 def update_cluster(msg):
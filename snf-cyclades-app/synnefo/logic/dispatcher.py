@@ -39,6 +39,10 @@ import time
 
 import json
 import socket
+import itertools
+import multiprocessing
+from Queue import Empty
+from collections import OrderedDict
 import traceback
 import daemon
 import daemon.runner
@@ -87,22 +91,335 @@ CHECK_TOOL_ACK_TIMEOUT = 10
 CHECK_TOOL_REPORT_TIMEOUT = 30
 # Seconds that the request queue will exist while there are no consumers.
 REQUEST_QUEUE_TTL = 600
+# Seconds for which the multi-worker snf-dispatcher will wait for a message,
+# before collecting the results of its workers.
+WORKER_POLL_TIMEOUT = 0.5
+# Seconds between two reports of the statistics of the workers in the log.
+WORKER_STATS_INTERVAL = 60
+# Messages that may be unacknowledged per queue and per worker.
+PREFETCH_COUNT = 5
+# Maximum number of coalesced build progress messages that are held, before
+# being processed in one batch.
+PROGRESS_BATCH_SIZE = 50
 
 
 def get_hostname():
     return socket.gethostbyaddr(socket.gethostname())[0]
 
 
+def get_message_key(body):
+    """Return the name of the Ganeti object that a message refers to.
+
+    Messages with the same key are processed by the same worker, in the order
+    that they were received.
+
+    """
+    try:
+        msg = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(msg, dict):
+        return None
+    return msg.get("instance") or msg.get("network") or msg.get("cluster")
+
+
+def get_progress_info(body):
+    """Return the instance of a message and the event time of its progress.
+
+    The event time is returned only for build progress messages, which may
+    be coalesced.
+
+    """
+    try:
+        msg = json.loads(body)
+    except ValueError:
+        return None, None
+    if not isinstance(msg, dict):
+        return None, None
+    instance = msg.get("instance")
+    if instance is None or msg.get("type") != "image-copy-progress":
+        return instance, None
+    return instance, msg.get("event_time")
+
+
+class ProgressCoalescer(object):
+    """Keep only the latest build progress message of each instance.
+
+    Build progress messages are held for up to 'window' seconds. A newer
+    progress message of the same instance replaces the held one, which is
+    acknowledged without being processed, since only the latest progress is
+    stored in the DB. The held messages are then given in one batch to
+    'process_batch'.
+
+    Any other message of an instance, e.g. an op-status message, first
+    flushes the held progress of the instance, so that the messages of each
+    instance are still processed in the order they were received.
+
+    """
+    def __init__(self, window, process_batch, batch_size=PROGRESS_BATCH_SIZE):
+        self.window = window
+        self.process_batch = process_batch
+        self.batch_size = batch_size
+        # instance -> (message, event time)
+        self.held = OrderedDict()
+        self.hold_time = None
+        self.coalesced = 0
+
+    def wrap(self, callback, coalesce=False):
+        """Return a consumer callback that goes through the coalescer.
+
+        Only the progress messages of 'coalesce' callbacks are held.
+
+        """
+        def consume(client, message):
+            instance, event_time = get_progress_info(message["body"])
+            if coalesce and event_time is not None:
+                self.hold(client, instance, message, event_time)
+                return
+            if instance is not None:
+                self.flush(client, instance)
+            callback(client, message)
+        return consume
+
+    def hold(self, client, instance, message, event_time):
+        previous = self.held.get(instance)
+        if previous is not None:
+            self.coalesced += 1
+            if previous[1] > event_time:
+                # Redelivered or reordered message
+                client.basic_ack(message)
+                return
+            client.basic_ack(previous[0])
+        elif not self.held:
+            self.hold_time = time.time()
+        self.held[instance] = (message, event_time)
+        if len(self.held) >= self.batch_size:
+            self.flush(client)
+
+    def flush(self, client, instance=None):
+        """Process the held messages, or only those of an instance."""
+        if instance is None:
+            messages = [message for message, _ in self.held.itervalues()]
+            self.held.clear()
+        elif instance in self.held:
+            messages = [self.held.pop(instance)[0]]
+        else:
+            return
+        if messages:
+            self.process_batch(client, messages)
+
+    def flush_expired(self, client):
+        """Process the held messages, if held for more than 'window'."""
+        if self.held and time.time() - self.hold_time >= self.window:
+            self.flush(client)
+
+    def clear(self):
+        """Forget the held messages, which the broker will redeliver."""
+        self.held.clear()
+
+
+class WorkerClient(object):
+    """AMQP client given to the callbacks that run in a worker process.
+
+    The callbacks only acknowledge their messages. The client records the
+    outcome, so that the dispatcher applies it with its own AMQP client.
+
+    """
+    def __init__(self):
+        self.actions = {}
+
+    def basic_ack(self, message):
+        self.actions[message["msg_id"]] = "ack"
+
+    def basic_nack(self, message):
+        self.actions[message["msg_id"]] = "nack"
+
+    def basic_reject(self, message, requeue=False):
+        self.actions[message["msg_id"]] = "reject"
+
+
+def worker_loop(index, inbox, results, generation):
+    """Run the callbacks for the messages dispatched to a worker process.
+
+    Messages dispatched before the current 'generation' are skipped, since
+    the dispatcher has reconnected to AMQP and the broker redelivers them.
+
+    """
+    setproctitle.setproctitle("%s (worker %d)" % (sys.argv[0], index))
+    while True:
+        try:
+            item = inbox.get()
+        except (SystemExit, KeyboardInterrupt):
+            break
+        if item is None:
+            break
+        item_generation, callback, batch, bodies = item
+        if item_generation != generation.value:
+            log.debug("Skipping %d messages dispatched before reconnecting",
+                      len(bodies))
+            continue
+        # See 'Dispatcher.wait'
+        close_connection()
+        client = WorkerClient()
+        messages = [{"body": body, "msg_id": msg_id}
+                    for msg_id, body in bodies]
+        try:
+            if batch:
+                getattr(callbacks, callback)(client, messages)
+            else:
+                getattr(callbacks, callback)(client, messages[0])
+        except Exception as e:
+            log.exception("Caught unexpected exception: %s", e)
+            for msg_id, _ in bodies:
+                client.actions.setdefault(msg_id, "reject")
+        for msg_id, _ in bodies:
+            results.put((index, msg_id, client.actions.get(msg_id)))
+
+
+class DispatcherWorker(object):
+    """A worker process of the dispatcher and its pending messages."""
+
+    def __init__(self, index, results, generation):
+        self.index = index
+        self.results = results
+        self.generation = generation
+        # msg_id -> (message, time the message was dispatched, callback,
+        #            whether the callback processes a batch)
+        self.pending = OrderedDict()
+        self.processed = 0
+        self.start_time = time.time()
+        self.start()
+
+    def start(self):
+        self.inbox = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=worker_loop,
+            args=(self.index, self.inbox, self.results, self.generation))
+        self.process.daemon = True
+        self.process.start()
+
+    def stop(self):
+        self.inbox.put(None)
+        self.process.join(timeout=1)
+
+    def dispatch(self, msg_id, message, callback):
+        self.pending[msg_id] = (message, time.time(), callback, False)
+        self.inbox.put((self.generation.value, callback, False,
+                        [(msg_id, message["body"])]))
+
+    def dispatch_batch(self, msg_ids, messages, callback):
+        """Dispatch messages that the callback processes in one batch."""
+        now = time.time()
+        bodies = []
+        for msg_id, message in zip(msg_ids, messages):
+            self.pending[msg_id] = (message, now, callback, True)
+            bodies.append((msg_id, message["body"]))
+        self.inbox.put((self.generation.value, callback, True, bodies))
+
+    def restart(self):
+        """Restart the worker process and dispatch its pending messages again.
+
+        The pending messages are put in the inbox of the new process before
+        any newer message, so that the messages of each key are still
+        processed in the order they were received. They keep the time they
+        were first dispatched.
+
+        """
+        self.start()
+        for msg_id, (message, _, callback, batch) in \
+                self.pending.items():
+            self.inbox.put((self.generation.value, callback, batch,
+                            [(msg_id, message["body"])]))
+
+    def flush(self):
+        """Forget the pending messages, which the broker will redeliver.
+
+        The messages still in the inbox are skipped by the worker process,
+        because the generation has been increased by the dispatcher.
+
+        """
+        self.pending.clear()
+
+    def complete(self, msg_id):
+        """Return the message that has been processed, if still pending."""
+        try:
+            message = self.pending.pop(msg_id)[0]
+        except KeyError:
+            return None
+        self.processed += 1
+        return message
+
+    def get_stats(self):
+        """Return the lag and the counters of the worker.
+
+        The lag is the age of the oldest message waiting in the worker. The
+        counters are cumulative since the worker was created, so that any
+        caller can compute rates from the difference of two calls, without
+        affecting the other callers.
+
+        """
+        now = time.time()
+        if self.pending:
+            lag = now - self.pending.itervalues().next()[1]
+        else:
+            lag = 0
+        return {"worker": self.index,
+                "pid": self.process.pid,
+                "pending": len(self.pending),
+                "processed": self.processed,
+                "lag": round(lag, 3),
+                "start_time": self.start_time,
+                "time": now}
+
+
+def get_throughput(stats, previous=None):
+    """Return the messages per second processed between two stats of a worker.
+
+    Without 'previous' stats, the average since the worker was created is
+    returned.
+
+    """
+    if previous is None:
+        previous = {"processed": 0, "time": stats["start_time"]}
+    elapsed = stats["time"] - previous["time"]
+    if elapsed <= 0:
+        return 0
+    return round((stats["processed"] - previous["processed"]) / elapsed, 3)
+
+
 class Dispatcher:
     debug = False
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, workers=0, coalesce_window=0):
         self.debug = debug
+        self.workers = []
+        self.coalescer = None
+        if coalesce_window > 0:
+            self.coalescer = ProgressCoalescer(coalesce_window,
+                                               self._process_progress_batch)
+        if workers > 0:
+            # Close the DB connection, so that it is not shared with the
+            # worker processes
+            close_connection()
+            self.results = multiprocessing.Queue()
+            # Increased on every reconnection to AMQP, to flush the inboxes
+            # of the workers
+            self.generation = multiprocessing.Value("i", 0)
+            self.workers = [DispatcherWorker(i, self.results, self.generation)
+                            for i in range(workers)]
+            self.msg_ids = itertools.count()
+            self.stats_time = time.time()
+            # The stats of the workers, when they were last logged
+            self.logged_stats = {}
         self._init()
 
     def wait(self):
         log.info("Waiting for messages..")
         timeout = DISPATCHER_RECONNECT_TIMEOUT
+        poll_timeout = WORKER_POLL_TIMEOUT if self.workers else timeout
+        if self.coalescer is not None:
+            poll_timeout = min(poll_timeout, self.coalescer.window)
+        last_msg_time = time.time()
         while True:
             try:
                 # Close the Django DB connection before processing
@@ -111,14 +428,29 @@ class Dispatcher:
                 # the dispatcher to recover from broken connections
                 # gracefully.
                 close_connection()
-                msg = self.client.basic_wait(timeout=timeout)
-                if not msg:
+                msg = self.client.basic_wait(timeout=poll_timeout)
+                if self.client.generation != self.amqp_generation:
+                    # The client has reconnected on its own, so the broker
+                    # redelivers the pending messages
+                    log.warning("Reconnected to AMQP. Forgetting the pending"
+                                " messages")
+                    self._forget_pending()
+                if self.coalescer is not None:
+                    self.coalescer.flush_expired(self.client)
+                if self.workers:
+                    self._collect_results()
+                if msg:
+                    last_msg_time = time.time()
+                elif time.time() - last_msg_time >= timeout:
                     log.warning("Idle connection for %d seconds. Will connect"
                                 " to a different host. Verify that"
                                 " snf-ganeti-eventd is running!!", timeout)
                     self.client.reconnect(timeout=1)
+                    self._forget_pending()
+                    last_msg_time = time.time()
             except AMQPConnectionError as e:
                 log.error("AMQP connection failed: %s" % e)
+                self._forget_pending()
                 log.warning("Sleeping for %d seconds before retrying to "
                             "connect to an AMQP broker" %
                             DISPATCHER_FAILED_CONNECTION_WAIT)
@@ -144,6 +476,92 @@ class Dispatcher:
         log.info("Clean up AMQP connection before exit")
         self.client.basic_cancel(timeout=1)
         self.client.close(timeout=1)
+        for worker in self.workers:
+            worker.stop()
+
+    def _dispatch(self, callback):
+        """Return a consumer callback that dispatches to the workers.
+
+        Messages are assigned to workers by hashing the name of the instance
+        or network they refer to, which preserves their order per object.
+
+        """
+        def dispatch(client, message):
+            worker = self._get_worker(message["body"])
+            worker.dispatch(self.msg_ids.next(), message, callback)
+        return dispatch
+
+    def _get_worker(self, body):
+        key = get_message_key(body)
+        return self.workers[hash(key) % len(self.workers)]
+
+    def _process_progress_batch(self, client, messages):
+        """Process a batch of coalesced build progress messages."""
+        if not self.workers:
+            callbacks.update_build_progress_batch(client, messages)
+            return
+        batches = OrderedDict()
+        for message in messages:
+            worker = self._get_worker(message["body"])
+            batches.setdefault(worker, []).append(message)
+        for worker, batch in batches.items():
+            msg_ids = [self.msg_ids.next() for message in batch]
+            worker.dispatch_batch(msg_ids, batch,
+                                  "update_build_progress_batch")
+
+    def _collect_results(self):
+        """Acknowledge the messages that the workers have processed."""
+        while True:
+            try:
+                index, msg_id, action = self.results.get_nowait()
+            except Empty:
+                break
+            message = self.workers[index].complete(msg_id)
+            if message is None:
+                continue
+            if action == "ack":
+                self.client.basic_ack(message)
+            elif action == "nack":
+                self.client.basic_nack(message)
+            elif action == "reject":
+                self.client.basic_reject(message)
+
+        for worker in self.workers:
+            if not worker.process.is_alive():
+                log.error("Worker %d (PID: %s) died. Restarting it and"
+                          " dispatching again its %d pending messages",
+                          worker.index, worker.process.pid,
+                          len(worker.pending))
+                worker.restart()
+
+        if time.time() - self.stats_time >= WORKER_STATS_INTERVAL:
+            self.stats_time = time.time()
+            for stats in self.get_worker_stats():
+                previous = self.logged_stats.get(stats["worker"])
+                self.logged_stats[stats["worker"]] = stats
+                log.info("Worker %d: pending %d, processed %d, lag %.3fs,"
+                         " throughput %.3f msg/s", stats["worker"],
+                         stats["pending"], stats["processed"], stats["lag"],
+                         get_throughput(stats, previous))
+
+    def _forget_pending(self):
+        """Forget the pending messages after reconnecting to AMQP.
+
+        The broker will redeliver them, so the workers skip those that are
+        still in their inboxes and the results of the rest are ignored.
+
+        """
+        self.amqp_generation = self.client.generation
+        if self.workers:
+            with self.generation.get_lock():
+                self.generation.value += 1
+        for worker in self.workers:
+            worker.flush()
+        if self.coalescer is not None:
+            self.coalescer.clear()
+
+    def get_worker_stats(self):
+        return [worker.get_stats() for worker in self.workers]
 
     def _init(self):
         log.info("Initializing")
@@ -152,6 +570,7 @@ class Dispatcher:
         self.client = AMQPClient(logger=log_amqp, confirm_buffer=1)
         # Connect to AMQP host
         self.client.connect()
+        self.amqp_generation = self.client.generation
 
         # Declare queues and exchanges
         exchange = settings.EXCHANGE_GANETI
@@ -182,9 +601,18 @@ class Dispatcher:
             self.client.queue_bind(queue=queue, exchange=exchange,
                                    routing_key=routing_key)
 
-            self.client.basic_consume(queue=binding[0],
-                                      callback=callback,
-                                      prefetch_count=5)
+            if self.workers:
+                callback = self._dispatch(binding[3])
+            prefetch_count = PREFETCH_COUNT * max(len(self.workers), 1)
+            if self.coalescer is not None:
+                coalesce = binding[3] == "update_build_progress"
+                callback = self.coalescer.wrap(callback, coalesce=coalesce)
+                if coalesce:
+                    # Let the broker deliver enough messages to fill a batch
+                    prefetch_count = max(prefetch_count,
+                                         2 * self.coalescer.batch_size)
+            self.client.basic_consume(queue=binding[0], callback=callback,
+                                      prefetch_count=prefetch_count)
 
             queue_dl = queues.convert_queue_to_dead(queue)
             exchange_dl = queues.convert_exchange_to_dead(exchange)
@@ -202,15 +630,19 @@ class Dispatcher:
         queue = queues.get_dispatcher_request_queue(hostname, pid)
         self.client.queue_declare(queue=queue, mirrored=True,
                                   ttl=REQUEST_QUEUE_TTL)
-        self.client.basic_consume(queue=queue, callback=handle_request)
+        self.client.basic_consume(
+            queue=queue,
+            callback=lambda client, msg: handle_request(
+                client, msg, self.get_worker_stats()))
         log.debug("Binding %s(%s) to queue %s with handler 'hadle_request'",
                   exchange, routing_key, queue)
 
 
-def handle_request(client, msg):
+def handle_request(client, msg, workers=None):
     """Callback function for handling requests.
 
-    Currently only 'status-check' action is supported.
+    Currently only 'status-check' action is supported. The report includes the
+    statistics of the 'workers', if any.
 
     """
 
@@ -281,7 +713,8 @@ def handle_request(client, msg):
             break
 
     # Send back status report
-    client.basic_publish("", reply_to, json.dumps({"status": status}))
+    client.basic_publish("", reply_to, json.dumps({"status": status,
+                                                   "workers": workers}))
 
 
 def parse_arguments(args):
@@ -315,6 +748,22 @@ def parse_arguments(args):
                            " snf-dispatcher process, that will check"
                            " communication between snf-dispatcher and Ganeti"
                            " backends via AMQP brokers")
+    parser.add_option("-w", "--workers", dest="workers", type="int",
+                      default=settings.DISPATCHER_WORKERS,
+                      help=("Number of worker processes that handle the"
+                            " messages. Messages for the same instance or"
+                            " network are handled in order by the same"
+                            " worker. With 0 all messages are handled by the"
+                            " main process (default: %d)"
+                            % settings.DISPATCHER_WORKERS))
+    parser.add_option("--coalesce-window", dest="coalesce_window",
+                      type="float",
+                      default=settings.DISPATCHER_PROGRESS_COALESCE_WINDOW,
+                      help=("Seconds for which build progress messages are"
+                            " held, so that only the latest progress of each"
+                            " instance is processed. With 0 every message is"
+                            " processed (default: %s)"
+                            % settings.DISPATCHER_PROGRESS_COALESCE_WINDOW))
 
     return parser.parse_args(args)
 
@@ -387,6 +836,15 @@ def check_dispatcher_status(pid_file):
                          bstatus["RAPI"])
         sys.stdout.write("   snf-ganeti-eventd -> AMQP: %s\n" %
                          bstatus["eventd"])
+    workers = json.loads(msg["body"]).get("workers")
+    if workers:
+        sys.stdout.write("Workers:\n")
+        for stats in workers:
+            sys.stdout.write(" * %d (PID: %s): pending %d, processed %d,"
+                             " lag %.3fs, average throughput %.3f msg/s\n"
+                             % (stats["worker"], stats["pid"],
+                                stats["pending"], stats["processed"],
+                                stats["lag"], get_throughput(stats)))
     sys.exit(0)
 
 
@@ -471,13 +929,15 @@ def get_user_confirmation():
     return True
 
 
-def debug_mode():
-    disp = Dispatcher(debug=True)
+def debug_mode(opts):
+    disp = Dispatcher(debug=True, workers=opts.workers,
+                      coalesce_window=opts.coalesce_window)
     disp.wait()
 
 
 def daemon_mode(opts):
-    disp = Dispatcher(debug=False)
+    disp = Dispatcher(debug=False, workers=opts.workers,
+                      coalesce_window=opts.coalesce_window)
     disp.wait()
 
 
@@ -521,7 +981,7 @@ def main():
 
     # Debug mode, process messages without daemonizing
     if opts.debug:
-        debug_mode()
+        debug_mode(opts)
         return
 
     # Create pidfile,
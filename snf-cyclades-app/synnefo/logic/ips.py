@@ -79,12 +79,13 @@ def allocate_ip_from_pools(pool_rows, userid, address=None, floating_ip=False):
     If an address is specified and does not belong to any of the pools,
     InvalidValue is raised.
 
+    The pool rows do not need to be locked, since each allocation locks only
+    the segment of the pool that it updates.
+
     """
     for pool_row in pool_rows:
-        pool = pool_row.pool
         try:
-            value = pool.get(value=address)
-            pool.save()
+            value = pool_row.allocate(address=address)
             subnet = pool_row.subnet
             ipaddress = IPAddress.objects.create(subnet=subnet,
                                                  network=subnet.network,
@@ -114,7 +115,7 @@ def allocate_ip(network, userid, address=None, floating_ip=False):
         raise faults.Conflict("Can not allocate IP while network '%s' is in"
                               " 'SNF:DRAINED' status" % network.id)
 
-    ip_pools = IPPoolTable.objects.select_for_update()\
+    ip_pools = IPPoolTable.objects.select_related("subnet")\
         .filter(subnet__network=network).order_by('id')
     try:
         return allocate_ip_from_pools(ip_pools, userid, address=address,
@@ -139,7 +140,7 @@ def allocate_public_ip(userid, floating_ip=False, backend=None, networks=None):
     be used.
 
     """
-    ip_pool_rows = IPPoolTable.objects.select_for_update()\
+    ip_pool_rows = IPPoolTable.objects.order_by('id')\
         .prefetch_related("subnet__network")\
         .filter(subnet__deleted=False)\
         .filter(subnet__network__deleted=False)\
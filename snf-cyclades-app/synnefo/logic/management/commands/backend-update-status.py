@@ -13,10 +13,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import time
+from optparse import make_option
+
 from snf_django.management.commands import SynnefoCommand
 from synnefo.db.models import Backend
-from synnefo.logic import backend as backend_mod
-from synnefo.db import transaction
+from synnefo.logic.backend_allocator import update_backend_stats
 
 
 HELP_MSG = """Query Ganeti backends and update the status of backend in DB.
@@ -24,16 +26,42 @@ HELP_MSG = """Query Ganeti backends and update the status of backend in DB.
 This command updates:
     * the list of the enabled disk-templates
     * the available resources (disk, memory, CPUs)
+
+With '--interval', the command keeps updating the backends periodically, so
+that server allocations always find fresh backend statistics.
 """
 
 
 class Command(SynnefoCommand):
     help = HELP_MSG
+    option_list = SynnefoCommand.option_list + (
+        make_option("--interval", dest="interval", type="int", default=None,
+                    help="Update the backends every INTERVAL seconds,"
+                         " until interrupted"),
+    )
 
-    @transaction.atomic
     def handle(self, **options):
-        for backend in Backend.objects.select_for_update()\
-                                      .filter(offline=False):
-            backend_mod.update_backend_disk_templates(backend)
-            backend_mod.update_backend_resources(backend)
-            self.stdout.write("Successfully updated backend '%s'\n" % backend)
+        interval = options["interval"]
+        if interval is None:
+            self.update_backends(ignore_errors=False)
+            return
+        while True:
+            self.update_backends(ignore_errors=True)
+            time.sleep(interval)
+
+    def update_backends(self, ignore_errors):
+        backend_ids = Backend.objects.filter(offline=False)\
+                                     .values_list("id", flat=True)
+        for backend_id in backend_ids:
+            try:
+                backend = update_backend_stats(backend_id)
+            except Backend.DoesNotExist:
+                continue
+            except Exception as e:
+                if not ignore_errors:
+                    raise
+                self.stderr.write("Failed to update backend %s: %s\n"
+                                  % (backend_id, e))
+                continue
+            self.stdout.write("Successfully updated backend '%s'\n"
+                              % backend)
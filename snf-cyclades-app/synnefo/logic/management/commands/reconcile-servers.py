@@ -21,6 +21,7 @@ logic/reconciliation.py for a description of reconciliation rules.
 
 """
 import sys
+import time
 import logging
 import subprocess
 from optparse import make_option
@@ -46,6 +47,32 @@ class Command(SynnefoCommand):
                     metavar="True|False",
                     help="Perform server reconciliation for each backend"
                          " parallel."),
+        make_option("--parallel-workers",
+                    dest="parallel_workers",
+                    type="int",
+                    default=0,
+                    metavar="N",
+                    help="Reconcile at most N backends at the same time."
+                         " With 0, all backends are reconciled at the same"
+                         " time (default)"),
+        make_option("--query-fields",
+                    action="store_true",
+                    dest="query_fields",
+                    default=False,
+                    help="Retrieve from Ganeti only the instance fields"
+                         " that are compared with the DB, instead of all the"
+                         " info of every instance"),
+        make_option("--incremental",
+                    dest="incremental",
+                    default=None,
+                    metavar="STATE_DIR",
+                    help="Skip the servers that have not changed, either in"
+                         " Ganeti, according to the serial number of their"
+                         " instance, or in the DB, since the previous run"
+                         " that used the same STATE_DIR. Run a full"
+                         " reconciliation periodically, since changes of"
+                         " the NICs, disks and tags in the DB are not"
+                         " detected"),
         make_option('--fix-stale', action='store_true', dest='fix_stale',
                     default=False, help='Fix (remove) stale DB entries in DB'),
         make_option('--fix-orphans', action='store_true', dest='fix_orphans',
@@ -94,12 +121,18 @@ class Command(SynnefoCommand):
         parallel = parse_bool(options["parallel"])
         if parallel and len(backends) > 1:
             cmd = sys.argv
+            pending = list(backends)
+            workers = options["parallel_workers"]
             processes = []
-            for backend in backends:
-                p = subprocess.Popen(cmd + ["--backend-id=%s" % backend.id])
-                processes.append(p)
-            for p in processes:
-                p.wait()
+            while pending or processes:
+                while pending and (workers <= 0 or len(processes) < workers):
+                    backend = pending.pop(0)
+                    p = subprocess.Popen(cmd +
+                                         ["--backend-id=%s" % backend.id])
+                    processes.append(p)
+                time.sleep(0.1)
+                processes = [proc for proc in processes
+                             if proc.poll() is None]
             return
 
         verbosity = int(options["verbosity"])
@@ -65,6 +65,18 @@ logging.basicConfig()
 
 BUILDING_NIC_TIMEOUT = timedelta(seconds=120)
 
+# Number of servers that are fetched from the DB at once, when comparing them
+# with the Ganeti instances.
+SERVER_CHUNK_SIZE = 500
+
+# The Ganeti instance fields that are compared with the DB.
+GANETI_INSTANCE_FIELDS = ["name", "oper_state", "mtime", "serial_no",
+                          "be/vcpus", "be/maxmem",
+                          "hv/boot_order", "hv/cdrom_image_path",
+                          "disk.sizes", "disk.names", "disk.uuids",
+                          "nic.ips", "nic.names", "nic.macs",
+                          "nic.networks.names", "tags"]
+
 
 class BackendReconciler(object):
     def __init__(self, backend, logger, options=None):
@@ -90,10 +102,18 @@ class BackendReconciler(object):
         self.db_servers_keys = set(self.db_servers.keys())
         log.debug("Got servers info from database.")
 
-        self.gnt_servers = get_ganeti_servers(backend)
+        query_fields = self.options.get("query_fields", False)
+        self.gnt_servers = get_ganeti_servers(backend,
+                                              query_fields=query_fields)
         self.gnt_servers_keys = set(self.gnt_servers.keys())
         log.debug("Got servers info from Ganeti backend.")
 
+        state_dir = self.options.get("incremental")
+        self.synced_state = None
+        if state_dir:
+            self.synced_state = SyncedServersState(state_dir, backend)
+            self.synced_state.load()
+
         self.gnt_jobs = get_ganeti_jobs(backend)
         log.debug("Got jobs from Ganeti backend")
 
@@ -101,6 +121,8 @@ class BackendReconciler(object):
         self.orphan_servers = self.reconcile_orphan_servers()
         self.unsynced_servers = self.reconcile_unsynced_servers()
         self.unsynced_snapshots = self.reconcile_unsynced_snapshots()
+        if self.synced_state is not None:
+            self.synced_state.save(self.event_time)
         self.close()
 
     def get_build_status(self, db_server):
@@ -186,9 +208,15 @@ class BackendReconciler(object):
             self.log.debug("Issued OP_INSTANCE_REMOVE for orphan servers.")
 
     def reconcile_unsynced_servers(self):
-        for server_id in self.db_servers_keys & self.gnt_servers_keys:
-            db_server = self.db_servers[server_id]
+        server_ids = sorted(self.db_servers_keys & self.gnt_servers_keys)
+        skipped = 0
+        for db_server in iter_database_servers(self.backend, server_ids):
+            server_id = db_server.id
             gnt_server = self.gnt_servers[server_id]
+            if self.synced_state is not None and\
+               self.synced_state.is_unchanged(db_server, gnt_server):
+                skipped += 1
+                continue
             if db_server.operstate == "BUILD":
                 build_status, end_timestamp = self.get_build_status(db_server)
                 if build_status == "RUNNING":
@@ -204,16 +232,28 @@ class BackendReconciler(object):
                     # Ganeti servers.
                     continue
 
-            self.reconcile_unsynced_operstate(server_id, db_server,
-                                              gnt_server)
-            self.reconcile_unsynced_tags(server_id, db_server, gnt_server)
-            self.reconcile_unsynced_flavor(server_id, db_server,
-                                           gnt_server)
-            self.reconcile_unsynced_nics(server_id, db_server, gnt_server)
-            self.reconcile_unsynced_disks(server_id, db_server, gnt_server)
-            self.reconcile_unsynced_rescue(server_id, gnt_server, db_server)
+            unsynced = [
+                self.reconcile_unsynced_operstate(server_id, db_server,
+                                                  gnt_server),
+                self.reconcile_unsynced_tags(server_id, db_server,
+                                             gnt_server),
+                self.reconcile_unsynced_flavor(server_id, db_server,
+                                               gnt_server),
+                self.reconcile_unsynced_nics(server_id, db_server,
+                                             gnt_server),
+                self.reconcile_unsynced_disks(server_id, db_server,
+                                              gnt_server),
+                self.reconcile_unsynced_rescue(server_id, gnt_server,
+                                               db_server)]
             if db_server.task is not None:
-                self.reconcile_pending_task(server_id, db_server)
+                unsynced.append(self.reconcile_pending_task(server_id,
+                                                            db_server))
+            if self.synced_state is not None and not any(unsynced):
+                self.synced_state.add(server_id, gnt_server)
+
+        if skipped:
+            self.log.debug("Skipped %d unchanged servers at backend %s",
+                           skipped, self.backend)
 
     @transaction.atomic_context
     def reconcile_building_server(self, server_id, atomic_context=None):
@@ -258,6 +298,8 @@ class BackendReconciler(object):
                     atomic_context=atomic_context)
                 self.log.debug("Simulated Ganeti state event for server '%s'",
                                server_id)
+            return True
+        return False
 
     @transaction.atomic_context
     def reconcile_unsynced_tags(self, server_id, db_server, gnt_server,
@@ -276,8 +318,10 @@ class BackendReconciler(object):
         self.log.debug("Server '%s' has tags '%s' in DB and '%s' in Ganeti.",
                        server_id, [db_tag.tag for db_tag in db_tags], gnt_tags)
 
+        unsynced = False
         for tag in gnt_tags:
             if not db_server.tags.filter(tag=tag, status='ACTIVE'):
+                unsynced = True
                 self.log.info("Found unsynced tags %s for server "
                               "'%s' that do not exist in Cyclades DB (action="
                               "activate)", tag, server_id)
@@ -306,6 +350,8 @@ class BackendReconciler(object):
                                                          in db_tags_del])
                 self.log.debug("Simulated Ganeti state event for server '%s'",
                                server_id)
+            unsynced = True
+        return unsynced
 
     @transaction.atomic_context
     def reconcile_unsynced_flavor(self, server_id, db_server, gnt_server,
@@ -323,7 +369,7 @@ class BackendReconciler(object):
                     volume_type_id=db_flavor.volume_type_id)
             except Flavor.DoesNotExist:
                 self.log.warning("Server '%s' has unknown flavor.", server_id)
-                return
+                return True
 
             self.log.info("Server '%s' has flavor '%s' in DB and '%s' in"
                           " Ganeti", server_id, db_flavor, gnt_flavor)
@@ -347,6 +393,8 @@ class BackendReconciler(object):
                 vm.save()
                 self.log.debug("Simulated Ganeti flavor event for server '%s'",
                                server_id)
+            return True
+        return False
 
     @transaction.atomic_context
     def reconcile_unsynced_nics(self, server_id, db_server, gnt_server,
@@ -361,7 +409,7 @@ class BackendReconciler(object):
         except Network.InvalidBackendIdError as e:
             self.log.warning("Server %s is connected to unknown network %s"
                              " Cannot reconcile server." % (server_id, str(e)))
-            return
+            return True
         nics_changed = len(db_nics) != len(gnt_nics)
         for db_nic, gnt_nic in zip(db_nics, sorted(gnt_nics_parsed.items())):
             gnt_nic_id, gnt_nic = gnt_nic
@@ -385,6 +433,7 @@ class BackendReconciler(object):
                     opcode="OP_INSTANCE_SET_PARAMS", status='success',
                     logmsg="Reconciliation: simulated Ganeti event",
                     nics=gnt_nics, atomic_context=atomic_context)
+        return nics_changed
 
     @transaction.atomic_context
     def reconcile_unsynced_disks(self, server_id, db_server, gnt_server,
@@ -420,6 +469,7 @@ class BackendReconciler(object):
                     opcode="OP_INSTANCE_SET_PARAMS", status='success',
                     logmsg="Reconciliation: simulated Ganeti event",
                     disks=gnt_disks, atomic_context=atomic_context)
+        return disks_changed
 
     @transaction.atomic
     def reconcile_pending_task(self, server_id, db_server):
@@ -436,7 +486,7 @@ class BackendReconciler(object):
             db_server = get_locked_server(server_id)
             if db_server.task_job_id != job_id:
                 # task has changed!
-                return
+                return True
             self.log.info("Found server '%s' with pending task: '%s'",
                           server_id, db_server.task)
             if self.options["fix_pending_tasks"]:
@@ -444,6 +494,7 @@ class BackendReconciler(object):
                 db_server.task_job_id = None
                 db_server.save()
                 self.log.info("Cleared pending task for server '%s", server_id)
+        return pending_task
 
     @transaction.atomic
     def reconcile_unsynced_rescue(self, server_id, gnt_server, db_server):
@@ -451,7 +502,7 @@ class BackendReconciler(object):
         # an check if these servers are in rescue mode in cyclades.
         hvparams = gnt_server.get("hvparams")
         if hvparams is None:
-            return
+            return False
 
         cdrom_image_path = hvparams.get('cdrom_image_path', '')
         boot_order = hvparams.get('boot_order', '')
@@ -500,6 +551,7 @@ class BackendReconciler(object):
                     opcode="OP_INSTANCE_SET_PARAMS", status='success',
                     logmsg="Reconciliation: simulated Ganeti event",
                     hvparams=hvparams)
+        return changed
 
     @transaction.atomic
     def reconcile_unsynced_snapshots(self):
@@ -619,20 +671,73 @@ def get_online_backends():
 
 
 def get_database_servers(backend):
-    servers = backend.virtual_machines.select_related("flavor")\
-                                      .prefetch_related("nics__ips__subnet")\
-                                      .filter(deleted=False)
+    """Return the servers of a backend, with only the fields that are needed
+    to find the stale servers."""
+    servers = backend.virtual_machines\
+                     .filter(deleted=False)\
+                     .only("id", "operstate", "action", "backendjobid")
     return dict([(s.id, s) for s in servers])
 
 
-def get_ganeti_servers(backend):
-    gnt_instances = backend_mod.get_instances(backend)
+def iter_database_servers(backend, server_ids, chunk_size=SERVER_CHUNK_SIZE):
+    """Yield the servers of a backend with the given IDs.
+
+    The servers are fetched in chunks, so that only the servers of one chunk
+    are kept in memory.
+
+    """
+    for start in xrange(0, len(server_ids), chunk_size):
+        chunk = server_ids[start:start + chunk_size]
+        servers = backend.virtual_machines\
+                         .select_related("flavor")\
+                         .prefetch_related("nics__ips__subnet")\
+                         .filter(id__in=chunk, deleted=False)\
+                         .order_by("id")
+        for server in servers:
+            yield server
+
+
+def get_ganeti_servers(backend, query_fields=False):
+    """Return the Synnefo instances of a backend, parsed.
+
+    With 'query_fields', only the fields that are compared with the DB are
+    retrieved from Ganeti, instead of all the info of every instance.
+
+    """
+    if query_fields:
+        gnt_instances = backend_mod.query_instances(backend,
+                                                    GANETI_INSTANCE_FIELDS)
+        gnt_instances = itertools.imap(instance_from_query, gnt_instances)
+    else:
+        gnt_instances = backend_mod.get_instances(backend)
     # Filter out non-synnefo instances
     snf_backend_prefix = settings.BACKEND_PREFIX_ID
-    gnt_instances = filter(lambda i: i["name"].startswith(snf_backend_prefix),
-                           gnt_instances)
-    gnt_instances = map(parse_gnt_instance, gnt_instances)
-    return dict([(i["id"], i) for i in gnt_instances if i["id"] is not None])
+    servers = {}
+    for instance in gnt_instances:
+        if not instance["name"].startswith(snf_backend_prefix):
+            continue
+        server = parse_gnt_instance(instance)
+        if server is not None:
+            servers[server["id"]] = server
+    return servers
+
+
+def instance_from_query(fields):
+    """Convert the fields of a Ganeti instance query to instance info.
+
+    The info has the format of the bulk instance info, limited to the keys
+    that 'parse_gnt_instance' uses.
+
+    """
+    instance = {"beparams": {}, "hvparams": {}}
+    for field, value in fields.items():
+        if field.startswith("be/"):
+            instance["beparams"][field[3:]] = value
+        elif field.startswith("hv/"):
+            instance["hvparams"][field[3:]] = value
+        else:
+            instance[field] = value
+    return instance
 
 
 def parse_gnt_instance(instance):
@@ -641,7 +746,7 @@ def parse_gnt_instance(instance):
     except Exception:
         logger.error("Ignoring instance with malformed name %s",
                      instance['name'])
-        return (None, None)
+        return None
 
     beparams = instance["beparams"]
 
@@ -669,7 +774,8 @@ def parse_gnt_instance(instance):
         "nics": nics_from_instance(instance),
         "flavor": flavor,
         "hvparams": instance.get("hvparams"),
-        "tags": instance["tags"]
+        "tags": instance["tags"],
+        "serial_no": instance.get("serial_no")
     }
 
 
@@ -713,6 +819,72 @@ def get_ganeti_jobs(backend):
     return dict([(int(j["id"]), j) for j in gnt_jobs])
 
 
+class SyncedServersState(object):
+    """The servers of a backend that were in sync in the previous run.
+
+    Each server is stored with the serial number and the state of its Ganeti
+    instance. Ganeti increases the serial number of an instance on every
+    change of its configuration. A server is unchanged, and need not be
+    compared again, if its instance has the same serial number and state,
+    and the server has not been updated in the DB since the previous run.
+
+    Changes in the DB that do not update the server itself, e.g. of its NICs,
+    are not detected, so a full reconciliation should still run
+    periodically.
+
+    """
+    TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+    def __init__(self, state_dir, backend):
+        self.path = os.path.join(state_dir, "servers-%s.json" % backend.id)
+        self.last_time = None
+        self.servers = {}
+        self.synced = {}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except IOError:
+            return
+        except ValueError:
+            logger.warning("Ignoring malformed reconciliation state %s",
+                           self.path)
+            return
+        self.last_time = datetime.strptime(state["time"], self.TIME_FORMAT)
+        self.servers = dict((int(server_id), tuple(value))
+                            for server_id, value in state["servers"].items())
+
+    def save(self, event_time):
+        state = {"time": event_time.strftime(self.TIME_FORMAT),
+                 "servers": self.synced}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.rename(tmp_path, self.path)
+
+    @staticmethod
+    def _instance_key(gnt_server):
+        return (gnt_server["serial_no"], gnt_server["state"])
+
+    def is_unchanged(self, db_server, gnt_server):
+        if self.last_time is None or gnt_server["serial_no"] is None:
+            return False
+        if db_server.operstate == "BUILD" or db_server.task is not None:
+            return False
+        key = self.servers.get(db_server.id)
+        if key is None or key != self._instance_key(gnt_server):
+            return False
+        if db_server.updated >= self.last_time:
+            return False
+        self.add(db_server.id, gnt_server)
+        return True
+
+    def add(self, server_id, gnt_server):
+        if gnt_server["serial_no"] is not None:
+            self.synced[server_id] = self._instance_key(gnt_server)
+
+
 class NetworkReconciler(object):
     def __init__(self, logger, fix=False):
         self.log = logger
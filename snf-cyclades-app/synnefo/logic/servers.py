@@ -241,7 +241,8 @@ def allocate_new_server(userid, project, flavor):
     from server allocation.
 
     This function runs inside a transaction, because after allocating the
-    instance a commit must be performed in order to release all locks.
+    instance a commit must be performed in order to release the lock on the
+    row of the chosen backend.
 
     """
     backend_allocator = BackendAllocator()
@@ -187,8 +187,11 @@ def _create_ip_pool(pool, cidr, subnet):
     size = int(pool[1]) - int(pool[0]) + 1
     base = str(cidr)
     offset = int(pool[0]) - int(cidr.network)
-    return IPPoolTable.objects.create(size=size, offset=offset,
-                                      base=base, subnet=subnet)
+    ip_pool = IPPoolTable.objects.create(size=size, offset=offset,
+                                         base=base, subnet=subnet)
+    # Initialize the pool and split it to segments
+    ip_pool.pool.save()
+    return ip_pool
 
 
 def check_number_of_subnets(network, version):
@@ -19,3 +19,4 @@ from .filter_default import *
 from .filter_project_backends import *
 from .base import *
 from .general import *
+from .backend_allocator import *
@@ -0,0 +1,134 @@
+# Copyright (C) 2010-2016 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from django.test import TestCase
+from mock import patch, Mock
+
+from synnefo.db import models_factory as mfactory
+from synnefo.db.models import Backend
+from synnefo.logic import backend_allocator
+from synnefo.logic.allocators.filter_default import DefaultFilter
+
+
+@patch("synnefo.logic.backend_allocator.get_available_backends")
+class BackendAllocatorTest(TestCase):
+    def setUp(self):
+        self.allocator = backend_allocator.BackendAllocator()
+        # Always choose the first candidate
+        self.allocator.strategy_mod = Mock()
+        self.allocator.strategy_mod.filter_backends.side_effect = \
+            lambda backends, vm: backends
+        self.allocator.strategy_mod.allocate.side_effect = \
+            lambda backends, vm: backends[0]
+        volume_type = mfactory.VolumeTypeFactory(disk_template="plain")
+        self.flavor = mfactory.FlavorFactory(ram=1024, disk=2,
+                                             volume_type=volume_type)
+        self.vm = {'ram': 1024, 'disk': 2048}
+
+    def test_reserve(self, mbackends):
+        backend = mfactory.BackendFactory(mfree=4096, dfree=4096, pinst_cnt=2)
+        self.assertTrue(backend_allocator.reserve_backend_resources(backend,
+                                                                    self.vm))
+        backend = Backend.objects.get(id=backend.id)
+        self.assertEqual((backend.mfree, backend.dfree, backend.pinst_cnt),
+                         (3072, 2048, 3))
+        backend.dfree = 1024
+        backend.save()
+        self.assertFalse(backend_allocator.reserve_backend_resources(backend,
+                                                                     self.vm))
+        backend = Backend.objects.get(id=backend.id)
+        self.assertEqual((backend.mfree, backend.dfree, backend.pinst_cnt),
+                         (3072, 1024, 3))
+
+    def test_reserve_like_filter(self, mbackends):
+        """Test that the resources are reserved as the filter accepts them."""
+        vm = dict(self.vm, cpu=1)
+        fits = DefaultFilter().vm_fits_in_backend
+        for mfree, dfree, pinst_cnt, ctotal in [(1024, 4096, 2, 80),
+                                                (4096, 2048, 2, 80),
+                                                (4096, 4096, 2, 4),
+                                                (4096, 4096, 2, 5),
+                                                (4096, 4096, 8, 12),
+                                                (4096, 4096, 7, 12)]:
+            backend = mfactory.BackendFactory(mfree=mfree, dfree=dfree,
+                                              pinst_cnt=pinst_cnt,
+                                              ctotal=ctotal)
+            self.assertEqual(
+                backend_allocator.reserve_backend_resources(backend, vm),
+                fits(backend, vm))
+
+    @patch("synnefo.logic.backend_allocator.backend_mod")
+    def test_update_stats(self, mbackend_mod, mbackends):
+        backend = mfactory.BackendFactory(disk_templates=["plain"])
+        mbackend_mod.get_available_disk_templates.return_value = \
+            ["plain", "drbd"]
+        mbackend_mod.get_physical_resources.return_value = {
+            "mfree": 1024, "mtotal": 2048, "dfree": 4096, "dtotal": 8192,
+            "pinst_cnt": 5, "ctotal": 16}
+        updated = backend_allocator.update_backend_stats(backend.id)
+        backend = Backend.objects.get(id=backend.id)
+        for b in [updated, backend]:
+            self.assertEqual(b.disk_templates, ["plain", "drbd"])
+            self.assertEqual((b.mfree, b.mtotal, b.dfree, b.dtotal,
+                              b.pinst_cnt, b.ctotal),
+                             (1024, 2048, 4096, 8192, 5, 16))
+        self.assertEqual(updated.updated, backend.updated)
+
+    def test_allocate_concurrently_used(self, mbackends):
+        backend1 = mfactory.BackendFactory()
+        backend2 = mfactory.BackendFactory()
+        mbackends.return_value = [backend1, backend2]
+        # A concurrent allocation has used up the first backend
+        Backend.objects.filter(id=backend1.id).update(mfree=0)
+        backend = self.allocator.allocate("user", None, self.flavor)
+        self.assertEqual(backend, backend2)
+        self.assertEqual(Backend.objects.get(id=backend1.id).pinst_cnt, 2)
+        self.assertEqual(Backend.objects.get(id=backend2.id).pinst_cnt, 3)
+
+    def test_allocate_drained(self, mbackends):
+        backend1 = mfactory.BackendFactory()
+        mbackends.return_value = [backend1]
+        Backend.objects.filter(id=backend1.id).update(drained=True)
+        self.assertEqual(self.allocator.allocate("user", None, self.flavor),
+                         None)
+
+    def test_allocate_no_resources(self, mbackends):
+        backend1 = mfactory.BackendFactory(mfree=512, dfree=4096)
+        mbackends.return_value = [backend1]
+        backend = self.allocator.allocate("user", None, self.flavor)
+        self.assertEqual(backend, backend1)
+        backend = Backend.objects.get(id=backend1.id)
+        self.assertEqual((backend.mfree, backend.dfree, backend.pinst_cnt),
+                         (0, 2048, 3))
+
+    @patch("synnefo.logic.backend_allocator.threading.Thread")
+    def test_refresh_stats(self, mthread, mbackends):
+        backend1 = mfactory.BackendFactory()
+        backend2 = mfactory.BackendFactory()
+        Backend.objects.filter(id=backend1.id).update(
+            updated=datetime.datetime.now() - datetime.timedelta(days=1))
+        backend1 = Backend.objects.get(id=backend1.id)
+        mbackends.return_value = [backend1, backend2]
+        self.allocator.allocate("user", None, self.flavor)
+        self.addCleanup(backend_allocator._refreshing_backends.discard,
+                        backend1.id)
+        mthread.assert_called_once_with(
+            target=backend_allocator._refresh_backend_stats,
+            args=(backend1.id,))
+        # The backend is refreshed once at a time
+        self.allocator.allocate("user", None, self.flavor)
+        self.assertEqual(mthread.call_count, 1)
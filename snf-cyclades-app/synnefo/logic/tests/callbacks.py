@@ -29,7 +29,8 @@ from datetime import datetime
 from mock import patch
 from synnefo.api.util import allocate_resource
 from synnefo.logic.callbacks import (update_db, update_network,
-                                     update_build_progress)
+                                     update_build_progress,
+                                     update_build_progress_batch)
 from snf_django.utils.testing import mocked_quotaholder
 from synnefo.logic.rapi import GanetiApiError
 from synnefo.db import transaction
@@ -926,3 +927,30 @@ class UpdateBuildProgressTest(TransactionTestCase):
             self.assertTrue(client.basic_ack.called)
             vm = self.get_db_vm()
             self.assertEqual(vm.buildpercentage, old)
+
+    def test_progress_batch(self, client):
+        vm2 = mfactory.VirtualMachineFactory()
+        msgs = [self.create_msg(progress=40, instance=self.vm.backend_vm_id),
+                self.create_msg(progress=60, instance=vm2.backend_vm_id)]
+        update_build_progress_batch(client, msgs)
+        self.assertEqual(client.basic_ack.call_count, 2)
+        self.assertEqual(self.get_db_vm().buildpercentage, 40)
+        vm2 = VirtualMachine.objects.get(id=vm2.id)
+        self.assertEqual(vm2.buildpercentage, 60)
+        # Older messages are ignored
+        msg = self.create_msg(progress=20, instance=self.vm.backend_vm_id,
+                              event_time=split_time(time() - 60))
+        update_build_progress_batch(client, [msg])
+        self.assertEqual(self.get_db_vm().buildpercentage, 40)
+
+    def test_progress_batch_fallback(self, client):
+        vm2 = mfactory.VirtualMachineFactory()
+        msgs = [self.create_msg(progress=40, instance=self.vm.backend_vm_id),
+                self.create_msg(progress=-1, instance=vm2.backend_vm_id),
+                self.create_msg(type="WRONG_TYPE",
+                                instance=self.vm.backend_vm_id)]
+        update_build_progress_batch(client, msgs)
+        # The messages are processed one by one
+        self.assertEqual(client.basic_ack.call_count, 2)
+        self.assertEqual(client.basic_nack.call_count, 1)
+        self.assertEqual(self.get_db_vm().buildpercentage, 40)
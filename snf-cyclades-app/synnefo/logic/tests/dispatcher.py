@@ -0,0 +1,177 @@
+# Copyright (C) 2010-2017 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from Queue import Queue
+
+from django.test import TestCase
+
+from synnefo.logic import dispatcher
+
+from mock import patch, Mock
+
+
+def amqp_message(instance, action="ack"):
+    body = json.dumps({"instance": instance, "action": action})
+    return {"body": body}
+
+
+class DispatcherWorkersTest(TestCase):
+    """Test the multi-worker dispatcher, running the workers in-process."""
+
+    def setUp(self):
+        for target in ["close_connection", "setproctitle",
+                       "DispatcherWorker.start", "Dispatcher._init"]:
+            patcher = patch("synnefo.logic.dispatcher." + target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.dispatcher = dispatcher.Dispatcher(workers=2)
+        self.dispatcher.client = Mock()
+        self.dispatcher.results = Queue()
+        for worker in self.dispatcher.workers:
+            worker.inbox = Queue()
+            worker.results = self.dispatcher.results
+            worker.process = Mock(pid=worker.index)
+            worker.process.is_alive.return_value = True
+        self.dispatch = self.dispatcher._dispatch("update_db")
+        self.processed = []
+
+    def callback(self, client, message):
+        body = json.loads(message["body"])
+        self.processed.append((body["instance"], message["msg_id"]))
+        if body["action"] == "ack":
+            client.basic_ack(message)
+        elif body["action"] == "nack":
+            client.basic_nack(message)
+        else:
+            raise ValueError("Unexpected message")
+
+    def run_workers(self):
+        """Process the messages in the inboxes of the workers."""
+        with patch("synnefo.logic.dispatcher.callbacks") as callbacks:
+            callbacks.update_db.side_effect = self.callback
+            for worker in self.dispatcher.workers:
+                worker.inbox.put(None)
+                dispatcher.worker_loop(worker.index, worker.inbox,
+                                       worker.results, worker.generation)
+
+    def test_order_per_key(self):
+        messages = [amqp_message("vm%d" % (i % 3)) for i in range(9)]
+        for message in messages:
+            self.dispatch(self.dispatcher.client, message)
+        # All the messages of an instance are given to the same worker
+        for i in range(3):
+            owners = [worker.index for worker in self.dispatcher.workers
+                      for pending in worker.pending.itervalues()
+                      if pending[0]["body"] == messages[i]["body"]]
+            self.assertEqual(len(owners), 3)
+            self.assertEqual(len(set(owners)), 1)
+        self.run_workers()
+        self.assertEqual(len(self.processed), 9)
+        for i in range(3):
+            msg_ids = [msg_id for instance, msg_id in self.processed
+                       if instance == "vm%d" % i]
+            self.assertEqual(msg_ids, range(i, 9, 3))
+
+    def test_acks(self):
+        ack = amqp_message("vm1", "ack")
+        nack = amqp_message("vm2", "nack")
+        fail = amqp_message("vm3", "fail")
+        for message in [ack, nack, fail]:
+            self.dispatch(self.dispatcher.client, message)
+        self.run_workers()
+        self.dispatcher._collect_results()
+        client = self.dispatcher.client
+        client.basic_ack.assert_called_once_with(ack)
+        client.basic_nack.assert_called_once_with(nack)
+        client.basic_reject.assert_called_once_with(fail)
+        for worker in self.dispatcher.workers:
+            self.assertFalse(worker.pending)
+            self.assertTrue(worker.inbox.empty())
+
+    def test_dead_worker(self):
+        messages = [amqp_message("vm1", "ack"), amqp_message("vm1", "nack")]
+        for message in messages:
+            self.dispatch(self.dispatcher.client, message)
+        worker = self.dispatcher._get_worker(messages[0]["body"])
+        # The worker dies and its inbox is lost
+        worker.process.is_alive.return_value = False
+        worker.inbox = Queue()
+        worker.start.side_effect = lambda: setattr(worker, "inbox", Queue())
+        self.dispatcher._collect_results()
+        self.assertTrue(worker.start.called)
+        self.assertFalse(self.dispatcher.client.basic_reject.called)
+        # A newer message of the same instance
+        worker.process.is_alive.return_value = True
+        newer = amqp_message("vm1", "ack")
+        self.dispatch(self.dispatcher.client, newer)
+        self.run_workers()
+        # The pending messages are processed before the newer one
+        self.assertEqual(self.processed, [("vm1", 0), ("vm1", 1), ("vm1", 2)])
+        self.dispatcher._collect_results()
+        client = self.dispatcher.client
+        self.assertEqual(client.basic_ack.call_args_list,
+                         [((messages[0],), {}), ((newer,), {})])
+        client.basic_nack.assert_called_once_with(messages[1])
+        self.assertFalse(worker.pending)
+
+    def test_stats(self):
+        for i in range(3):
+            self.dispatch(self.dispatcher.client, amqp_message("vm1"))
+        worker = self.dispatcher._get_worker(amqp_message("vm1")["body"])
+        self.run_workers()
+        stats = worker.get_stats()
+        self.assertEqual(stats["pending"], 3)
+        self.dispatcher._collect_results()
+        # The counters are not reset by reading them
+        first = worker.get_stats()
+        second = worker.get_stats()
+        self.assertEqual(first["pending"], 0)
+        self.assertEqual(first["processed"], 3)
+        self.assertEqual(second["processed"], 3)
+        self.assertEqual(dispatcher.get_throughput(second, first), 0)
+        first["time"] = second["time"] - 2
+        first["processed"] = 1
+        self.assertEqual(dispatcher.get_throughput(second, first), 1)
+        second["start_time"] = second["time"] - 6
+        self.assertEqual(dispatcher.get_throughput(second), 0.5)
+
+    def test_reconnect(self):
+        messages = [amqp_message("vm1"), amqp_message("vm2")]
+        for message in messages:
+            self.dispatch(self.dispatcher.client, message)
+        self.dispatcher._forget_pending()
+        for worker in self.dispatcher.workers:
+            self.assertFalse(worker.pending)
+        # The broker redelivers the messages after reconnecting
+        redelivered = [amqp_message("vm1"), amqp_message("vm2")]
+        for message in redelivered:
+            self.dispatch(self.dispatcher.client, message)
+        self.run_workers()
+        # The messages that were still in the inboxes are skipped
+        self.assertEqual(sorted(self.processed), [("vm1", 2), ("vm2", 3)])
+        self.dispatcher._collect_results()
+        self.assertEqual(self.dispatcher.client.basic_ack.call_count, 2)
+        for message in redelivered:
+            self.dispatcher.client.basic_ack.assert_any_call(message)
+
+    def test_reconnect_ignores_results(self):
+        message = amqp_message("vm1")
+        self.dispatch(self.dispatcher.client, message)
+        self.run_workers()
+        # The result arrives after reconnecting
+        self.dispatcher._forget_pending()
+        self.dispatcher._collect_results()
+        self.assertFalse(self.dispatcher.client.basic_ack.called)
@@ -27,6 +27,8 @@ from time import time
 from synnefo import settings
 
 import os
+import shutil
+import tempfile
 
 
 @patch("synnefo.logic.rapi_pool.GanetiRapiClient")
@@ -504,6 +506,81 @@ class ServerReconciliationTest(TransactionTestCase):
         self.assertEqual(nic.ipv4_address, "192.168.2.5")
         self.assertEqual(nic.mac, "aa:00:bb:cc:dd:ee")
 
+    def test_query_fields(self, mrapi):
+        vm1 = mfactory.VirtualMachineFactory(backend=self.backend,
+                                             deleted=False,
+                                             rescue_image=None,
+                                             operstate="STOPPED")
+        fields = reconciliation.GANETI_INSTANCE_FIELDS
+        values = {"name": vm1.backend_vm_id,
+                  "oper_state": True,
+                  "mtime": time(),
+                  "serial_no": 3,
+                  "be/vcpus": 4,
+                  "be/maxmem": 1024,
+                  "tags": []}
+        # Fields without a value, such as 'hv/cdrom_image_path', are ignored
+        mrapi().Query.return_value = {
+            "fields": [{"name": field} for field in fields],
+            "data": [[(0, values[field]) if field in values else
+                      (0, []) if "." in field else (2, None)
+                      for field in fields]]}
+        self.reconciler.options["query_fields"] = True
+        with mocked_quotaholder():
+            self.reconciler.reconcile()
+        self.assertFalse(mrapi().GetInstances.called)
+        vm1 = VirtualMachine.objects.get(id=vm1.id)
+        self.assertEqual(vm1.operstate, "STARTED")
+
+    def test_incremental(self, mrapi):
+        flavor = mfactory.FlavorFactory(cpu=4, ram=1024, disk=0)
+        vm1 = mfactory.VirtualMachineFactory(backend=self.backend,
+                                             deleted=False,
+                                             flavor=flavor,
+                                             rescue_image=None,
+                                             operstate="STARTED")
+        instance = {"name": vm1.backend_vm_id,
+                    "beparams": {"maxmem": 1024,
+                                 "minmem": 1024,
+                                 "vcpus": 4},
+                    "oper_state": True,
+                    "mtime": time(),
+                    "serial_no": 1,
+                    "disk.sizes": [],
+                    "disk.names": [],
+                    "disk.uuids": [],
+                    "nic.ips": [],
+                    "nic.names": [],
+                    "nic.macs": [],
+                    "nic.networks.names": [],
+                    "tags": []}
+        mrapi().GetInstances.return_value = [instance]
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        options = dict(self.reconciler.options, incremental=state_dir)
+
+        def reconcile():
+            # The reconciler returns its client to the pool when it is done,
+            # so build a new one that gets the client of this test's patch.
+            reconciler = reconciliation.BackendReconciler(
+                self.backend, options=options, logger=logging.getLogger())
+            with patch.object(reconciler, "reconcile_unsynced_operstate",
+                              return_value=False) as operstate:
+                with mocked_quotaholder():
+                    reconciler.reconcile()
+            return operstate.called
+
+        self.assertTrue(reconcile())
+        # Unchanged in Ganeti and in DB
+        self.assertFalse(reconcile())
+        # Changed in Ganeti
+        instance["serial_no"] = 2
+        self.assertTrue(reconcile())
+        self.assertFalse(reconcile())
+        # Changed in DB
+        vm1.save()
+        self.assertTrue(reconcile())
+
 
 @patch("synnefo.logic.rapi_pool.GanetiRapiClient")
 class NetworkReconciliationTest(TransactionTestCase):
@@ -37,7 +37,6 @@ import os
 
 from time import time, gmtime, strftime
 from functools import wraps
-from operator import itemgetter
 from collections import namedtuple
 from copy import deepcopy
 
@@ -133,6 +132,20 @@ MAP_TO_OBJ_STATES = {
 
 OBJ_TO_MAP_STATES = dict([(v, k) for k, v in MAP_TO_OBJ_STATES.items()])
 
+# Map the image sort keys to the (property, metadata key) to sort by. Images
+# without the metadata key are sorted by the property, if both are set, like
+# 'created_at' falls back to the version timestamp in image_to_dict().
+SORT_KEYS = {
+    'id': ('uuid', None),
+    'name': (None, PLANKTON_PREFIX + 'name'),
+    'status': ('available', None),
+    'size': ('size', None),
+    'disk_format': (None, PLANKTON_PREFIX + 'disk_format'),
+    'container_format': (None, PLANKTON_PREFIX + 'container_format'),
+    'created_at': ('mtime', PLANKTON_PREFIX + 'created_at'),
+    'updated_at': ('mtime', None),
+}
+
 
 class PlanktonBackend(object):
     """A wrapper arround the pithos backend to simplify image handling."""
@@ -399,33 +412,37 @@ class PlanktonBackend(object):
     def _list_images(self, user=None, filters=None, params=None,
                      check_permissions=True):
         filters = filters or {}
-
-        # TODO: Use filters
-        # # Fix keys
-        # keys = [PLANKTON_PREFIX + 'name']
-        # size_range = (None, None)
-        # for key, val in filters.items():
-        #     if key == 'size_min':
-        #         size_range = (val, size_range[1])
-        #     elif key == 'size_max':
-        #         size_range = (size_range[0], val)
-        #     else:
-        #         keys.append('%s = %s' % (PLANKTON_PREFIX + key, val))
+        params = params or {}
+
+        meta = {}
+        for key in ('name', 'disk_format', 'container_format'):
+            if key in filters:
+                meta[PLANKTON_PREFIX + key] = filters[key]
+        available = None
+        if 'status' in filters:
+            if filters['status'] not in OBJ_TO_MAP_STATES:
+                return []
+            available = OBJ_TO_MAP_STATES[filters['status']]
+        size_range = None
+        if 'size_min' in filters or 'size_max' in filters:
+            size_max = filters.get('size_max')
+            size_range = (filters.get('size_min'),
+                          size_max + 1 if size_max is not None else None)
+
+        sort_key, sort_meta = SORT_KEYS[params.get('sort_key', 'created_at')]
         _images = self.backend.get_domain_objects(
             domain=PLANKTON_DOMAIN, user=user,
-            check_permissions=check_permissions)
+            check_permissions=check_permissions,
+            account=filters.get('owner'), public=filters.get('is_public'),
+            meta=meta, size_range=size_range, available=available,
+            sort_key=sort_key, sort_meta=sort_meta,
+            descending=params.get('sort_dir', 'desc') == 'desc',
+            marker=params.get('marker'), limit=params.get('limit'))
 
         images = []
         for (location, metadata, permissions) in _images:
             location = Location(*location.split("/", 2))
             images.append(image_to_dict(location, metadata, permissions))
-
-        if params is None:
-            params = {}
-
-        key = itemgetter(params.get('sort_key', 'created_at'))
-        reverse = params.get('sort_dir', 'desc') == 'desc'
-        images.sort(key=key, reverse=reverse)
         return images
 
     @handle_pithos_backend
@@ -436,15 +453,14 @@ class PlanktonBackend(object):
 
     @handle_pithos_backend
     def list_shared_images(self, member, filters=None, params=None):
-        images = self._list_images(user=self.user, filters=filters,
-                                   params=params)
-        is_shared = lambda img: not img["is_public"] and img["owner"] == member
-        return filter(is_shared, images)
+        filters = dict(filters or {}, owner=member, is_public=False)
+        return self._list_images(user=self.user, filters=filters,
+                                 params=params)
 
     @handle_pithos_backend
     def list_public_images(self, filters=None, params=None):
-        images = self._list_images(user=None, filters=filters, params=params)
-        return filter(lambda img: img["is_public"], images)
+        filters = dict(filters or {}, is_public=True)
+        return self._list_images(user=None, filters=filters, params=params)
 
     # Snapshots
     @handle_pithos_backend
@@ -322,3 +322,35 @@ class PlanktonTest(BaseAPITest):
     def test_list_images_filters_error_1(self, backend):
         response = self.get(join_urls(IMAGES_URL, "?size_max="))
         self.assertBadRequest(response)
+
+    def test_list_images_filters(self, backend):
+        backend().get_domain_objects.return_value = []
+        params = urllib.urlencode({"name": "foo", "status": "AVAILABLE",
+                                   "size_min": "10", "size_max": "20",
+                                   "owner": "img_owner", "is_public": "true",
+                                   "sort_key": "name", "sort_dir": "asc",
+                                   "marker": "1234", "limit": "5"})
+        response = self.get(join_urls(IMAGES_URL, "detail?" + params),
+                            "user")
+        self.assertSuccess(response)
+        backend().get_domain_objects.assert_called_once_with(
+            domain="plankton", user="user", check_permissions=True,
+            account="img_owner", public=True,
+            meta={"plankton:name": "foo"}, size_range=(10, 21),
+            available=1, sort_key=None, sort_meta="plankton:name",
+            descending=False, marker="1234", limit=5)
+
+    def test_list_images_default_sort(self, backend):
+        backend().get_domain_objects.return_value = []
+        response = self.get(join_urls(IMAGES_URL, "detail"), "user")
+        self.assertSuccess(response)
+        kwargs = backend().get_domain_objects.call_args[1]
+        self.assertEqual((kwargs["sort_key"], kwargs["sort_meta"]),
+                         ("mtime", "plankton:created_at"))
+        self.assertTrue(kwargs["descending"])
+
+    def test_list_images_filters_error_2(self, backend):
+        response = self.get(join_urls(IMAGES_URL, "?is_public=maybe"))
+        self.assertBadRequest(response)
+        response = self.get(join_urls(IMAGES_URL, "?limit=foo"))
+        self.assertBadRequest(response)
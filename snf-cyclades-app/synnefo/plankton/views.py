@@ -32,9 +32,9 @@ from synnefo.plankton.backend import split_url
 
 
 FILTERS = ('name', 'container_format', 'disk_format', 'status', 'size_min',
-           'size_max')
+           'size_max', 'owner', 'is_public')
 
-PARAMS = ('sort_key', 'sort_dir')
+PARAMS = ('sort_key', 'sort_dir', 'marker', 'limit')
 
 SORT_KEY_OPTIONS = ('id', 'name', 'status', 'size', 'disk_format',
                     'container_format', 'created_at', 'updated_at')
@@ -329,6 +329,20 @@ def list_images(request, detail=False):
         except ValueError:
             raise faults.BadRequest("Malformed request.")
 
+    if 'is_public' in filters:
+        is_public = filters['is_public'].lower()
+        if is_public not in ('true', 'false'):
+            raise faults.BadRequest("Malformed request.")
+        filters['is_public'] = is_public == 'true'
+
+    if 'limit' in params:
+        try:
+            params['limit'] = int(params['limit'])
+        except ValueError:
+            raise faults.BadRequest("Malformed request.")
+        if params['limit'] < 0:
+            raise faults.BadRequest("Malformed request.")
+
     with PlanktonBackend(request.user_uniq) as backend:
         images = backend.list_images(filters, params)
 
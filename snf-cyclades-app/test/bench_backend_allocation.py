@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010-2017 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the latency of concurrent server allocations to Ganeti backends.
+
+A number of threads allocate servers of the same flavor to the available
+backends, the way concurrent server creations do, and the latency of each
+allocation is recorded. The resources of the backends are restored after
+each run.
+
+The script runs against the database of the installed Cyclades settings.
+"""
+
+import os
+import threading
+from optparse import OptionParser
+from time import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'synnefo.settings')
+
+import django
+django.setup()
+
+from django.db import close_connection
+
+from synnefo.db import transaction
+from synnefo.db.models import Backend, Flavor
+from synnefo.logic.backend_allocator import BackendAllocator
+
+USERID = 'bench-backend-allocation'
+RESOURCES = ('mfree', 'dfree', 'pinst_cnt')
+
+
+@transaction.atomic
+def allocate(flavor):
+    return BackendAllocator().allocate(USERID, None, flavor)
+
+
+def save_resources():
+    return dict((b.id, dict((r, getattr(b, r)) for r in RESOURCES))
+                for b in Backend.objects.all())
+
+
+@transaction.atomic
+def restore_resources(resources):
+    for backend_id, values in resources.items():
+        Backend.objects.filter(id=backend_id).update(**values)
+
+
+class AllocationT(threading.Thread):
+    def __init__(self, flavor, repeat):
+        self.flavor = flavor
+        self.repeat = repeat
+        self.latencies = []
+        threading.Thread.__init__(self)
+
+    def run(self):
+        try:
+            for i in xrange(self.repeat):
+                start = time()
+                allocate(self.flavor)
+                self.latencies.append(time() - start)
+        finally:
+            close_connection()
+
+
+def bench(threads, repeat, flavor):
+    resources = save_resources()
+    try:
+        ts = [AllocationT(flavor, repeat) for i in range(threads)]
+        start = time()
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        elapsed = time() - start
+    finally:
+        restore_resources(resources)
+
+    latencies = sorted(l for t in ts for l in t.latencies)
+    count = len(latencies)
+    average = sum(latencies) / count
+    p95 = latencies[int(count * 0.95) - 1]
+    print "%3d threads: %6d allocations in %7.2f s, %8.1f allocations/s," \
+        " latency avg %6.1f ms, p95 %6.1f ms" % \
+        (threads, count, elapsed, count / elapsed, average * 1000, p95 * 1000)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--threads',
+                      dest='threads',
+                      type='int',
+                      action='append',
+                      help="Number of concurrent threads to measure"
+                           " (may be given many times, default=1,2,4,8)")
+    parser.add_option('--repeat',
+                      dest='repeat',
+                      type='int',
+                      default=100,
+                      help="Allocations per thread (default=100)")
+    parser.add_option('--flavor',
+                      dest='flavor',
+                      type='int',
+                      help="ID of the flavor of the allocated servers"
+                           " (default: the first public flavor)")
+
+    (options, args) = parser.parse_args()
+
+    flavors = Flavor.objects.filter(deleted=False)
+    if options.flavor is not None:
+        flavor = flavors.get(id=options.flavor)
+    else:
+        flavor = flavors.filter(public=True).order_by('id')[0]
+
+    for threads in options.threads or [1, 2, 4, 8]:
+        bench(threads, options.repeat, flavor)
+
+
+if __name__ == "__main__":
+    main()
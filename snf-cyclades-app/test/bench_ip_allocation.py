@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010-2017 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the throughput of concurrent IP allocations from a large subnet.
+
+A number of threads allocate and release addresses of the same subnet, the
+way concurrent port creations do. Since each allocation locks only one
+segment of the IP pool, the allocations of different threads mostly wait
+only for the segment that is currently being filled.
+
+The script runs against the database of the installed Cyclades settings,
+and creates and deletes a private network of its own.
+"""
+
+import os
+import threading
+from optparse import OptionParser
+from time import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'synnefo.settings')
+
+import django
+django.setup()
+
+from django.db import close_connection
+
+import ipaddr
+
+from synnefo.db import transaction
+from synnefo.db.models import Network, Subnet, IPAddress
+from synnefo.logic import ips, subnets
+
+USERID = 'bench-ip-allocation'
+
+
+@transaction.atomic
+def create_network(cidr):
+    cidr = ipaddr.IPNetwork(cidr)
+    network = Network.objects.create(userid=USERID, name='bench',
+                                     flavor='CUSTOM', state='ACTIVE')
+    subnet = Subnet.objects.create(network=network, userid=USERID,
+                                   ipversion=4, cidr=str(cidr), dhcp=False)
+    pool = (cidr.network + 1, cidr.broadcast - 1)
+    subnets.create_ip_pools([pool], cidr, subnet)
+    return network
+
+
+@transaction.atomic
+def delete_network(network):
+    IPAddress.objects.filter(network=network).delete()
+    for subnet in network.subnets.all():
+        subnet.ip_pools.all().delete()
+        subnet.delete()
+    network.delete()
+
+
+@transaction.atomic
+def allocate(network):
+    return ips.allocate_ip(network, USERID)
+
+
+@transaction.atomic
+def release(address):
+    address.release_address()
+    address.delete()
+
+
+class AllocationT(threading.Thread):
+    def __init__(self, network, repeat, keep):
+        self.network = network
+        self.repeat = repeat
+        self.keep = keep
+        threading.Thread.__init__(self)
+
+    def run(self):
+        try:
+            for i in xrange(self.repeat):
+                address = allocate(self.network)
+                if not self.keep:
+                    release(address)
+        finally:
+            close_connection()
+
+
+def bench(threads, repeat, cidr, keep):
+    network = create_network(cidr)
+    try:
+        ts = [AllocationT(network, repeat, keep) for i in range(threads)]
+        start = time()
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        elapsed = time() - start
+    finally:
+        delete_network(network)
+
+    count = threads * repeat
+    print "%3d threads: %6d allocations in %7.2f s, %8.1f allocations/s" % \
+        (threads, count, elapsed, count / elapsed)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--threads',
+                      dest='threads',
+                      type='int',
+                      action='append',
+                      help="Number of concurrent threads to measure"
+                           " (may be given many times, default=1,2,4,8)")
+    parser.add_option('--repeat',
+                      dest='repeat',
+                      type='int',
+                      default=100,
+                      help="Allocations per thread (default=100)")
+    parser.add_option('--cidr',
+                      dest='cidr',
+                      default='10.0.0.0/16',
+                      help="Subnet of the network (default=10.0.0.0/16)")
+    parser.add_option('--keep',
+                      action='store_true',
+                      dest='keep',
+                      default=False,
+                      help="Keep the allocated addresses until the end of"
+                           " each run, instead of releasing them at once")
+
+    (options, args) = parser.parse_args()
+
+    for threads in options.threads or [1, 2, 4, 8]:
+        bench(threads, options.repeat, options.cidr, options.keep)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,12 +27,15 @@ import sys
 import os
 import json
 import logging
+import threading
+import Queue
 import pyinotify
 import daemon
 import daemon.pidlockfile
 import daemon.runner
 from lockfile import LockTimeout
 from signal import signal, SIGINT, SIGTERM
+from time import time
 import setproctitle
 
 from synnefo import settings
@@ -211,14 +214,75 @@ def get_ganeti_node():
     return netutils.GetHostname().GetFqdn()
 
 
+class EventdStats(object):
+    """Throughput and publish latency of eventd, logged periodically."""
+
+    def __init__(self, logger, interval=60):
+        self.logger = logger
+        self.interval = interval
+        self.reset(time())
+
+    def reset(self, now):
+        self.started = now
+        self.events = 0
+        self.messages = 0
+        self.batches = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def add_batch(self, events, messages, received, published):
+        """Account a batch of events, received at 'received' time."""
+        self.events += events
+        self.messages += messages
+        self.batches += 1
+        latency = published - received
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def maybe_report(self, now=None):
+        if not self.interval:
+            return
+        now = now or time()
+        elapsed = now - self.started
+        if elapsed < self.interval:
+            return
+        if self.batches:
+            self.logger.info(
+                "Processed %d events (%.1f events/s), published %d messages"
+                " (%.1f msgs/s) in %d batches, publish latency avg %.1f ms,"
+                " max %.1f ms", self.events, self.events / elapsed,
+                self.messages, self.messages / elapsed, self.batches,
+                1000 * self.latency_sum / self.batches,
+                1000 * self.latency_max)
+        self.reset(now)
+
+
 class JobFileHandler(pyinotify.ProcessEvent):
-    def __init__(self, logger, cluster_name):
+    """Handle inotify events of the Ganeti job queue.
+
+    The inotify loop reads each changed job file when its event arrives, so
+    that every status of the job is seen, even if the job is archived before
+    its event is processed. A worker thread parses these snapshots and
+    publishes the resulting messages to RabbitMQ in batches of at most
+    'batch_size' events. A message identical to one already in the batch,
+    e.g. of a job file that was written again without a change in the state
+    of its opcodes, is published only once.
+
+    """
+
+    def __init__(self, logger, cluster_name, confirm_buffer=25,
+                 batch_size=100, master_check_interval=1,
+                 stats_interval=60):
         pyinotify.ProcessEvent.__init__(self)
         self.logger = logger
         self.cluster_name = cluster_name
+        self.batch_size = batch_size
+        self.master_check_interval = master_check_interval
+        self.stats = EventdStats(logger, stats_interval)
 
         # Set max_retries to 0 for unlimited retries.
-        self.client = AMQPClient(hosts=settings.AMQP_HOSTS, confirm_buffer=25,
+        self.client = AMQPClient(hosts=settings.AMQP_HOSTS,
+                                 confirm_buffer=confirm_buffer,
                                  max_retries=0, logger=logger)
 
         logger.info("Attempting to connect to RabbitMQ hosts")
@@ -227,6 +291,7 @@ class JobFileHandler(pyinotify.ProcessEvent):
         logger.info("Connected successfully")
 
         self.ganeti_master = get_ganeti_master()
+        self.master_checked = time()
         logger.debug("Ganeti Master Node: %s", self.ganeti_master)
 
         self.ganeti_node = get_ganeti_node()
@@ -245,21 +310,127 @@ class JobFileHandler(pyinotify.ProcessEvent):
                             # "GROUP": self.process_group_op}
                             "TAGS": self.process_tag_op}
 
+        self.queue = Queue.Queue()
+        self.worker = threading.Thread(target=self.run_worker,
+                                       name="eventd-worker")
+        self.worker.daemon = True
+        self.worker.start()
+
     def process_IN_CLOSE_WRITE(self, event):
         self.process_IN_MOVED_TO(event)
 
     def process_IN_MOVED_TO(self, event):
         self.logger.info("Processing event %s", event.name)
-        jobfile = os.path.join(event.path, event.name)
         if not event.name.startswith("job-"):
             self.logger.debug("Not a job file: %s" % event.path)
             return
-
+        jobfile = os.path.join(event.path, event.name)
         try:
             data = utils.ReadFile(jobfile)
         except IOError:
             return
+        self.queue.put((data, time()))
+
+    def stop(self, timeout=10):
+        """Stop the worker thread, after it has published pending events."""
+        self.queue.put(None)
+        self.worker.join(timeout)
+        if self.worker.is_alive():
+            self.logger.warning("Worker did not stop in %d seconds, %d"
+                                " events are lost", timeout,
+                                self.queue.qsize())
+
+    def run_worker(self):
+        while True:
+            try:
+                if not self.process_batch():
+                    return
+            except Exception:
+                self.logger.exception("Unhandled exception in worker")
+
+    def get_batch(self):
+        """Wait for the next batch of job file snapshots.
 
+        Return the contents of the job files, in the order of their events,
+        the time the first event of the batch was received and whether the
+        worker must stop after the batch.
+
+        """
+        item = self.queue.get()
+        if item is None:
+            return [], None, True
+        snapshots = [item[0]]
+        received = item[1]
+        while len(snapshots) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is None:
+                return snapshots, received, True
+            snapshots.append(item[0])
+        return snapshots, received, False
+
+    def process_batch(self):
+        """Process the next batch of job files.
+
+        Return False if the worker must stop.
+
+        """
+        snapshots, received, stop = self.get_batch()
+        if not snapshots:
+            return False
+
+        messages = []
+        published = set()
+        for data in snapshots:
+            for message in self.get_job_messages(data):
+                if message not in published:
+                    published.add(message)
+                    messages.append(message)
+
+        if messages and self.is_master():
+            self.client.basic_publish_batch(settings.EXCHANGE_GANETI,
+                                            messages)
+        elif messages:
+            self.logger.debug("Ignoring %d msgs. Reason: Not Master",
+                              len(messages))
+
+        self.stats.add_batch(len(snapshots), len(messages), received, time())
+        self.stats.maybe_report()
+        return not stop
+
+    def is_master(self):
+        """Check if this node is the Ganeti master.
+
+        While this node is the master, the master is looked up at most once
+        per 'master_check_interval' seconds, instead of once per message.
+        Otherwise it is always looked up, so that no messages are dropped
+        after this node has become the master.
+
+        """
+        now = time()
+        if self.ganeti_node == self.ganeti_master and \
+           now - self.master_checked < self.master_check_interval:
+            return True
+
+        current_master = get_ganeti_master()
+        self.master_checked = now
+        if self.ganeti_master != current_master:
+            self.logger.warning("Ganeti Master changed! New Master: %s",
+                                current_master)
+
+            if self.ganeti_node == current_master:
+                self.logger.info("This node became Ganeti Master.")
+            else:
+                self.logger.info("This node is not Ganeti Master.")
+
+            self.ganeti_master = current_master
+
+        return self.ganeti_node == self.ganeti_master
+
+    def get_job_messages(self, data):
+        """Return the (routekey, msg) of the opcodes of a job file."""
         data = serializer.LoadJson(data)
         job = jqueue._QueuedJob.Restore(None, data, False, False)
 
@@ -267,6 +438,7 @@ class JobFileHandler(pyinotify.ProcessEvent):
 
         job_id = int(job.id)
 
+        messages = []
         for op in job.ops:
             op_id = op.input.OP_ID
 
@@ -307,36 +479,16 @@ class JobFileHandler(pyinotify.ProcessEvent):
                 # so that the job can be retried if needed.
                 msg["job_fields"] = op.Serialize()["input"]
 
-            # Check if this is the master node. Only the master node should
-            # deliver messages to RabbitMQ.
-            current_master = get_ganeti_master()
-            if self.ganeti_master != current_master:
-                self.logger.warning("Ganeti Master changed! New Master: %s",
-                                    current_master)
-
-                if self.ganeti_node == current_master:
-                    self.logger.info("This node became Ganeti Master.")
-                else:
-                    self.logger.info("This node is not Ganeti Master.")
-
-                self.ganeti_master = current_master
-
             msg = json.dumps(msg)
 
-            if self.ganeti_node != self.ganeti_master:
-                self.logger.debug(
-                    "Ignoring msg for job: %s: %s. Reason: Not Master",
-                    job_id, op_id)
-                continue
-
             self.logger.debug("Delivering msg: %s (key=%s)", msg, routekey)
 
-            # Send the message to RabbitMQ. Since the master node test and the
-            # message delivery isn't atomic, race conditions may occur. We can
-            # live with that.
-            self.client.basic_publish(settings.EXCHANGE_GANETI,
-                                      routekey,
-                                      msg)
+            # Only the master node should deliver messages to RabbitMQ. Since
+            # the master node test and the message delivery isn't atomic,
+            # race conditions may occur. We can live with that.
+            messages.append((routekey, msg))
+
+        return messages
 
     def process_instance_op(self, op, job_id):
         """ Process OP_INSTANCE_* opcodes.
@@ -544,6 +696,23 @@ def parse_arguments(args):
                       metavar='PIDFILE',
                       help="Save PID to file (default: %s)" %
                            "/var/run/snf-ganeti-eventd.pid")
+    parser.add_option("--confirm-buffer", dest="confirm_buffer", type="int",
+                      default=25, metavar="N",
+                      help="Wait for publisher confirmations when N"
+                           " messages are unacked (default: 25)")
+    parser.add_option("--batch-size", dest="batch_size", type="int",
+                      default=100, metavar="N",
+                      help="Publish the messages of at most N job file"
+                           " events at once (default: 100)")
+    parser.add_option("--master-check-interval",
+                      dest="master_check_interval", type="float",
+                      default=1, metavar="SECONDS",
+                      help="While this node is the Ganeti master, check"
+                           " again at most once every SECONDS (default: 1)")
+    parser.add_option("--stats-interval", dest="stats_interval",
+                      type="int", default=60, metavar="SECONDS",
+                      help="Log events/s and publish latency every SECONDS,"
+                           " 0 to disable (default: 60)")
 
     return parser.parse_args(args)
 
@@ -609,7 +778,11 @@ def main():
 
     cluster_name = find_cluster_name()
 
-    handler = JobFileHandler(logger, cluster_name)
+    handler = JobFileHandler(logger, cluster_name,
+                             confirm_buffer=opts.confirm_buffer,
+                             batch_size=opts.batch_size,
+                             master_check_interval=opts.master_check_interval,
+                             stats_interval=opts.stats_interval)
     notifier = pyinotify.Notifier(wm, handler)
 
     try:
@@ -637,6 +810,7 @@ def main():
     finally:
         # destroy the inotify's instance on this interrupt (stop monitoring)
         notifier.stop()
+        handler.stop()
         raise
 
 
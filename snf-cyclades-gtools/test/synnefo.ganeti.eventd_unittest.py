@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2017 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import json
+import shutil
+import logging
+import tempfile
+from itertools import count
+from socket import error as socket_error
+from mock import patch, Mock
+
+from synnefo.ganeti import eventd
+from synnefo.lib.amqp.amqp_puka import AMQPPukaClient
+from synnefo.lib.amqp.amqp_haigha import AMQPHaighaClient
+
+log = logging.getLogger()
+
+# Use backported unittest functionality if Python < 2.7
+try:
+    import unittest2 as unittest
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise Exception("The unittest2 package is required for Python < 2.7")
+    import unittest
+
+
+class JobFileHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.master = "node1"
+        patchers = {
+            "AMQPClient": patch("synnefo.ganeti.eventd.AMQPClient"),
+            "Thread": patch("synnefo.ganeti.eventd.threading.Thread"),
+            "get_ganeti_node": patch("synnefo.ganeti.eventd.get_ganeti_node",
+                                     return_value="node1"),
+            "get_ganeti_master": patch(
+                "synnefo.ganeti.eventd.get_ganeti_master",
+                side_effect=lambda: self.master)}
+        mocks = {}
+        for name, patcher in patchers.items():
+            mocks[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+        self.get_master = mocks["get_ganeti_master"]
+        self.queue_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.queue_dir)
+        self.handler = eventd.JobFileHandler(log, "cluster", batch_size=10,
+                                             master_check_interval=60,
+                                             stats_interval=0)
+        # A job file is the list of the messages of its opcodes
+        self.handler.get_job_messages = \
+            lambda data: [tuple(message) for message in json.loads(data)]
+        self.publish = self.handler.client.basic_publish_batch
+
+    def write_job(self, name, *messages):
+        """Write a job file and send its inotify event."""
+        with open(os.path.join(self.queue_dir, name), "w") as f:
+            f.write(json.dumps(messages))
+        event = Mock(path=self.queue_dir)
+        event.name = name
+        self.handler.process_IN_MOVED_TO(event)
+
+    def test_every_status(self):
+        self.write_job("job-1", ["ganeti.vm", "queued"])
+        self.write_job("job-1", ["ganeti.vm", "running"])
+        # Written again, without any change in its state
+        self.write_job("job-1", ["ganeti.vm", "running"])
+        self.write_job("job-2", ["ganeti.net", "queued"])
+        # The job is archived before the worker processes its events
+        os.remove(os.path.join(self.queue_dir, "job-1"))
+        self.assertTrue(self.handler.process_batch())
+        self.publish.assert_called_once_with(
+            eventd.settings.EXCHANGE_GANETI,
+            [("ganeti.vm", "queued"), ("ganeti.vm", "running"),
+             ("ganeti.net", "queued")])
+
+    def test_batch_size(self):
+        self.handler.batch_size = 2
+        for status in ["queued", "waiting", "running"]:
+            self.write_job("job-1", ["ganeti.vm", status])
+        self.handler.process_batch()
+        self.handler.process_batch()
+        self.assertEqual(
+            [call[0][1] for call in self.publish.call_args_list],
+            [[("ganeti.vm", "queued"), ("ganeti.vm", "waiting")],
+             [("ganeti.vm", "running")]])
+
+    def test_not_a_job_file(self):
+        self.write_job("lock", ["ganeti.vm", "queued"])
+        self.assertTrue(self.handler.queue.empty())
+
+    def test_stop(self):
+        self.write_job("job-1", ["ganeti.vm", "queued"])
+        self.handler.queue.put(None)
+        self.assertFalse(self.handler.process_batch())
+        self.assertEqual(self.publish.call_count, 1)
+        self.handler.queue.put(None)
+        self.assertFalse(self.handler.process_batch())
+
+    def test_master(self):
+        self.get_master.reset_mock()
+        for status in ["queued", "running"]:
+            self.write_job("job-1", ["ganeti.vm", status])
+            self.handler.process_batch()
+        self.assertEqual(self.publish.call_count, 2)
+        # The master is not looked up again while this node is the master
+        self.assertFalse(self.get_master.called)
+
+    def test_new_master(self):
+        self.handler.ganeti_master = self.master = "node2"
+        self.write_job("job-1", ["ganeti.vm", "queued"])
+        self.handler.process_batch()
+        self.assertFalse(self.publish.called)
+        # This node becomes the master, before the check interval passes
+        self.master = "node1"
+        self.write_job("job-1", ["ganeti.vm", "running"])
+        self.handler.process_batch()
+        self.publish.assert_called_once_with(
+            eventd.settings.EXCHANGE_GANETI, [("ganeti.vm", "running")])
+
+
+class PukaPublishBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = AMQPPukaClient(hosts=["amqp://host"], confirm_buffer=3)
+        self.client.client = Mock()
+        self.client.client.needs_write.return_value = False
+        promises = count()
+        self.client.client.basic_publish.side_effect = \
+            lambda **kwargs: promises.next()
+        self.client.client.wait.side_effect = \
+            lambda promises: self.client.unacked.clear()
+
+    def test_publish_batch(self):
+        messages = [("key1", "body1"), ("key2", "body2")]
+        self.client.basic_publish_batch("exchange", messages)
+        publish = self.client.client.basic_publish
+        self.assertEqual(
+            [(call[1]["routing_key"], call[1]["body"])
+             for call in publish.call_args_list], messages)
+        for call in publish.call_args_list:
+            self.assertEqual(call[1]["exchange"], "exchange")
+            self.assertEqual(call[1]["headers"], {"delivery_mode": 2})
+        self.assertFalse(self.client.unsend)
+        # Confirmations are not waited for until the buffer fills
+        self.assertEqual(len(self.client.unacked), 2)
+        self.assertFalse(self.client.client.wait.called)
+        self.client.basic_publish_batch("exchange", [("key3", "body3")])
+        self.assertTrue(self.client.client.wait.called)
+        self.assertFalse(self.client.unacked)
+
+    def test_connection_failure(self):
+        publish = self.client.client.basic_publish
+        publish.side_effect = [0, socket_error("Connection reset")]
+        with patch.object(self.client, "connect") as connect:
+            self.client.basic_publish_batch(
+                "exchange", [("key1", "body1"), ("key2", "body2"),
+                             ("key3", "body3")])
+        self.assertTrue(connect.called)
+        # The unsent messages are resent after reconnecting
+        self.assertEqual(self.client.unsend.items(),
+                         [("body2", ("exchange", "key2")),
+                          ("body3", ("exchange", "key3"))])
+
+
+class PukaReconnectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = AMQPPukaClient(hosts=["amqp://host"])
+        self.client.client = Mock()
+        self.client.connect = Mock()
+
+    def test_stale_delivery_tags(self):
+        message = {"body": "body1", "delivery_tag": 1,
+                   "generation": self.client.generation}
+        self.client.client.basic_ack.side_effect = \
+            socket_error("Connection reset")
+        self.client.basic_ack(message)
+        self.assertTrue(self.client.connect.called)
+        self.assertEqual(self.client.generation, 1)
+        # The message is redelivered, so it is not acknowledged in the new
+        # channel
+        self.client.client.reset_mock()
+        self.client.basic_ack(message)
+        self.client.basic_reject(message, requeue=True)
+        self.assertFalse(self.client.client.basic_ack.called)
+        self.assertFalse(self.client.client.basic_reject.called)
+        redelivered = dict(message, generation=1)
+        self.client.basic_reject(redelivered)
+        self.client.client.basic_reject.assert_called_once_with(
+            redelivered, requeue=False)
+
+
+class HaighaPublishBatchTestCase(unittest.TestCase):
+    def test_publish_batch(self):
+        client = AMQPHaighaClient(hosts=["amqp://host"], confirm_buffer=2)
+        client.channel = Mock()
+        client.connection = Mock()
+        message_ids = count()
+        client.channel.basic.publish.side_effect = \
+            lambda *args: message_ids.next()
+        messages = [("key1", "body1"), ("key2", "body2"), ("key3", "body3")]
+        client.basic_publish_batch("exchange", messages)
+        publish = client.channel.basic.publish
+        self.assertEqual(
+            [(call[0][2], call[0][0].body) for call in publish.call_args_list],
+            [(key, body) for key, body in messages])
+        self.assertEqual(set(call[0][1] for call in publish.call_args_list),
+                         set(["exchange"]))
+        # Confirmations are read once more than 'confirm_buffer' messages
+        # are unacked
+        self.assertEqual(client.connection.read_frames.call_count, 1)
+        self.assertEqual(len(client.unacked), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
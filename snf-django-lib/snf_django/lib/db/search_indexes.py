@@ -0,0 +1,115 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Trigram indexes for the searches of the admin dashboard.
+
+Each index is given as a tuple of the app label, the model name, the column
+and the expression that Django compares for the lookups of the searches on
+PostgreSQL, e.g. '%s::text' for 'contains' and 'UPPER(%s::text)' for
+'icontains' lookups. GIN trigram indexes on these expressions avoid scanning
+the whole tables.
+
+The indexes need the pg_trgm extension, which only a superuser can enable,
+so they are skipped if it is not enabled. The migrations that create them
+cannot fail because of that, and the indexes can be created again, once the
+extension has been enabled, with the management command of each app.
+
+"""
+
+PG_TRGM_WARNING = ("Warning: The pg_trgm extension of PostgreSQL is not"
+                   " enabled. Skipping the indexes of the admin searches."
+                   " Run 'snf-manage %s' to create them after enabling it.")
+
+
+def index_name(table, column):
+    return "%s_%s_search" % (table, column)
+
+
+def has_pg_trgm(cursor):
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    return cursor.fetchone() is not None
+
+
+def is_valid_index(cursor, name):
+    """Return whether an index exists and has been built successfully."""
+    cursor.execute("SELECT i.indisvalid FROM pg_class c"
+                   " JOIN pg_index i ON i.indexrelid = c.oid"
+                   " WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+                   [name])
+    row = cursor.fetchone()
+    return row is not None and row[0]
+
+
+def execute_outside_transaction(connection, func):
+    """Call func with a cursor of a new connection to the same database.
+
+    'CREATE INDEX CONCURRENTLY' cannot run in a transaction, while Django 1.7
+    runs every migration in one on PostgreSQL and has no way to run a
+    migration, or one of its operations, outside of it. The new connection
+    is in autocommit mode, and is closed when func returns. Return the result
+    of func.
+    """
+    other = connection.__class__(connection.settings_dict, connection.alias)
+    try:
+        with other.cursor() as cursor:
+            return func(cursor)
+    finally:
+        other.close()
+
+
+def create_search_indexes(connection, indexes, get_model):
+    """Create the search indexes that do not exist or are not valid.
+
+    The indexes are built concurrently, without blocking writes to the
+    tables. Return the names of the created indexes, or None if the pg_trgm
+    extension is not enabled. Nothing is created on databases other than
+    PostgreSQL.
+    """
+    if connection.vendor != "postgresql":
+        return []
+
+    def create(cursor):
+        if not has_pg_trgm(cursor):
+            return None
+        created = []
+        for app, model, column, expression in indexes:
+            table = get_model(app, model)._meta.db_table
+            name = index_name(table, column)
+            if is_valid_index(cursor, name):
+                continue
+            # An interrupted concurrent build leaves an invalid index behind
+            cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS "%s"' % name)
+            cursor.execute(
+                'CREATE INDEX CONCURRENTLY "%s" ON "%s" USING gin '
+                '((%s) gin_trgm_ops)' %
+                (name, table, expression % ('"%s"' % column)))
+            created.append(name)
+        return created
+
+    return execute_outside_transaction(connection, create)
+
+
+def drop_search_indexes(connection, indexes, get_model):
+    """Drop the search indexes, concurrently."""
+    if connection.vendor != "postgresql":
+        return
+
+    def drop(cursor):
+        for app, model, column, expression in indexes:
+            table = get_model(app, model)._meta.db_table
+            cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS "%s"' %
+                           index_name(table, column))
+
+    execute_outside_transaction(connection, drop)
@@ -0,0 +1,149 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import sys
+from StringIO import StringIO
+from mock import patch
+
+from astakosclient.errors import Unauthorized
+from snf_django.lib import tokencache
+from snf_django.lib.tokencache import TokenCache
+from snf_django.management.utils import pprint_table, pprint_table_stream
+
+# Use backported unittest functionality if Python < 2.7
+try:
+    import unittest2 as unittest
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise Exception("The unittest2 package is required for Python < 2.7")
+    import unittest
+
+
+def user_info(expires="2100-01-01T00:00:00.000000+00:00"):
+    return {"access": {"token": {"id": "token", "expires": expires},
+                       "user": {"id": "user"}}}
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    def test_disabled(self):
+        cache = TokenCache()
+        self.assertFalse(cache.enabled)
+
+    def test_hit_and_miss(self):
+        cache = TokenCache(ttl=60)
+        self.assertEqual(cache.get("token"), None)
+        cache.set("token", user_info())
+        self.assertEqual(cache.get("token"), user_info())
+        self.assertEqual(cache.get("other"), None)
+        stats = cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_expiration(self):
+        cache = TokenCache(ttl=60)
+        # Expired tokens are never cached
+        cache.set("token", user_info("2013-06-19T15:23:59.975572+00:00"))
+        self.assertEqual(cache.get("token"), None)
+        cache.set("token", user_info())
+        with patch("snf_django.lib.tokencache.time") as time:
+            time.return_value = 2 ** 40
+            self.assertEqual(cache.get("token"), None)
+
+    def test_negative(self):
+        cache = TokenCache(ttl=60)
+        cache.set_invalid("token", Unauthorized("Invalid token"))
+        self.assertEqual(cache.get("token"), None)
+        cache = TokenCache(ttl=60, negative_ttl=10)
+        cache.set_invalid("token", Unauthorized("Invalid token"))
+        self.assertRaises(Unauthorized, cache.get, "token")
+        self.assertEqual(cache.get_stats()["negative_hits"], 1)
+
+    def test_lru(self):
+        cache = TokenCache(ttl=60, size=2)
+        cache.set("token1", user_info())
+        cache.set("token2", user_info())
+        cache.get("token1")
+        cache.set("token3", user_info())
+        self.assertEqual(cache.get("token2"), None)
+        self.assertEqual(cache.get("token1"), user_info())
+        self.assertEqual(cache.get("token3"), user_info())
+
+    def test_invalidate(self):
+        cache = TokenCache(ttl=60)
+        cache.set("token", user_info())
+        cache.invalidate("token")
+        self.assertEqual(cache.get("token"), None)
+
+    def test_invalidate_shared(self):
+        from django.core.cache import caches
+        caches["default"].clear()
+        cache = TokenCache(ttl=60, negative_ttl=10, shared_cache="default")
+        other = TokenCache(ttl=60, negative_ttl=10, shared_cache="default")
+        cache.set("token", user_info())
+        self.assertEqual(other.get("token"), user_info())
+        # The token is revoked in both processes
+        cache.invalidate("token")
+        self.assertEqual(other.get("token"), None)
+        self.assertEqual(other.get_stats()["revoked"], 1)
+        # Even if it is cached again by a validation that raced with the
+        # revocation
+        other.set("token", user_info())
+        self.assertEqual(other.get("token"), None)
+        self.assertEqual(other.get_stats()["revoked"], 2)
+        # Its rejection by Astakos is still cached
+        other.set_invalid("token", Unauthorized("Invalid token"))
+        self.assertRaises(Unauthorized, cache.get, "token")
+
+    def test_log_stats(self):
+        cache = TokenCache(ttl=60)
+        with patch("snf_django.lib.tokencache.logger") as logger:
+            cache.get("token")
+            self.assertFalse(logger.info.called)
+            cache.stats_time -= 2 * tokencache.STATS_INTERVAL
+            cache.get("token")
+            self.assertEqual(logger.info.call_count, 1)
+
+
+class TableStreamTestCase(unittest.TestCase):
+    headers = ["id", "name"]
+    table = [[1, "a"], [2, "bb"], [3, "ccc"]]
+
+    def stream(self, output_format, **kwargs):
+        out = StringIO()
+        pprint_table_stream(out, iter(self.table), self.headers,
+                            output_format, **kwargs)
+        return out.getvalue()
+
+    def test_same_output(self):
+        for output_format in ["pretty", "csv"]:
+            out = StringIO()
+            pprint_table(out, self.table, self.headers, output_format)
+            self.assertEqual(self.stream(output_format), out.getvalue())
+
+    def test_json(self):
+        self.assertEqual(json.loads(self.stream("json")),
+                         [{"id": "1", "name": "a"}, {"id": "2", "name": "bb"},
+                          {"id": "3", "name": "ccc"}])
+        out = StringIO()
+        pprint_table_stream(out, iter([]), self.headers, "json")
+        self.assertEqual(json.loads(out.getvalue()), [])
+
+    def test_sample(self):
+        lines = self.stream("pretty", sample_size=1).splitlines()
+        self.assertEqual(lines, [u"id  name", u"--------", u" 1     a",
+                                 u" 2    bb", u" 3   ccc"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cache of the user info that Astakos returns for authentication tokens.
+
+Entries are kept in a process-local LRU and, optionally, in a Django cache
+that is shared between processes and hosts. A valid token is cached until it
+expires or for 'AUTH_CACHE_TTL' seconds, whichever comes first. An invalid
+token is cached for 'AUTH_CACHE_NEGATIVE_TTL' seconds. Caching is disabled
+when 'AUTH_CACHE_TTL' is 0.
+
+An invalidated token is marked as revoked in the shared cache, and the mark
+is checked before an entry of the local LRU is trusted, so that the token is
+rejected by all processes. Without a shared cache, the other processes keep
+accepting the token until their own entry expires.
+
+"""
+
+import logging
+import threading
+from calendar import timegm
+from collections import OrderedDict
+from hashlib import sha256
+from time import time
+
+from dateutil.parser import parse as parse_date
+from django.conf import settings
+from django.utils.encoding import smart_str
+
+from astakosclient.errors import Unauthorized
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two reports of the statistics of the cache in the log
+STATS_INTERVAL = 300
+
+
+class TokenCache(object):
+    """Process-local LRU of validated tokens, backed by a shared cache."""
+
+    def __init__(self, ttl=0, negative_ttl=0, size=1000, shared_cache=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = size
+        self.shared_cache = shared_cache
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.revoked = 0
+        self.stats_time = time()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _key(self, token):
+        # Never keep the raw tokens, since the shared cache is not ours
+        return "authtoken:" + sha256(smart_str(token)).hexdigest()
+
+    def _revoked_key(self, key):
+        return "revoked:" + key
+
+    def _get_shared(self):
+        if self.shared_cache is None:
+            return None
+        from django.core.cache import caches
+        return caches[self.shared_cache]
+
+    def get(self, token):
+        """Return the cached user info of a token, or None if not cached.
+
+        Raise 'Unauthorized' if the token is cached as invalid.
+
+        """
+        key = self._key(token)
+        now = time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] <= now:
+                entry = None
+            if entry is not None:
+                self.entries[key] = entry
+        shared = self._get_shared()
+        if shared is not None:
+            revoked_key = self._revoked_key(key)
+            found = shared.get_many([key, revoked_key])
+            if entry is None:
+                entry = found.get(key)
+                if entry is not None and entry[0] > now:
+                    self._store(key, entry)
+                else:
+                    entry = None
+            if revoked_key in found and entry is not None and \
+               entry[1] is not None:
+                # The token has been revoked after it was validated
+                with self.lock:
+                    self.entries.pop(key, None)
+                    self.revoked += 1
+                entry = None
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if entry[1] is None:
+                    self.negative_hits += 1
+        self._log_stats(now)
+        if entry is None:
+            return None
+        expires, user_info, error = entry
+        if user_info is None:
+            raise Unauthorized(*error)
+        return user_info
+
+    def _store(self, key, entry):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def _set(self, key, entry, timeout):
+        self._store(key, entry)
+        shared = self._get_shared()
+        if shared is not None:
+            shared.set(key, entry, max(int(timeout), 1))
+
+    def set(self, token, user_info):
+        """Cache the user info of a valid token."""
+        now = time()
+        timeout = self.ttl
+        try:
+            expires = user_info["access"]["token"]["expires"]
+            expires = timegm(parse_date(expires).utctimetuple())
+            timeout = min(timeout, expires - now)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            pass
+        if timeout <= 0:
+            return
+        key = self._key(token)
+        self._set(key, (now + timeout, user_info, None), timeout)
+
+    def set_invalid(self, token, error):
+        """Cache the 'Unauthorized' error of an invalid token."""
+        if self.negative_ttl <= 0:
+            return
+        key = self._key(token)
+        entry = (time() + self.negative_ttl, None,
+                 (error.message, error.details, error.status))
+        self._set(key, entry, self.negative_ttl)
+
+    def invalidate(self, token):
+        """Remove a token from the cache, e.g. after it has been renewed.
+
+        The token is also marked as revoked in the shared cache, for as long
+        as any process may keep it in its local LRU.
+
+        """
+        key = self._key(token)
+        with self.lock:
+            self.entries.pop(key, None)
+        shared = self._get_shared()
+        if shared is not None:
+            shared.set(self._revoked_key(key), True,
+                       max(int(self.ttl), int(self.negative_ttl), 1))
+            shared.delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {"size": len(self.entries),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "negative_hits": self.negative_hits,
+                    "revoked": self.revoked}
+
+    def _log_stats(self, now):
+        with self.lock:
+            if now - self.stats_time < STATS_INTERVAL:
+                return
+            self.stats_time = now
+        logger.info("Token cache: size %(size)d, hits %(hits)d,"
+                    " misses %(misses)d, negative hits %(negative_hits)d,"
+                    " revoked %(revoked)d", self.get_stats())
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    """Return the token cache of this process, as configured in settings."""
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache(
+            ttl=getattr(settings, "AUTH_CACHE_TTL", 0),
+            negative_ttl=getattr(settings, "AUTH_CACHE_NEGATIVE_TTL", 0),
+            size=getattr(settings, "AUTH_CACHE_SIZE", 1000),
+            shared_cache=getattr(settings, "AUTH_CACHE_BACKEND", None))
+    return _token_cache
+
+
+def invalidate_token(token):
+    """Remove a token from the token cache.
+
+    The token is removed from the local LRU of this process and, if a shared
+    cache is configured, it is marked as revoked there, so that the other
+    processes stop accepting it too.
+
+    """
+    get_token_cache().invalidate(token)
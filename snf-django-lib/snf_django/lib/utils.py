@@ -14,7 +14,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from astakosclient import AstakosClient
+from astakosclient.errors import Unauthorized
 from django.conf import settings
+from snf_django.lib.tokencache import get_token_cache
 
 
 def get_token(request):
@@ -38,7 +40,12 @@ def get_client_ip(request):
 
 
 def retrieve_user(token, astakos_auth_url, logger=None, client_ip=None):
-    """Return user_info retrieved from astakos for the given token"""
+    """Return user_info retrieved from astakos for the given token
+
+    The user info is cached, if the token cache is enabled, so that Astakos
+    is not asked again for the same token.
+
+    """
     astakos_url = astakos_auth_url
     if astakos_url is None:
         try:
@@ -56,8 +63,21 @@ def retrieve_user(token, astakos_auth_url, logger=None, client_ip=None):
     if client_ip:
         headers = {'X-Client-IP': client_ip}
 
+    cache = get_token_cache()
+    if cache.enabled:
+        user_info = cache.get(token)
+        if user_info is not None:
+            return user_info
+
     astakos = AstakosClient(token, astakos_url, use_pool=True, retry=2,
                             logger=logger, headers=headers)
-    user_info = astakos.authenticate()
+    try:
+        user_info = astakos.authenticate()
+    except Unauthorized as e:
+        if cache.enabled:
+            cache.set_invalid(token, e)
+        raise
 
+    if cache.enabled:
+        cache.set(token, user_info)
     return user_info
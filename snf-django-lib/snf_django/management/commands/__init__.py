@@ -18,13 +18,18 @@ import re
 import sys
 import datetime
 import logging
+from importlib import import_module
 from optparse import (make_option, OptionParser, OptionGroup,
                       TitledHelpFormatter)
 from synnefo import settings
+from django.apps import apps
+from django.db import connections, DEFAULT_DB_ALIAS
 from django.core.management.base import (BaseCommand,
                                          CommandError as DjangoCommandError)
 from django.core.exceptions import FieldError
+from django.db.models.fields import FieldDoesNotExist
 from snf_django.management import utils
+from snf_django.lib.db import search_indexes
 from snf_django.lib.astakos import UserCache
 from snf_django.utils.line_logging import NewlineStreamHandler
 
@@ -262,6 +267,11 @@ class ListCommand(SynnefoCommand):
 
     * Pretty printing output to a nice table.
 
+    With the "--stream" option, the results are fetched and printed in chunks
+    of ``stream_chunk_size`` objects, and ``handle_db_objects`` and
+    ``handle_output`` are called once per chunk. If all displayed fields are
+    plain model fields, only their columns are fetched from the database.
+
     """
 
     # The following fields must be handled in the ListCommand subclasses!
@@ -292,6 +302,9 @@ class ListCommand(SynnefoCommand):
     prefetch_related = []
     select_related = []
 
+    # Number of objects fetched at once with "--stream"
+    stream_chunk_size = 1000
+
     help = "Generic List Command"
     option_list = SynnefoCommand.option_list + (
         make_option(
@@ -323,6 +336,14 @@ class ListCommand(SynnefoCommand):
             action="store_false",
             default=True,
             help="Do not display headers"),
+        make_option(
+            "--stream",
+            dest="stream",
+            action="store_true",
+            default=False,
+            help="Print the results while they are fetched, in chunks,"
+                 " instead of loading them all in memory. The pretty"
+                 " output format aligns the columns to the first chunk"),
     )
 
     def __init__(self, *args, **kwargs):
@@ -459,6 +480,29 @@ class ListCommand(SynnefoCommand):
         if USER_EMAIL_FIELD in self.fields:
             if '_user_email' in self.object_class._meta.get_all_field_names():
                 raise RuntimeError("%s has already a 'user_mail' attribute")
+
+        headers = self.fields
+        output_format = options["output_format"]
+        if options["stream"]:
+            table = self.stream_rows(objects, **options)
+            if output_format != "json" and not options["headers"]:
+                headers = None
+            utils.pprint_table_stream(self.stdout, table, headers,
+                                      output_format,
+                                      sample_size=self.stream_chunk_size)
+            return
+
+        objects = list(objects)
+        table = self.get_rows(objects, **options)
+
+        # Print output
+        if output_format != "json" and not options["headers"]:
+            headers = None
+        utils.pprint_table(self.stdout, table, headers, output_format)
+
+    def get_rows(self, objects, **options):
+        """Return the table rows of a list of objects."""
+        if USER_EMAIL_FIELD in self.fields:
             uuids = [getattr(obj, self.user_uuid_field) for obj in objects]
             ucache = UserCache(self.astakos_auth_url, self.astakos_token)
             ucache.fetch_names(list(set(uuids)))
@@ -467,7 +511,6 @@ class ListCommand(SynnefoCommand):
                 obj._user_email = ucache.get_name(uuid)
 
         # Special handling of DB results
-        objects = list(objects)
         self.handle_db_objects(objects, **options)
 
         headers = self.fields
@@ -489,12 +532,78 @@ class ListCommand(SynnefoCommand):
 
         # Special handle of output
         self.handle_output(table, headers)
+        return table
+
+    def stream_rows(self, objects, **options):
+        """Yield the table rows of a queryset, fetching them in chunks."""
+        lookups = self.get_value_lookups()
+        if lookups is not None:
+            # Fetch only the displayed columns, after the primary key
+            objects = objects.prefetch_related(None)
+            objects = objects.values_list("pk", *lookups)
+            for chunk in self.get_chunks(objects, lambda row: row[0]):
+                for row in chunk:
+                    yield list(row[1:])
+            return
 
-        # Print output
-        output_format = options["output_format"]
-        if output_format != "json" and not options["headers"]:
-            headers = None
-        utils.pprint_table(self.stdout, table, headers, output_format)
+        for chunk in self.get_chunks(objects, lambda obj: obj.pk):
+            for row in self.get_rows(chunk, **options):
+                yield row
+
+    def get_chunks(self, objects, get_pk):
+        """Yield the results of a queryset in lists of up to
+        stream_chunk_size items.
+        """
+        size = self.stream_chunk_size
+        if self.order_by is not None:
+            offset = 0
+            while True:
+                chunk = list(objects[offset:offset + size])
+                if chunk:
+                    yield chunk
+                if len(chunk) < size:
+                    return
+                offset += size
+
+        # Ordered by primary key, continue after the last one instead of
+        # making the database skip an offset
+        chunk = list(objects[:size])
+        while chunk:
+            yield chunk
+            if len(chunk) < size:
+                return
+            last = get_pk(chunk[-1])
+            chunk = list(objects.filter(pk__gt=last)[:size])
+
+    def get_value_lookups(self):
+        """Return the values_list() lookups of the displayed fields, or None
+        if some field is not a plain (non-relation) field of the model.
+        """
+        def overridden(name):
+            return (getattr(type(self), name).im_func is not
+                    getattr(ListCommand, name).im_func)
+
+        if overridden("handle_db_objects") or overridden("handle_output"):
+            return None
+
+        lookups = []
+        for key in self.fields:
+            attr = self.FIELDS[key][0]
+            if callable(attr):
+                return None
+            model = self.object_class
+            attrs = attr.split(".")
+            for i, name in enumerate(attrs):
+                try:
+                    field = model._meta.get_field(name, many_to_many=False)
+                except FieldDoesNotExist:
+                    return None
+                if (field.rel is None) != (i == len(attrs) - 1):
+                    return None
+                if field.rel is not None:
+                    model = field.rel.to
+            lookups.append("__".join(attrs))
+        return lookups
 
     def handle_args(self, *args, **kwargs):
         pass
@@ -553,3 +662,31 @@ class RemoveCommand(SynnefoCommand):
         except ValueError:
             raise CommandError("Unaccepted input value. Please choose yes/no"
                                " (y/n).")
+
+
+class SearchIndexesCommand(SynnefoCommand):
+    """Generic command that creates the indexes of the admin searches.
+
+    'migration' is the module of the migration that creates the indexes of
+    the app, which defines them in SEARCH_INDEXES.
+    """
+
+    help = """Create the indexes of the searches of the admin dashboard
+
+The migrations skip these indexes if the pg_trgm extension of PostgreSQL is
+not enabled. Run this command after a superuser has enabled it with
+'CREATE EXTENSION pg_trgm'. The indexes that exist are kept and the rest are
+built concurrently, without blocking writes to the tables, so the command can
+be run again at any time.
+"""
+
+    migration = None
+
+    def handle(self, **options):
+        indexes = import_module(self.migration).SEARCH_INDEXES
+        created = search_indexes.create_search_indexes(
+            connections[DEFAULT_DB_ALIAS], indexes, apps.get_model)
+        if created is None:
+            raise CommandError("The pg_trgm extension of PostgreSQL is not"
+                               " enabled")
+        self.stdout.write("Created %d indexes\n" % len(created))
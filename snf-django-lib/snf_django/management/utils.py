@@ -18,6 +18,8 @@ import operator
 import locale
 import unicodedata
 
+from itertools import chain, islice
+
 from datetime import datetime
 from django.utils.timesince import timesince, timeuntil
 from django.db.models.query import QuerySet
@@ -248,3 +250,57 @@ def pprint_table(out, table, headers=None, output_format='pretty',
                 out.write(line + "\n")
     else:
         raise ValueError("Unknown output format '%s'" % output_format)
+
+
+def pprint_table_stream(out, rows, headers=None, output_format='pretty',
+                        separator=None, sample_size=1000):
+    """Print the rows of an iterable as they are produced.
+
+    Unlike 'pprint_table', the rows are not kept in memory. The JSON output
+    has one row per line and the pretty output aligns the columns to the
+    widths of the first 'sample_size' rows; longer values are not truncated.
+    """
+
+    if headers:
+        assert(isinstance(headers, (list, tuple))), "Invalid headers type"
+        headers = map(smart_unicode, headers)
+
+    def convert(row):
+        row = map(smart_unicode, row)
+        if output_format != "json":
+            row = [escape_ctrl_chars(c) for c in row]
+        return row
+
+    rows = (convert(row) for row in rows)
+
+    if output_format == "json":
+        assert(headers is not None), "json output format requires headers"
+        sep = "["
+        for row in rows:
+            out.write(sep + json.dumps(dict(zip(headers, row))) + "\n")
+            sep = ","
+        out.write("[]\n" if sep == "[" else "]\n")
+    elif output_format == "csv":
+        enc = locale.getpreferredencoding()
+        cw = UnicodeWriter(out, encoding=enc)
+        if headers:
+            cw.writerow(headers)
+        for row in rows:
+            cw.writerow(row)
+    elif output_format == "pretty":
+        sep = separator if separator else "  "
+        sample = list(islice(rows, sample_size))
+        columns = [headers] + sample if headers else sample
+        widths = [max(map(len, col)) for col in zip(*(columns))]
+
+        t_length = sum(widths) + len(sep) * (len(widths) - 1)
+        if headers:
+            line = sep.join(v.rjust(w) for v, w in zip(headers, widths))
+            out.write(line + "\n")
+            out.write("-" * t_length + "\n")
+
+        for row in chain(sample, rows):
+            line = sep.join(v.rjust(w) for v, w in zip(row, widths))
+            out.write(line + "\n")
+    else:
+        raise ValueError("Unknown output format '%s'" % output_format)
@@ -33,7 +33,8 @@ from pithos.api.util import (
     validate_matching_preconditions, split_container_object_string,
     copy_or_move_object, get_int_parameter, get_content_length,
     get_content_range, socket_read_iterator, SaveToBackendHandler,
-    object_data_response, put_object_block, hashmap_md5, simple_list_response,
+    object_data_response, put_object_block, block_uploader, hashmap_md5,
+    simple_list_response,
     api_method, is_uuid, retrieve_uuid, retrieve_uuids,
     retrieve_displaynames, Checksum, NoChecksum
 )
@@ -483,12 +484,17 @@ def container_update(request, v_account, v_container):
         request.backend.can_write_container(request.user_uniq, v_account,
                                             v_container)
 
-        for data in socket_read_iterator(request, content_length,
-                                         request.backend.block_size):
-            # TODO: Raise 408 (Request Timeout) if this takes too long.
-            # TODO: Raise 499 (Client Disconnect) if a length is defined
-            #       and we stop before getting this much data.
-            hashmap.append(request.backend.put_block(data))
+        uploader = block_uploader(request)
+        try:
+            for data in socket_read_iterator(request, content_length,
+                                             request.backend.block_size):
+                # TODO: Raise 408 (Request Timeout) if this takes too long.
+                # TODO: Raise 499 (Client Disconnect) if a length is defined
+                #       and we stop before getting this much data.
+                uploader.put(data)
+            hashmap = uploader.finish()
+        finally:
+            uploader.close()
 
     response = HttpResponse(status=202)
     if hashmap:
@@ -939,15 +945,19 @@ def object_write(request, v_account, v_container, v_object):
         etag = request.META.get('HTTP_ETAG')
         checksum_compute = Checksum() if etag or UPDATE_MD5 else NoChecksum()
         size = 0
-        hashmap = []
-        for data in socket_read_iterator(request, content_length,
-                                         request.backend.block_size):
-            # TODO: Raise 408 (Request Timeout) if this takes too long.
-            # TODO: Raise 499 (Client Disconnect) if a length is defined
-            #       and we stop before getting this much data.
-            size += len(data)
-            hashmap.append(request.backend.put_block(data))
-            checksum_compute.update(data)
+        uploader = block_uploader(request)
+        try:
+            for data in socket_read_iterator(request, content_length,
+                                             request.backend.block_size):
+                # TODO: Raise 408 (Request Timeout) if this takes too long.
+                # TODO: Raise 499 (Client Disconnect) if a length is defined
+                #       and we stop before getting this much data.
+                size += len(data)
+                uploader.put(data)
+                checksum_compute.update(data)
+            hashmap = uploader.finish()
+        finally:
+            uploader.close()
 
         checksum = checksum_compute.hexdigest()
         if etag and parse_etags(etag)[0].lower() != checksum:
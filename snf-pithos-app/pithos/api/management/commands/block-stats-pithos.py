@@ -0,0 +1,120 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import CommandError
+from optparse import make_option
+
+from pithos.api.util import get_backend
+from pithos.backends.modular import DEFAULT_BLOCK_REFS_BATCH_SIZE
+from snf_django.management.commands import SynnefoCommand
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def ratio(logical, physical):
+    if not physical:
+        return "-"
+    return "%.2f" % (float(logical) / physical)
+
+
+class Command(SynnefoCommand):
+    help = """Report the deduplication of the Pithos blocks
+
+Pithos stores every block once, no matter how many objects, versions and
+accounts share it. Without options, this command reports the size of all
+stored blocks and the total size of their references. With '--account',
+it reports per container of the account the size of the versions, the size
+of their distinct blocks and the size of the blocks no other account or
+container references, i.e. the size that deleting them would free.
+
+Pithos counts the references of each block as maps are stored and
+removed. Run with '--rebuild' once after upgrading, or after tracking the
+references has been disabled, to count the references of the existing
+maps. Pithos must be offline while '--rebuild' runs, or the references of
+the maps stored or removed meanwhile may be lost or counted twice.
+"""
+
+    option_list = SynnefoCommand.option_list + (
+        make_option('--account',
+                    dest='account',
+                    help="Report the containers of this account"),
+        make_option('--container',
+                    dest='container',
+                    help="Report only this container of the account"),
+        make_option('--rebuild',
+                    dest='rebuild',
+                    action='store_true',
+                    default=False,
+                    help="Recount the block references of all maps."
+                         " Pithos must be offline while this runs"),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=DEFAULT_BLOCK_REFS_BATCH_SIZE,
+                    help="Number of maps recounted in each transaction "
+                         "(default: %s)" % DEFAULT_BLOCK_REFS_BATCH_SIZE),
+    )
+
+    def handle(self, **options):
+        account = options['account']
+        container = options['container']
+        if container and not account:
+            raise CommandError("--container requires --account")
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size must be a positive integer")
+
+        b = get_backend()
+        try:
+            if options['rebuild']:
+                self.rebuild(b, options['batch_size'])
+            stats = b.get_block_stats(account, container)
+        except Exception as e:
+            logger.exception(e)
+            raise CommandError(e)
+        finally:
+            b.close()
+
+        output_format = options['output_format']
+        if account is None:
+            if not stats['built']:
+                self.stderr.write("Block references have not been counted"
+                                  " for the existing maps. Run with"
+                                  " '--rebuild'.\n")
+            headers = ("Blocks", "Logical", "Physical", "Ratio")
+            table = [(stats['blocks'], stats['logical'], stats['physical'],
+                      ratio(stats['logical'], stats['physical']))]
+        else:
+            headers = ("Container", "Versions", "Logical", "Physical",
+                       "Ratio", "Exclusive")
+            table = [(s['name'] or "(total)", s['versions'], s['logical'],
+                      s['physical'], ratio(s['logical'], s['physical']),
+                      s['exclusive']) for s in stats]
+        self.pprint_table(table, headers, output_format)
+
+    def rebuild(self, b, batch_size):
+        self.stderr.write("Recounting the block references of all maps."
+                          " Pithos must not serve any requests until this"
+                          " completes.\n")
+        marker = None
+        count = 0
+        while True:
+            marker = b.rebuild_block_refs(marker, batch_size)
+            if marker is None:
+                break
+            count += batch_size
+            self.stderr.write("Recounted the blocks of %d maps\n" % count)
+        self.stderr.write("Recounted the block references of all maps\n")
@@ -0,0 +1,128 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import CommandError
+from operator import itemgetter
+from optparse import make_option
+from time import time, sleep
+
+from pithos.api.util import get_backend
+from pithos.backends.modular import (DEFAULT_BLOCK_REFS_BATCH_SIZE,
+                                     DEFAULT_GC_GRACE)
+from snf_django.management.commands import SynnefoCommand
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(SynnefoCommand):
+    help = """Delete the Pithos maps and blocks that are no longer used
+
+Purging versions releases their maps, and the blocks that no other map
+references. This command deletes the released maps and the unreferenced
+blocks from the block store, in batches of one transaction each. It can be
+interrupted and run again at any time.
+
+Blocks are deleted only after they have stayed unreferenced for the grace
+period, which also protects the blocks uploaded for objects whose maps have
+not been stored yet. The grace period must be longer than any upload.
+
+The block references must have been counted with
+'snf-manage block-stats-pithos --rebuild' first. Only the local file block
+store supports deleting blocks.
+"""
+
+    option_list = SynnefoCommand.option_list + (
+        make_option('--grace',
+                    dest='grace',
+                    type='int',
+                    default=DEFAULT_GC_GRACE,
+                    help="Seconds that a map or block must have been unused"
+                         " before it is deleted (default: %s)"
+                         % DEFAULT_GC_GRACE),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=DEFAULT_BLOCK_REFS_BATCH_SIZE,
+                    help="Number of maps or blocks deleted in each"
+                         " transaction (default: %s)"
+                         % DEFAULT_BLOCK_REFS_BATCH_SIZE),
+        make_option('--rate',
+                    dest='rate',
+                    type='float',
+                    default=0,
+                    help="Maximum number of maps or blocks deleted per"
+                         " second (default: no limit)"),
+        make_option('--dry-run',
+                    dest='dry_run',
+                    action='store_true',
+                    default=False,
+                    help="Only report what would be deleted"),
+    )
+
+    def handle(self, **options):
+        if options['grace'] < 0:
+            raise CommandError("--grace must not be negative")
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size must be a positive integer")
+        if options['rate'] < 0:
+            raise CommandError("--rate must not be negative")
+
+        b = get_backend()
+        try:
+            # Maps are returned as their names, blocks as (hash, size)
+            maps = self.collect(b.collect_maps, "maps", options,
+                                get_marker=lambda mapfile: mapfile)[0]
+            blocks, size = self.collect(b.collect_blocks, "blocks", options,
+                                        get_marker=itemgetter(0),
+                                        get_size=itemgetter(1))
+        except Exception as e:
+            logger.exception(e)
+            raise CommandError(e)
+        finally:
+            b.close()
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write("%s %d maps and %d blocks of %d bytes\n" %
+                          (verb, maps, blocks, size))
+
+    def collect(self, method, name, options, get_marker, get_size=None):
+        """Call method in batches and return the number of items
+           and their total size.
+
+        get_marker returns the marker of the next batch from the last item
+        of a batch, and get_size, if given, the size of an item.
+        """
+
+        count = size = 0
+        marker = None
+        start = time()
+        while True:
+            batch = method(grace=options['grace'], marker=marker,
+                           limit=options['batch_size'],
+                           dry_run=options['dry_run'])
+            count += len(batch)
+            if get_size is not None:
+                size += sum(get_size(item) for item in batch)
+            if batch:
+                marker = get_marker(batch[-1])
+            if len(batch) < options['batch_size']:
+                return count, size
+            self.stderr.write("Processed %d %s\n" % (count, name))
+            if options['rate']:
+                delay = count / options['rate'] - (time() - start)
+                if delay > 0:
+                    sleep(delay)
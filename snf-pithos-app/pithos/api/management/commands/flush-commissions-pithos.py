@@ -0,0 +1,87 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from django.core.management.base import CommandError
+from optparse import make_option
+
+from pithos.api.util import get_backend
+from pithos.backends.modular import DEFAULT_COMMISSION_BATCH_SIZE
+from snf_django.management.commands import SynnefoCommand
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(SynnefoCommand):
+    help = """Issue the size changes recorded by Pithos to Astakos
+
+When PITHOS_BACKEND_BATCH_COMMISSIONS is set, Pithos records the size
+changes of its operations locally instead of issuing a commission per
+request. This command sums them up per user and project and issues them
+in batched commissions. Run it periodically, or keep it running with
+'--interval'.
+"""
+
+    option_list = SynnefoCommand.option_list + (
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=DEFAULT_COMMISSION_BATCH_SIZE,
+                    help="Maximum number of size changes issued in one "
+                         "commission (default: %s)" %
+                         DEFAULT_COMMISSION_BATCH_SIZE),
+        make_option('--interval',
+                    dest='interval',
+                    type='int',
+                    default=0,
+                    help="Keep running, issuing the recorded size changes "
+                         "every INTERVAL seconds"),
+    )
+
+    def handle(self, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+        if batch_size <= 0:
+            raise CommandError("--batch-size must be a positive integer")
+        if interval < 0:
+            raise CommandError("--interval must be a positive integer")
+
+        while True:
+            try:
+                count = self.flush(batch_size)
+            except Exception as e:
+                logger.exception(e)
+                if not interval:
+                    raise CommandError(e)
+            else:
+                self.stdout.write("Issued %d size changes\n" % count)
+            if not interval:
+                return
+            time.sleep(interval)
+
+    def flush(self, batch_size):
+        total = 0
+        b = get_backend()
+        try:
+            while True:
+                count = b.issue_pending_commissions(limit=batch_size)
+                total += count
+                if count < batch_size:
+                    return total
+        finally:
+            b.close()
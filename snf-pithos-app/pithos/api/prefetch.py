@@ -0,0 +1,163 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Read-ahead of object blocks on the download path.
+
+While a response streams the data of one block, the blocks that follow it
+are fetched by a bounded pool of worker threads (greenlets, under the
+gevent gunicorn worker), so that downloads are not limited by the latency
+of a single block read.
+"""
+
+import os
+import threading
+from collections import deque
+from Queue import Queue
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Process-wide prefetch counters. A hit is a block that had already been
+# fetched when the response needed it, a miss one that had to be waited for.
+prefetch_stats = {'hits': 0, 'misses': 0}
+
+
+class FetchResult(object):
+    """The pending result of a block fetch."""
+
+    __slots__ = ('event', 'data', 'error', 'notify')
+
+    def __init__(self, notify=None):
+        self.event = threading.Event()
+        self.data = None
+        self.error = None
+        self.notify = notify
+
+    def set(self, data=None, error=None):
+        self.data = data
+        self.error = error
+        self.event.set()
+        if self.notify is not None:
+            self.notify.put(self)
+
+    def done(self):
+        return self.event.is_set()
+
+    def get(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.data
+
+
+class FetchPool(object):
+    """A bounded pool of worker threads that fetch blocks.
+
+    Workers are started on first use, and again in a forked child process,
+    so that a pool created at import time is safe to use in gunicorn
+    workers.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.pid = None
+        self.queue = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.queue = Queue()
+        for i in xrange(self.size):
+            t = threading.Thread(target=self._work, args=(self.queue,))
+            t.daemon = True
+            t.start()
+        self.pid = os.getpid()
+
+    @staticmethod
+    def _work(queue):
+        while True:
+            fetch, hash, result = queue.get()
+            try:
+                result.set(data=fetch(hash))
+            except Exception as e:
+                result.set(error=e)
+
+    def submit(self, fetch, hash, notify=None):
+        """Schedule fetch(hash) and return a FetchResult for it.
+
+        If given, the result is put in the 'notify' queue once it is set.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                self._start()
+        result = FetchResult(notify)
+        self.queue.put((fetch, hash, result))
+        return result
+
+
+class BlockPrefetcher(object):
+    """Fetch the blocks of a list of hashes ahead of their use.
+
+    Blocks must be requested with get() in the order of the list. Whenever
+    a block is requested, up to `window` of the blocks that follow it are
+    scheduled on the pool.
+    """
+
+    def __init__(self, pool, fetch, hashes, window):
+        self.pool = pool
+        self.fetch = fetch
+        self.hashes = hashes
+        self.window = window
+        self.pending = deque()
+        self.index = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _fill(self):
+        hashes = self.hashes
+        while len(self.pending) < self.window and self.index < len(hashes):
+            h = hashes[self.index]
+            self.pending.append((h, self.pool.submit(self.fetch, h)))
+            self.index += 1
+
+    def get(self, hash):
+        """Return the data of the block with the given hash."""
+        self._fill()
+        if not self.pending or self.pending[0][0] != hash:
+            # The caller left the expected sequence. Drop what has been
+            # scheduled and fall back to plain fetching.
+            logger.warning("Block prefetch out of sequence, disabling it")
+            self.pending.clear()
+            self.index = len(self.hashes)
+            self.misses += 1
+            prefetch_stats['misses'] += 1
+            return self.fetch(hash)
+
+        h, result = self.pending.popleft()
+        if result.done():
+            self.hits += 1
+            prefetch_stats['hits'] += 1
+        else:
+            self.misses += 1
+            prefetch_stats['misses'] += 1
+        data = result.get()
+        self._fill()
+        return data
+
+    def close(self):
+        self.pending.clear()
+        self.index = len(self.hashes)
+        logger.debug("Block prefetch: %d hits, %d misses",
+                     self.hits, self.misses)
@@ -136,9 +136,38 @@ BACKEND_POOL_ENABLED = getattr(settings, 'PITHOS_BACKEND_POOL_ENABLED', True)
 # Default backend pool size
 BACKEND_POOL_SIZE = getattr(settings, 'PITHOS_BACKEND_POOL_SIZE', 5)
 
+# Record the size changes of Pithos operations locally instead of issuing a
+# commission to the quotaholder on every request. The recorded changes are
+# issued in batches by 'snf-manage flush-commissions-pithos', while quota
+# limits are checked against the quotas fetched from the quotaholder, which
+# are cached for BACKEND_QUOTA_CACHE_TIMEOUT seconds.
+BACKEND_BATCH_COMMISSIONS = getattr(settings,
+                                    'PITHOS_BACKEND_BATCH_COMMISSIONS', False)
+BACKEND_QUOTA_CACHE_TIMEOUT = getattr(
+    settings, 'PITHOS_BACKEND_QUOTA_CACHE_TIMEOUT', 60)
+
+# Count the references of the stored blocks, so that the unreferenced blocks
+# can be collected. Without it, 'snf-manage block-stats-pithos --rebuild' must
+# be run before blocks are collected again.
+BACKEND_TRACK_BLOCK_REFS = getattr(settings,
+                                   'PITHOS_BACKEND_TRACK_BLOCK_REFS', True)
+
 # Update object checksums.
 UPDATE_MD5 = getattr(settings, 'PITHOS_UPDATE_MD5', False)
 
+# The number of uploaded blocks that are buffered and stored in one batch
+# during an object PUT. Each buffered block uses up to BACKEND_BLOCK_SIZE
+# bytes of memory.
+UPLOAD_BLOCK_BATCH = getattr(settings, 'PITHOS_UPLOAD_BLOCK_BATCH', 4)
+
+# The number of batches of uploaded blocks that are hashed and stored while
+# the request reads the following blocks (0 stores each batch before reading
+# on), and the size of the per-process pool of workers that store them.
+UPLOAD_PIPELINE_BATCHES = getattr(settings, 'PITHOS_UPLOAD_PIPELINE_BATCHES',
+                                  2)
+UPLOAD_PIPELINE_WORKERS = getattr(settings, 'PITHOS_UPLOAD_PIPELINE_WORKERS',
+                                  16)
+
 # This enables a ui compatibility layer for the introduction of UUIDs in
 # identity management.  WARNING: Setting to True will break your installation.
 TRANSLATE_UUIDS = getattr(settings, 'PITHOS_TRANSLATE_UUIDS', False)
@@ -152,6 +181,17 @@ PUBLIC_URL_ALPHABET = getattr(
     'PITHOS_PUBLIC_URL_ALPHABET',
     '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
 
+# The number of blocks fetched ahead while an object is being downloaded
+# (0 disables read-ahead), the size of the per-process pool of workers that
+# fetch them, and the maximum memory, in bytes, one download may hold in
+# fetched blocks.
+DOWNLOAD_PREFETCH_BLOCKS = getattr(settings,
+                                   'PITHOS_DOWNLOAD_PREFETCH_BLOCKS', 4)
+DOWNLOAD_PREFETCH_WORKERS = getattr(settings,
+                                    'PITHOS_DOWNLOAD_PREFETCH_WORKERS', 16)
+DOWNLOAD_PREFETCH_MAX_MEMORY = getattr(
+    settings, 'PITHOS_DOWNLOAD_PREFETCH_MAX_MEMORY', 32 * 1024 * 1024)
+
 # The maximum number or items returned by the listing api methods
 API_LIST_LIMIT = getattr(settings, 'PITHOS_API_LIST_LIMIT', 10000)
 
@@ -22,6 +22,8 @@ from pithos.api.test.util import strnextling, get_random_data, get_random_name
 
 from synnefo.lib import join_urls
 
+from mock import patch
+
 import json
 from django.utils.http import urlencode
 
@@ -618,6 +620,31 @@ class ContainerGet(PithosAPITest):
             objects.remove('')
         self.assertEquals(['photos/me.jpg'], objects)
 
+    def test_list_pseudo_hierarchical_folders_seek(self):
+        # Fetch a few rows per query, so that batches end both inside and
+        # outside of the common prefixes found, and the listing either seeks
+        # past the prefix or continues after the last path of the batch.
+        url = join_urls(self.pithos_path, self.user, 'apples')
+        for batch_size in [1, 2, 3]:
+            with patch(
+                    'pithos.backends.lib.sqlalchemy.node.LISTING_BATCH_SIZE',
+                    batch_size):
+                r = self.get('%s?prefix=photos/&delimiter=/' % url)
+                self.assertEqual(r.status_code, 200)
+                objects = r.content.split('\n')
+                if '' in objects:
+                    objects.remove('')
+                self.assertEquals(
+                    ['photos/animals/', 'photos/me.jpg', 'photos/plants/'],
+                    objects)
+
+                r = self.get('%s?prefix=photos/&delimiter=/&limit=2' % url)
+                objects = r.content.split('\n')
+                if '' in objects:
+                    objects.remove('')
+                self.assertEquals(['photos/animals/', 'photos/me.jpg'],
+                                  objects)
+
     def test_extended_list_json(self):
         url = join_urls(self.pithos_path, self.user, 'apples')
         params = {'format': 'json', 'limit': 2, 'prefix': 'photos/animals',
@@ -978,6 +1005,23 @@ class ContainerPost(PithosAPITest):
         r = self.post(url, data=get_random_data())
         self.assertEqual(r.status_code, 403)
 
+    def test_upload_blocks_pipeline(self):
+        cname = self.create_container()[0]
+        url = join_urls(self.pithos_path, self.user, cname)
+        block_size = pithos_settings.BACKEND_BLOCK_SIZE
+        data = get_random_data(length=5 * block_size + 10)
+
+        hashmaps = []
+        for batches in (0, 2):
+            with patch('pithos.api.util.UPLOAD_BLOCK_BATCH', 2):
+                with patch('pithos.api.util.UPLOAD_PIPELINE_BATCHES',
+                           batches):
+                    r = self.post(url, data=data)
+            self.assertEqual(r.status_code, 202)
+            hashmaps.append(r.content.split())
+        self.assertEqual(len(hashmaps[0]), 6)
+        self.assertEqual(hashmaps[0], hashmaps[1])
+
 
 class ContainerDelete(PithosAPITest):
     def setUp(self):
@@ -21,6 +21,7 @@ from collections import defaultdict
 from urllib import quote, unquote
 from functools import partial
 from unittest import skipIf
+from mock import patch
 
 from pithos.api.test import (PithosAPITest, pithos_settings,
                              AssertMappingInvariant, AssertUUidInvariant,
@@ -28,6 +29,7 @@ from pithos.api.test import (PithosAPITest, pithos_settings,
                              DATE_FORMATS, pithos_test_settings)
 from pithos.api.test.util import (md5_hash, merkle, strnextling,
                                   get_random_data, get_random_name, HashMap)
+from pithos.api.prefetch import prefetch_stats
 
 from synnefo.lib import join_urls
 
@@ -406,6 +408,29 @@ class ObjectGet(PithosAPITest):
             self.assertEquals(fdata, sdata)
             i += 1
 
+    def test_get_prefetch(self):
+        cname = self.containers[0]
+        length = 5 * TEST_BLOCK_SIZE + 10
+        oname, odata = self.upload_object(cname, length=length)[:-1]
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+
+        with patch('pithos.api.util.DOWNLOAD_PREFETCH_BLOCKS', 0):
+            r = self.get(url)
+            self.assertEqual("".join(r.streaming_content), odata)
+
+        fetched = prefetch_stats['hits'] + prefetch_stats['misses']
+        with patch('pithos.api.util.DOWNLOAD_PREFETCH_BLOCKS', 3):
+            r = self.get(url)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual("".join(r.streaming_content), odata)
+
+            offset = TEST_BLOCK_SIZE + 1
+            r = self.get(url, HTTP_RANGE='bytes=%d-' % offset)
+            self.assertEqual(r.status_code, 206)
+            self.assertEqual("".join(r.streaming_content), odata[offset:])
+        self.assertEqual(prefetch_stats['hits'] + prefetch_stats['misses'],
+                         fetched + 6 + 5)
+
     def test_multiple_range_not_satisfiable(self):
         # perform get with multiple range
         cname = self.containers[0]
@@ -823,6 +848,26 @@ class ObjectPut(PithosAPITest):
         hash = merkle('')
         self.assertEqual(hashes, [hash])
 
+    def test_upload_pipeline(self):
+        cname = self.container
+        data = get_random_data(length=7 * TEST_BLOCK_SIZE + 10)
+        blocks = [data[i:i + TEST_BLOCK_SIZE]
+                  for i in xrange(0, len(data), TEST_BLOCK_SIZE)]
+        for batches in (0, 1, 2):
+            oname = get_random_name()
+            url = join_urls(self.pithos_path, self.user, cname, oname)
+            with patch('pithos.api.util.UPLOAD_BLOCK_BATCH', 2):
+                with patch('pithos.api.util.UPLOAD_PIPELINE_BATCHES',
+                           batches):
+                    r = self.put(url, data=data)
+            self.assertEqual(r.status_code, 201)
+
+            r = self.get('%s?hashmap=&format=json' % url)
+            self.assertEqual(json.loads(r.content)['hashes'],
+                             [merkle(b) for b in blocks])
+            r = self.get(url)
+            self.assertEqual("".join(r.streaming_content), data)
+
     def test_create_object_by_hashmap(self):
         cname = self.container
         block_size = pithos_settings.BACKEND_BLOCK_SIZE
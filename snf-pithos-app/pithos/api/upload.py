@@ -0,0 +1,118 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pipelined storing of object blocks on the upload path.
+
+While a request reads the following blocks from the socket, the blocks it
+has already read are hashed and stored in batches by a bounded pool of
+worker threads. The blocks of each batch are marked in the block reference
+table by the request thread, which owns the database connection, between
+hashing and storing them.
+"""
+
+from collections import deque
+from functools import partial
+from Queue import Queue
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BlockUploader(object):
+    """Store blocks in batches and collect their hashes in order.
+
+    Blocks are given with put(), in the order of the object. Up to `window`
+    batches of `batch` blocks are hashed or stored at a time on the pool;
+    with a `window` of 0, every batch is stored with put_blocks() in the
+    calling thread.
+    """
+
+    def __init__(self, backend, pool, batch, window):
+        self.backend = backend
+        self.pool = pool
+        self.batch = max(1, batch)
+        self.window = window
+        self.blocks = []
+        self.pending = deque()
+        self.hashmap = []
+        # Every finished hash or store task is put here, to wake up _collect.
+        self.done = Queue()
+
+    def put(self, data):
+        self.blocks.append(data)
+        if len(self.blocks) >= self.batch:
+            self._flush()
+
+    def _flush(self):
+        blocks, self.blocks = self.blocks, []
+        if not blocks:
+            return
+        if self.window <= 0:
+            self.hashmap.extend(self.backend.put_blocks(blocks))
+            return
+        # Each entry is [blocks, hash result, store result].
+        self.pending.append(
+            [blocks, self._submit(self.backend.hash_blocks, blocks), None])
+        self._store_hashed()
+        while len(self.pending) > self.window:
+            self._collect()
+
+    def _submit(self, func, blocks):
+        return self.pool.submit(func, blocks, notify=self.done)
+
+    def _store(self, entry):
+        blocks, hashed = entry[:2]
+        hashes = hashed.get()
+        self.backend.touch_blocks(hashes, [len(b) for b in blocks])
+        entry[2] = self._submit(
+            partial(self.backend.store_blocks, hashes=hashes), blocks)
+
+    def _store_hashed(self):
+        for entry in self.pending:
+            if entry[2] is None and entry[1].done():
+                self._store(entry)
+
+    def _collect(self):
+        # Wait for the first batch to be stored, storing the batches that
+        # are hashed in the meantime.
+        entry = self.pending[0]
+        while True:
+            self._store_hashed()
+            if entry[2] is not None and entry[2].done():
+                break
+            self.done.get()
+        self.hashmap.extend(entry[2].get())
+        self.pending.popleft()
+
+    def finish(self):
+        """Store the remaining blocks and return the hashmap."""
+        self._flush()
+        while self.pending:
+            self._collect()
+        return self.hashmap
+
+    def close(self):
+        """Wait for the batches in flight, ignoring their errors.
+
+        This keeps the backend from being used by the pool after the request
+        has released it.
+        """
+        while self.pending:
+            blocks, hashed, stored = self.pending.popleft()
+            for result in (hashed, stored):
+                if result is not None:
+                    result.event.wait()
+        self.blocks = []
@@ -55,7 +55,18 @@ from pithos.api.settings import (BACKEND_DB_MODULE, BACKEND_DB_CONNECTION,
                                  BASE_HOST, UPDATE_MD5, VIEW_PREFIX,
                                  OAUTH2_CLIENT_CREDENTIALS, UNSAFE_DOMAIN,
                                  RESOURCE_MAX_METADATA, ACC_MAX_GROUPS,
-                                 ACC_MAX_GROUP_MEMBERS)
+                                 ACC_MAX_GROUP_MEMBERS,
+                                 BACKEND_BATCH_COMMISSIONS,
+                                 BACKEND_QUOTA_CACHE_TIMEOUT,
+                                 BACKEND_TRACK_BLOCK_REFS,
+                                 DOWNLOAD_PREFETCH_BLOCKS,
+                                 DOWNLOAD_PREFETCH_WORKERS,
+                                 DOWNLOAD_PREFETCH_MAX_MEMORY,
+                                 UPLOAD_BLOCK_BATCH,
+                                 UPLOAD_PIPELINE_BATCHES,
+                                 UPLOAD_PIPELINE_WORKERS)
+from pithos.api.prefetch import FetchPool, BlockPrefetcher
+from pithos.api.upload import BlockUploader
 
 from pithos.backends import connect_backend
 from pithos.backends.exceptions import (NotAllowedError, QuotaError,
@@ -814,7 +825,8 @@ class ObjectWrapper(object):
     in each entry of the range list.
     """
 
-    def __init__(self, backend, ranges, sizes, hashmaps, boundary, meta):
+    def __init__(self, backend, ranges, sizes, hashmaps, boundary, meta,
+                 prefetch_blocks=0, fetch_pool=None):
         self.backend = backend
         self.ranges = ranges
         self.sizes = sizes
@@ -831,9 +843,57 @@ class ObjectWrapper(object):
         self.range_index = -1
         self.offset, self.length = self.ranges[0]
 
+        self.prefetcher = None
+        if prefetch_blocks > 0 and fetch_pool is not None:
+            hashes = self._block_sequence()
+            if len(hashes) > 1:
+                self.prefetcher = BlockPrefetcher(
+                    fetch_pool, self._fetch_block, hashes, prefetch_blocks)
+
     def __iter__(self):
         return self
 
+    def _block_sequence(self):
+        """Return the hashes of the blocks that part_iterator will fetch,
+           in the order it will fetch them.
+        """
+        bs = self.backend.block_size
+        hashes = []
+        last = self.block_hash
+        for offset, length in self.ranges:
+            file_index = 0
+            while length > 0:
+                file_size = self.sizes[file_index]
+                while offset >= file_size:
+                    offset -= file_size
+                    file_index += 1
+                    file_size = self.sizes[file_index]
+                block_index = int(offset / bs)
+                h = self.hashmaps[file_index][block_index]
+                if h != last:
+                    hashes.append(h)
+                    last = h
+                bl = min(length, min((block_index + 1) * bs, file_size) -
+                         offset)
+                offset += bl
+                length -= bl
+        return hashes
+
+    def _fetch_block(self, hash):
+        # Blocks are fetched unpadded, and only padded in part_iterator if
+        # a read goes past the stored data, to avoid copying every block.
+        return self.backend.get_block(hash, padded=False)
+
+    def _get_block(self, hash):
+        if self.prefetcher is not None:
+            return self.prefetcher.get(hash)
+        return self._fetch_block(hash)
+
+    def close(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
     def part_iterator(self):
         if self.length > 0:
             # Get the file for the current offset.
@@ -850,7 +910,7 @@ class ObjectWrapper(object):
                 self.block_hash = self.hashmaps[
                     self.file_index][self.block_index]
                 try:
-                    self.block = self.backend.get_block(self.block_hash)
+                    self.block = self._get_block(self.block_hash)
                 except ItemNotExists:
                     raise faults.ItemNotFound('Block does not exist')
 
@@ -861,6 +921,9 @@ class ObjectWrapper(object):
                     self.sizes[self.file_index] % self.backend.block_size):
                 bs = self.sizes[self.file_index] % self.backend.block_size
             bl = min(self.length, bs - bo)
+            if bo + bl > len(self.block):
+                self.block += '\x00' * (bo + bl - len(self.block))
+            # Slicing a whole block returns the block itself, not a copy.
             data = self.block[bo:bo + bl]
             self.offset += bl
             self.length -= bl
@@ -901,6 +964,17 @@ class ObjectWrapper(object):
                 return '\r\n'.join(out)
 
 
+_block_fetch_pool = FetchPool(DOWNLOAD_PREFETCH_WORKERS)
+
+
+def _prefetch_window(block_size):
+    """Return how many blocks a download may fetch ahead.
+       The block being streamed is held in memory too.
+    """
+    max_blocks = DOWNLOAD_PREFETCH_MAX_MEMORY / block_size - 1
+    return max(0, min(DOWNLOAD_PREFETCH_BLOCKS, max_blocks))
+
+
 def object_data_response(request, sizes, hashmaps, meta, public=False):
     """Get the StreamingHttpResponse object for replying with the object's
        data."""
@@ -938,7 +1012,10 @@ def object_data_response(request, sizes, hashmaps, meta, public=False):
     else:
         boundary = ''
     wrapper = ObjectWrapper(request.backend, ranges, sizes, hashmaps,
-                            boundary, meta)
+                            boundary, meta,
+                            prefetch_blocks=_prefetch_window(
+                                request.backend.block_size),
+                            fetch_pool=_block_fetch_pool)
     response = StreamingHttpResponse(wrapper, status=ret)
     put_object_headers(
         response, meta, restricted=public,
@@ -959,6 +1036,16 @@ def object_data_response(request, sizes, hashmaps, meta, public=False):
     return response
 
 
+_block_store_pool = FetchPool(UPLOAD_PIPELINE_WORKERS)
+
+
+def block_uploader(request):
+    """Get a BlockUploader for storing the uploaded blocks of a request."""
+
+    return BlockUploader(request.backend, _block_store_pool,
+                         UPLOAD_BLOCK_BATCH, UPLOAD_PIPELINE_BATCHES)
+
+
 def put_object_block(request, hashmap, data, offset, is_snapshot):
     """Put one block of data at the given offset."""
 
@@ -1023,7 +1110,10 @@ BACKEND_KWARGS = dict(
     mapfile_prefix=BACKEND_MAPFILE_PREFIX,
     resource_max_metadata=RESOURCE_MAX_METADATA,
     acc_max_groups=ACC_MAX_GROUPS,
-    acc_max_group_members=ACC_MAX_GROUP_MEMBERS)
+    acc_max_group_members=ACC_MAX_GROUP_MEMBERS,
+    batch_commissions=BACKEND_BATCH_COMMISSIONS,
+    quota_cache_timeout=BACKEND_QUOTA_CACHE_TIMEOUT,
+    track_block_refs=BACKEND_TRACK_BLOCK_REFS)
 
 _pithos_backend_pool = PithosBackendPool(size=BACKEND_POOL_SIZE,
                                          **BACKEND_KWARGS)
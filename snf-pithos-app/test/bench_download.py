@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Copyright (C) 2010-2017 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the throughput of the Pithos object download path.
+
+Objects are served by pithos.api.util.ObjectWrapper from an in-memory block
+store, so that the numbers reflect the per-byte cost of the download path
+(block copying, slicing and padding) and not the storage latency. Run it on
+two revisions to compare them.
+"""
+
+import os
+from optparse import OptionParser
+from hashlib import sha256
+from time import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'synnefo.settings')
+
+from pithos.api.util import ObjectWrapper
+
+
+class MemoryBackend(object):
+    """The part of the backend interface used by ObjectWrapper."""
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.blocks = {}
+
+    def put_block(self, data):
+        h = sha256(data.rstrip('\x00')).hexdigest()
+        self.blocks[h] = bytearray(data)
+        return h
+
+    def get_block(self, hash, padded=True):
+        # Copy the block out, as a read from the block store would.
+        block = str(self.blocks[hash])
+        if padded:
+            block += '\x00' * (self.block_size - len(block))
+        return block
+
+
+def make_object(backend, size):
+    bs = backend.block_size
+    hashmap = [backend.put_block(os.urandom(min(bs, size - i)))
+               for i in xrange(0, size, bs)]
+    return hashmap
+
+
+def run(backend, size, hashmap, ranges, rounds):
+    boundary = 'b' * 32 if len(ranges) > 1 else ''
+    served = 0
+    start = time()
+    for i in xrange(rounds):
+        wrapper = ObjectWrapper(backend, ranges, [size], [hashmap],
+                                boundary, {})
+        for data in wrapper:
+            served += len(data)
+    elapsed = time() - start
+    return served / elapsed / (1024 * 1024)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--block-size', dest='block_size', type='int',
+                      default=4 * 1024 * 1024, help='Block size in bytes')
+    parser.add_option('--blocks', dest='blocks', type='int', default=64,
+                      help='Number of blocks in the object')
+    parser.add_option('--tail', dest='tail', type='int', default=12345,
+                      help='Size of the final partial block')
+    parser.add_option('--rounds', dest='rounds', type='int', default=10,
+                      help='Number of downloads per test')
+    (options, args) = parser.parse_args()
+
+    backend = MemoryBackend(options.block_size)
+    bs = options.block_size
+    size = options.blocks * bs + options.tail
+    hashmap = make_object(backend, size)
+
+    tests = [
+        ('full', [(0, size)]),
+        ('single range', [(bs / 2, size - bs)]),
+        ('multi range', [(0, bs / 2), (bs + 7, 3 * bs),
+                         (size - bs - options.tail, bs + options.tail)]),
+    ]
+    for name, ranges in tests:
+        rate = run(backend, size, hashmap, ranges, options.rounds)
+        print "%-15s %10.1f MB/s" % (name, rate)
+
+
+if __name__ == '__main__':
+    main()
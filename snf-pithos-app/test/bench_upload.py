@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright (C) 2010-2017 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the throughput of the Pithos object upload path.
+
+Blocks are stored by pithos.api.upload.BlockUploader in an in-memory block
+store that sleeps for '--latency' milliseconds per stored batch, the way a
+request to Archipelago or to a network file system does. Each test is run
+with serial storing (a window of 0) and with pipelined storing.
+"""
+
+from optparse import OptionParser
+from hashlib import sha256
+from time import time, sleep
+
+from pithos.api.prefetch import FetchPool
+from pithos.api.upload import BlockUploader
+
+
+class MemoryBackend(object):
+    """The part of the backend interface used by BlockUploader."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.blocks = {}
+
+    def hash_blocks(self, blocks):
+        return [sha256(data.rstrip('\x00')).hexdigest() for data in blocks]
+
+    def touch_blocks(self, hashes, sizes):
+        pass
+
+    def store_blocks(self, blocks, hashes=None):
+        if hashes is None:
+            hashes = self.hash_blocks(blocks)
+        sleep(self.latency)
+        self.blocks.update(zip(hashes, blocks))
+        return hashes
+
+    def put_blocks(self, blocks):
+        hashes = self.hash_blocks(blocks)
+        self.touch_blocks(hashes, map(len, blocks))
+        return self.store_blocks(blocks, hashes)
+
+
+def run(backend, pool, blocks, batch, window, rounds):
+    uploaded = 0
+    start = time()
+    for i in xrange(rounds):
+        uploader = BlockUploader(backend, pool, batch, window)
+        try:
+            for data in blocks:
+                uploader.put(data)
+                uploaded += len(data)
+            uploader.finish()
+        finally:
+            uploader.close()
+    elapsed = time() - start
+    return uploaded / elapsed / (1024 * 1024)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--block-size', dest='block_size', type='int',
+                      default=4 * 1024 * 1024, help='Block size in bytes')
+    parser.add_option('--blocks', dest='blocks', type='int', default=64,
+                      help='Number of blocks in the object')
+    parser.add_option('--latency', dest='latency', type='float', default=10,
+                      help='Milliseconds to store a batch of blocks')
+    parser.add_option('--batch', dest='batch', type='int', default=4,
+                      help='Blocks per stored batch')
+    parser.add_option('--window', dest='window', type='int', default=2,
+                      help='Batches in flight when pipelined')
+    parser.add_option('--workers', dest='workers', type='int', default=16,
+                      help='Number of storing workers')
+    parser.add_option('--rounds', dest='rounds', type='int', default=5,
+                      help='Number of uploads per test')
+    (options, args) = parser.parse_args()
+
+    backend = MemoryBackend(options.latency / 1000.0)
+    pool = FetchPool(options.workers)
+    # Distinct blocks, so that every block is hashed and stored.
+    block = 'x' * (options.block_size - 8)
+    blocks = ['%08d%s' % (i, block) for i in xrange(options.blocks)]
+
+    tests = [
+        ('serial', 0),
+        ('pipelined', options.window),
+    ]
+    for name, window in tests:
+        rate = run(backend, pool, blocks, options.batch, window,
+                   options.rounds)
+        print "%-15s %10.1f MB/s" % (name, rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import errno
+from mmap import mmap, ACCESS_READ
+from tempfile import mkstemp
+
+
+def shard_path(root, name, levels=3):
+    """Return the directory under root where name is kept.
+       The first 2 * levels characters of name are used as a directory
+       prefix, so that no single directory ends up with too many entries.
+    """
+    parts = [name[2 * i:2 * i + 2] for i in xrange(levels)]
+    return os.path.join(root, *parts)
+
+
+def makedirs(path, mode=0o777):
+    """Create path and its parents, ignoring an existing path."""
+    try:
+        os.makedirs(path, mode)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def file_read(path):
+    """Return the contents of the file at path, or None if it is missing.
+       Non-empty files are mapped in memory instead of being read
+       through the file object buffers.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        size = os.fstat(fd).st_size
+        if not size:
+            return ''
+        m = mmap(fd, size, access=ACCESS_READ)
+        try:
+            return m[:]
+        finally:
+            m.close()
+    finally:
+        os.close(fd)
+
+
+def file_write(path, data, mode=0o644, dirmode=0o755):
+    """Atomically write data to the file at path.
+       Data is written to a temporary file in the same directory, which is
+       then renamed over path, so readers never see a partial file.
+    """
+    dirname = os.path.dirname(path)
+    makedirs(dirname, dirmode)
+    fd, tmppath = mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(fd, buffer(data, written))
+            os.fchmod(fd, mode)
+        finally:
+            os.close(fd)
+        os.rename(tmppath, path)
+    except:
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+        raise
+
+
+def file_delete(path):
+    """Remove the file at path. Return False if it did not exist."""
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+    return True
@@ -0,0 +1,188 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from os.path import isdir, exists, realpath, join
+from hashlib import new as newhasher
+from binascii import hexlify
+from collections import defaultdict
+
+from context_file import (shard_path, makedirs, file_read, file_write,
+                          file_delete)
+
+
+class FileBlocker(object):
+    """Blocker that keeps blocks as files in a local directory tree.
+       Required constructor parameters: blocksize, blockpath, hashtype.
+       Optional: umask.
+    """
+
+    blocksize = None
+    blockpath = None
+    hashtype = None
+
+    def __init__(self, **params):
+        blocksize = params['blocksize']
+        blockpath = realpath(params['blockpath'])
+        umask = params.get('umask', 0o022)
+        if not isdir(blockpath):
+            if not exists(blockpath):
+                makedirs(blockpath, 0o777 & ~umask)
+            else:
+                raise ValueError("Variable blockpath '%s' is not a directory"
+                                 % (blockpath,))
+
+        hashtype = params['hashtype']
+        try:
+            hasher = newhasher(hashtype)
+        except ValueError:
+            msg = "Variable hashtype '%s' is not available from hashlib"
+            raise ValueError(msg % (hashtype,))
+
+        hasher.update("")
+        emptyhash = hasher.digest()
+
+        self.blocksize = blocksize
+        self.blockpath = blockpath
+        self.filemode = 0o666 & ~umask
+        self.dirmode = 0o777 & ~umask
+        self.hashtype = hashtype
+        self.hashlen = len(emptyhash)
+        self.emptyhash = emptyhash
+
+    def _pad(self, block):
+        return block + ('\x00' * (self.blocksize - len(block)))
+
+    def _block_path(self, blkhash):
+        name = hexlify(blkhash)
+        return join(shard_path(self.blockpath, name), name)
+
+    def _check_rear_blocks(self, hashes):
+        """Return the set of the given hashes that exist in storage.
+           Hashes are grouped by directory, so that every directory
+           is listed only once, however many hashes it holds.
+        """
+        bydir = defaultdict(set)
+        for h in hashes:
+            name = hexlify(h)
+            bydir[shard_path(self.blockpath, name)].add(name)
+
+        found = set()
+        for d, names in bydir.iteritems():
+            try:
+                entries = os.listdir(d)
+            except OSError:
+                continue
+            found.update(names.intersection(entries))
+        return set(h for h in hashes if hexlify(h) in found)
+
+    def block_hash(self, data):
+        """Hash a block of data"""
+        hasher = newhasher(self.hashtype)
+        hasher.update(data.rstrip('\x00'))
+        return hasher.digest()
+
+    def block_ping(self, hashes):
+        """Check hashes for existence and
+           return those missing from block storage.
+        """
+        found = self._check_rear_blocks(hashes)
+        found.add(self.emptyhash)
+        notfound = []
+        append = notfound.append
+
+        for h in hashes:
+            if h not in found:
+                append(h)
+                found.add(h)
+
+        return notfound
+
+    def block_retr(self, hashes, pad=True):
+        """Retrieve blocks from storage by their hashes.
+           If pad is False, blocks are returned as stored, without the
+           trailing zeros that fill them up to the block size.
+        """
+        blocks = []
+        append = blocks.append
+        _pad = self._pad if pad else (lambda block: block)
+
+        for h in hashes:
+            if h == self.emptyhash:
+                append(_pad(''))
+                continue
+            block = file_read(self._block_path(h))
+            if block is None:
+                break
+            append(_pad(block))
+
+        return blocks
+
+    def block_stor(self, blocklist, hashes=None):
+        """Store a bunch of blocks and return (hashes, missing).
+           Hashes is a list of the hashes of the blocks,
+           missing is a list of indices in that list indicating
+           which blocks were missing from the store.
+           The hashes of the blocks may be given, if they have already
+           been computed with block_hash().
+        """
+        if hashes is None:
+            block_hash = self.block_hash
+            hashlist = [block_hash(b) for b in blocklist]
+        else:
+            hashlist = list(hashes)
+        found = self._check_rear_blocks(hashlist)
+        missing = [i for i, h in enumerate(hashlist) if h not in found]
+        for i in missing:
+            file_write(self._block_path(hashlist[i]), blocklist[i],
+                       self.filemode, self.dirmode)
+
+        return hashlist, missing
+
+    def block_delta(self, blkhash, offset, data):
+        """Construct and store a new block from a given block
+           and a data 'patch' applied at offset. Return:
+           (the hash of the new block, if the block already existed)
+        """
+
+        blocksize = self.blocksize
+        if offset >= blocksize or not data:
+            return None, None
+
+        block = self.block_retr((blkhash,))
+        if not block:
+            return None, None
+
+        block = block[0]
+        newblock = block[:offset] + data
+        if len(newblock) > blocksize:
+            newblock = newblock[:blocksize]
+        elif len(newblock) < blocksize:
+            newblock += block[len(newblock):]
+
+        h, a = self.block_stor((newblock,))
+        return h[0], 1 if a else 0
+
+    def block_remv(self, hashes):
+        """Remove blocks from storage by their hashes.
+           Return the number of blocks that existed.
+        """
+        removed = 0
+        for h in hashes:
+            if h == self.emptyhash:
+                continue
+            if file_delete(self._block_path(h)):
+                removed += 1
+        return removed
@@ -0,0 +1,75 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from os.path import isdir, exists, realpath, join
+from hashlib import sha1
+from binascii import hexlify, unhexlify
+
+from context_file import (shard_path, makedirs, file_read, file_write,
+                          file_delete)
+
+
+class FileMapper(object):
+    """Mapper that keeps hashes maps as files in a local directory tree.
+       Every map file holds the concatenated binary hashes of the map.
+       Required constructor parameters: mappath, namelen.
+       Optional: umask.
+    """
+
+    mappath = None
+    namelen = None
+
+    def __init__(self, **params):
+        self.params = params
+        self.namelen = params['namelen']
+        mappath = realpath(params['mappath'])
+        umask = params.get('umask', 0o022)
+        if not isdir(mappath):
+            if not exists(mappath):
+                makedirs(mappath, 0o777 & ~umask)
+            else:
+                raise ValueError("Variable mappath '%s' is not a directory"
+                                 % (mappath,))
+        self.mappath = mappath
+        self.filemode = 0o666 & ~umask
+        self.dirmode = 0o777 & ~umask
+
+    def _map_path(self, maphash):
+        # Map names are not uniformly distributed (they share a common
+        # prefix), so shard on a digest of the name instead.
+        return join(shard_path(self.mappath, sha1(maphash).hexdigest()),
+                    maphash)
+
+    def map_retr(self, maphash, size):
+        """Return as a list, part of the hashes map of an object
+           at the given block offset.
+           By default, return the whole hashes map.
+        """
+        data = file_read(self._map_path(maphash))
+        if data is None:
+            raise IOError("Could not retrieve map %s" % maphash)
+        namelen = self.namelen
+        return [hexlify(data[i:i + namelen])
+                for i in xrange(0, len(data), namelen)]
+
+    def map_stor(self, maphash, hashes, size, blocksize):
+        """Store hashes in the given hashes map."""
+        data = ''.join(unhexlify(h) for h in hashes)
+        file_write(self._map_path(maphash), data,
+                   self.filemode, self.dirmode)
+
+    def map_remv(self, maphash):
+        """Remove the given hashes map."""
+        return file_delete(self._map_path(maphash))
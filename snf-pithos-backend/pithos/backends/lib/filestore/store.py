@@ -0,0 +1,82 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from os.path import join
+from binascii import unhexlify
+
+from fileblocker import FileBlocker
+from filemapper import FileMapper
+
+
+class Store(object):
+    """Store that keeps blocks and maps in a local directory tree.
+       Required constructor parameters: block_size, hash_algorithm,
+                                        block_path
+       Optional: block_umask
+    """
+
+    def __init__(self, **params):
+        umask = params.get('block_umask', 0o022)
+        pb = {'blocksize': params['block_size'],
+              'blockpath': join(params['block_path'], 'blocks'),
+              'hashtype': params['hash_algorithm'],
+              'umask': umask,
+              }
+        self.blocker = FileBlocker(**pb)
+        pm = {'namelen': self.blocker.hashlen,
+              'mappath': join(params['block_path'], 'maps'),
+              'umask': umask,
+              }
+        self.mapper = FileMapper(**pm)
+
+    def map_get(self, name, size):
+        return self.mapper.map_retr(name, size)
+
+    def map_put(self, name, map, size, block_size):
+        self.mapper.map_stor(name, map, size, block_size)
+
+    def map_delete(self, name):
+        self.mapper.map_remv(name)
+
+    def block_get(self, hash, pad=True):
+        blocks = self.blocker.block_retr((hash,), pad)
+        if not blocks:
+            return None
+        return blocks[0]
+
+    def block_get_archipelago(self, hash, pad=True):
+        try:
+            hash = unhexlify(hash)
+        except TypeError:
+            return None
+        return self.block_get(hash, pad)
+
+    def block_put(self, data):
+        hashes, absent = self.blocker.block_stor((data,))
+        return hashes[0]
+
+    def block_put_many(self, blocklist, hashes=None):
+        hashes, absent = self.blocker.block_stor(blocklist, hashes)
+        return hashes
+
+    def block_update(self, hash, offset, data):
+        h, e = self.blocker.block_delta(hash, offset, data)
+        return h
+
+    def block_delete(self, hash):
+        return self.blocker.block_remv((hash,)) > 0
+
+    def block_search(self, map):
+        return self.blocker.block_ping(map)
@@ -15,6 +15,7 @@
 
 from hashlib import new as newhasher
 from binascii import hexlify
+from collections import OrderedDict
 import ConfigParser
 
 from context_archipelago import ArchipelagoObject, file_sync_read_chunks
@@ -31,14 +32,19 @@ from pithos.workers import (
 
 monkey.patch_Request()
 
+# Default number of requests kept in flight by batched block operations.
+DEFAULT_INFLIGHT = 32
+
 
 class ArchipelagoBlocker(object):
     """Blocker.
        Required constructor parameters: blocksize, hashtype.
+       Optional: inflight.
     """
 
     blocksize = None
     hashtype = None
+    inflight = DEFAULT_INFLIGHT
 
     def __init__(self, **params):
         cfg = ConfigParser.ConfigParser()
@@ -60,6 +66,9 @@ class ArchipelagoBlocker(object):
         self.hashtype = hashtype
         self.hashlen = len(emptyhash)
         self.emptyhash = emptyhash
+        inflight = params.get('inflight')
+        if inflight:
+            self.inflight = int(inflight)
 
     def _pad(self, block):
         return block + ('\x00' * (self.blocksize - len(block)))
@@ -82,6 +91,70 @@ class ArchipelagoBlocker(object):
         else:
             return False
 
+    def _wait_requests(self, reqs):
+        """Wait for a list of submitted requests and release them.
+           Return a list with the success status of each request.
+        """
+        ret = []
+        append = ret.append
+        for req in reqs:
+            req.wait()
+            append(bool(req.success()))
+            req.put()
+        return ret
+
+    def _check_rear_blocks(self, hashes):
+        """Check a list of hashes for existence.
+           Up to self.inflight info requests are submitted at once on a
+           pooled ioctx, and waited on together.
+           Return a list of booleans, one for each hash.
+        """
+        found = []
+        extend = found.extend
+        inflight = self.inflight
+
+        for i in xrange(0, len(hashes), inflight):
+            reqs = []
+            ioctx = self.ioctx_pool.pool_get()
+            try:
+                for h in hashes[i:i + inflight]:
+                    req = Request.get_info_request(ioctx, self.dst_port,
+                                                   hexlify(h))
+                    req.submit()
+                    reqs.append(req)
+            finally:
+                # Reap whatever got submitted, even if submission failed.
+                ret = self._wait_requests(reqs)
+                self.ioctx_pool.pool_put(ioctx)
+            extend(ret)
+
+        return found
+
+    def _write_rear_blocks(self, hashes, blocks):
+        """Write a list of blocks under the given hashes.
+           Up to self.inflight write requests are submitted at once on a
+           pooled ioctx, and waited on together.
+        """
+        inflight = self.inflight
+
+        for i in xrange(0, len(hashes), inflight):
+            reqs = []
+            ioctx = self.ioctx_pool.pool_get()
+            try:
+                for h, block in zip(hashes[i:i + inflight],
+                                    blocks[i:i + inflight]):
+                    req = Request.get_write_request(ioctx, self.dst_port,
+                                                    hexlify(h), data=block,
+                                                    offset=0,
+                                                    datalen=len(block))
+                    req.submit()
+                    reqs.append(req)
+            finally:
+                ret = self._wait_requests(reqs)
+                self.ioctx_pool.pool_put(ioctx)
+            if not all(ret):
+                raise IOError("archipelago: Write request error")
+
     def block_hash(self, data):
         """Hash a block of data"""
         hasher = newhasher(self.hashtype)
@@ -92,14 +165,9 @@ class ArchipelagoBlocker(object):
         """Check hashes for existence and
            return those missing from block storage.
         """
-        notfound = []
-        append = notfound.append
-
-        for h in hashes:
-            if h not in notfound and not self._check_rear_block(h):
-                append(h)
-
-        return notfound
+        hashes = list(OrderedDict.fromkeys(hashes))
+        found = self._check_rear_blocks(hashes)
+        return [h for h, f in zip(hashes, found) if not f]
 
     def block_retr(self, hashes):
         """Retrieve blocks from storage by their hashes."""
@@ -123,17 +191,21 @@ class ArchipelagoBlocker(object):
 
         return blocks
 
-    def block_retr_archipelago(self, hashes):
-        """Retrieve blocks from storage by their hashes"""
+    def block_retr_archipelago(self, hashes, pad=True):
+        """Retrieve blocks from storage by their hashes.
+           If pad is False, blocks are returned as stored, without the
+           trailing zeros that fill them up to the block size.
+        """
         blocks = []
         append = blocks.append
+        _pad = self._pad if pad else (lambda block: block)
 
         ioctx = self.ioctx_pool.pool_get()
         archip_emptyhash = hexlify(self.emptyhash)
 
         for h in hashes:
             if h == archip_emptyhash:
-                append(self._pad(''))
+                append(_pad(''))
                 continue
             req = Request.get_info_request(ioctx, self.dst_port, h)
             req.submit()
@@ -149,7 +221,7 @@ class ArchipelagoBlocker(object):
                 req_data.wait()
                 ret_data = req_data.success()
                 if ret_data:
-                    append(self._pad(string_at(req_data.get_data(), size)))
+                    append(_pad(string_at(req_data.get_data(), size)))
                     req_data.put()
                 else:
                     req_data.put()
@@ -162,19 +234,28 @@ class ArchipelagoBlocker(object):
         self.ioctx_pool.pool_put(ioctx)
         return blocks
 
-    def block_stor(self, blocklist):
+    def block_stor(self, blocklist, hashes=None):
         """Store a bunch of blocks and return (hashes, missing).
            Hashes is a list of the hashes of the blocks,
            missing is a list of indices in that list indicating
            which blocks were missing from the store.
+           The hashes of the blocks may be given, if they have already
+           been computed with block_hash().
         """
-        block_hash = self.block_hash
-        hashlist = [block_hash(b) for b in blocklist]
-        missing = [i for i, h in enumerate(hashlist) if not
-                   self._check_rear_block(h)]
+        if hashes is None:
+            block_hash = self.block_hash
+            hashlist = [block_hash(b) for b in blocklist]
+        else:
+            hashlist = list(hashes)
+        uniq = list(OrderedDict.fromkeys(hashlist))
+        found = dict(zip(uniq, self._check_rear_blocks(uniq)))
+        missing = [i for i, h in enumerate(hashlist) if not found[h]]
+
+        # Write each missing block once, even if it appears many times.
+        towrite = OrderedDict()
         for i in missing:
-            with self._get_rear_block(hashlist[i], 1) as rbl:
-                rbl.sync_write(blocklist[i])  # XXX: verify?
+            towrite.setdefault(hashlist[i], blocklist[i])
+        self._write_rear_blocks(towrite.keys(), towrite.values())
 
         return hashlist, missing
 
@@ -41,19 +41,21 @@ class Blocker(object):
         """Retrieve blocks from storage by their hashes."""
         return self.archip_blocker.block_retr(hashes)
 
-    def block_retr_archipelago(self, hashes):
+    def block_retr_archipelago(self, hashes, pad=True):
         """Retrieve blocks from storage by theri hashes."""
-        return self.archip_blocker.block_retr_archipelago(hashes)
+        return self.archip_blocker.block_retr_archipelago(hashes, pad)
 
-    def block_stor(self, blocklist):
+    def block_stor(self, blocklist, hashes=None):
         """Store a bunch of blocks and return (hashes, missing).
            Hashes is a list of the hashes of the blocks,
            missing is a list of indices in that list indicating
            which blocks were missing from the store.
+           The hashes of the blocks may be given, if they have already
+           been computed with block_hash().
 
         """
 
-        (hashes, missing) = self.archip_blocker.block_stor(blocklist)
+        (hashes, missing) = self.archip_blocker.block_stor(blocklist, hashes)
         return (hashes, missing)
 
     def block_delta(self, blkhash, offset, data):
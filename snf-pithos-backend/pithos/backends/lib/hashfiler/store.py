@@ -21,12 +21,14 @@ class Store(object):
     """Store.
        Required constructor parameters: block_size, hash_algorithm,
                                         archipelago_cfile, namelen
+       Optional: archipelago_inflight
     """
 
     def __init__(self, **params):
         pb = {'blocksize': params['block_size'],
               'hashtype': params['hash_algorithm'],
               'archipelago_cfile': params['archipelago_cfile'],
+              'inflight': params.get('archipelago_inflight'),
               }
         self.blocker = Blocker(**pb)
         pm = {'namelen': self.blocker.hashlen,
@@ -49,8 +51,8 @@ class Store(object):
             return None
         return blocks[0]
 
-    def block_get_archipelago(self, hash):
-        blocks = self.blocker.block_retr_archipelago((hash,))
+    def block_get_archipelago(self, hash, pad=True):
+        blocks = self.blocker.block_retr_archipelago((hash,), pad)
         if not blocks:
             return None
         return blocks[0]
@@ -59,6 +61,10 @@ class Store(object):
         hashes, absent = self.blocker.block_stor((data,))
         return hashes[0]
 
+    def block_put_many(self, blocklist, hashes=None):
+        hashes, absent = self.blocker.block_stor(blocklist, hashes)
+        return hashes
+
     def block_update(self, hash, offset, data):
         h, e = self.blocker.block_delta(hash, offset, data)
         return h
@@ -0,0 +1,29 @@
+"""create qh_deltas
+
+Revision ID: 2f2aa2a4d1d5
+Revises: 5adc52055209
+Create Date: 2018-05-14 12:03:41.219841
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2f2aa2a4d1d5'
+down_revision = '5adc52055209'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('qh_deltas',
+                    sa.Column('id', sa.Integer, primary_key=True),
+                    sa.Column('holder', sa.String(256), nullable=False),
+                    sa.Column('source', sa.String(256), nullable=False),
+                    sa.Column('delta', sa.BigInteger, nullable=False))
+    op.create_index('idx_qh_deltas_holder_source', 'qh_deltas',
+                    ['holder', 'source'])
+
+
+def downgrade():
+    op.drop_index('idx_qh_deltas_holder_source', tablename='qh_deltas')
+    op.drop_table('qh_deltas')
@@ -0,0 +1,35 @@
+"""create block_refs
+
+Revision ID: 3c0e7a4b9d21
+Revises: 2f2aa2a4d1d5
+Create Date: 2018-06-04 11:27:15.604219
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c0e7a4b9d21'
+down_revision = '2f2aa2a4d1d5'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('block_refs',
+                    sa.Column('hash', sa.String(256), primary_key=True),
+                    sa.Column('refcount', sa.BigInteger, nullable=False,
+                              default=0),
+                    sa.Column('size', sa.BigInteger, nullable=False,
+                              default=0),
+                    sa.Column('first_seen',
+                              sa.DECIMAL(precision=16, scale=6)),
+                    sa.Column('mtime', sa.DECIMAL(precision=16, scale=6)))
+    op.create_index('idx_block_refs_refcount_mtime', 'block_refs',
+                    ['refcount', 'mtime'])
+    op.create_index('idx_versions_mapfile', 'versions', ['mapfile'])
+
+
+def downgrade():
+    op.drop_index('idx_versions_mapfile', tablename='versions')
+    op.drop_index('idx_block_refs_refcount_mtime', tablename='block_refs')
+    op.drop_table('block_refs')
@@ -0,0 +1,24 @@
+"""create released_maps
+
+Revision ID: 4a1d6f0c8e52
+Revises: 3c0e7a4b9d21
+Create Date: 2018-06-11 15:42:08.318570
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a1d6f0c8e52'
+down_revision = '3c0e7a4b9d21'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('released_maps',
+                    sa.Column('mapfile', sa.String(256), primary_key=True),
+                    sa.Column('mtime', sa.DECIMAL(precision=16, scale=6)))
+
+
+def downgrade():
+    op.drop_table('released_maps')
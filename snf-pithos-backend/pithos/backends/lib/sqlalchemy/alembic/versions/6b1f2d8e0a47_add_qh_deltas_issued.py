@@ -0,0 +1,33 @@
+"""add qh_deltas issued
+
+Revision ID: 6b1f2d8e0a47
+Revises: 4a1d6f0c8e52
+Create Date: 2018-06-25 10:14:52.731406
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b1f2d8e0a47'
+down_revision = '4a1d6f0c8e52'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('qh_deltas',
+                  sa.Column('issued', sa.DECIMAL(precision=16, scale=6)))
+    op.drop_index('idx_qh_deltas_holder_source', tablename='qh_deltas')
+    op.create_index('idx_qh_deltas_source_holder', 'qh_deltas',
+                    ['source', 'holder'])
+
+
+def downgrade():
+    # The issued size changes are kept only while they may be missing from
+    # cached quotas, so they can be dropped
+    d = sa.sql.table('qh_deltas', sa.sql.column('issued'))
+    op.execute(d.delete().where(d.c.issued.isnot(None)))
+    op.drop_index('idx_qh_deltas_source_holder', tablename='qh_deltas')
+    op.create_index('idx_qh_deltas_holder_source', 'qh_deltas',
+                    ['holder', 'source'])
+    op.drop_column('qh_deltas', 'issued')
@@ -0,0 +1,31 @@
+"""create block_refs_journal
+
+Revision ID: 9d3e5b7c1a64
+Revises: 6b1f2d8e0a47
+Create Date: 2018-07-02 16:08:41.218735
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9d3e5b7c1a64'
+down_revision = '6b1f2d8e0a47'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('block_refs_journal',
+                    sa.Column('id', sa.Integer, primary_key=True),
+                    sa.Column('hash', sa.String(256), nullable=False),
+                    sa.Column('refcount', sa.BigInteger, nullable=False),
+                    sa.Column('size', sa.BigInteger, nullable=False),
+                    sa.Column('mtime', sa.DECIMAL(precision=16, scale=6)))
+
+
+def downgrade():
+    # The journaled reference count changes are lost, so the block
+    # references must be rebuilt before collecting blocks
+    c = sa.sql.table('config', sa.sql.column('key'))
+    op.execute(c.delete().where(c.c.key == 'block_refs_built'))
+    op.drop_table('block_refs_journal')
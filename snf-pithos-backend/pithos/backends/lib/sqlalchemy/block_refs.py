@@ -0,0 +1,312 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import Table, Column, MetaData, Index
+from sqlalchemy.types import BigInteger, Integer, String, DECIMAL
+from sqlalchemy.sql import select, func, bindparam, and_
+from sqlalchemy.exc import NoSuchTableError, IntegrityError
+
+from dbworker import DBWorker
+
+# The number of hashes looked up by each query.
+REFS_BATCH_SIZE = 1000
+
+
+def create_tables(engine):
+    metadata = MetaData()
+    columns = []
+    columns.append(Column('hash', String(256), primary_key=True))
+    columns.append(Column('refcount', BigInteger, nullable=False, default=0))
+    columns.append(Column('size', BigInteger, nullable=False, default=0))
+    columns.append(Column('first_seen', DECIMAL(precision=16, scale=6)))
+    columns.append(Column('mtime', DECIMAL(precision=16, scale=6)))
+    block_refs = Table('block_refs', metadata, *columns,
+                       mysql_engine='InnoDB')
+    Index('idx_block_refs_refcount_mtime', block_refs.c.refcount,
+          block_refs.c.mtime)
+
+    # map files no version uses, to be deleted from the store
+    columns = []
+    columns.append(Column('mapfile', String(256), primary_key=True))
+    columns.append(Column('mtime', DECIMAL(precision=16, scale=6)))
+    Table('released_maps', metadata, *columns, mysql_engine='InnoDB')
+
+    # reference count changes, to be applied to block_refs by the collector
+    columns = []
+    columns.append(Column('id', Integer, primary_key=True))
+    columns.append(Column('hash', String(256), nullable=False))
+    columns.append(Column('refcount', BigInteger, nullable=False))
+    columns.append(Column('size', BigInteger, nullable=False))
+    columns.append(Column('mtime', DECIMAL(precision=16, scale=6)))
+    Table('block_refs_journal', metadata, *columns, mysql_engine='InnoDB')
+
+    metadata.create_all(engine)
+    return metadata.sorted_tables
+
+
+def chunks(l, size=REFS_BATCH_SIZE):
+    for i in xrange(0, len(l), size):
+        yield l[i:i + size]
+
+
+class BlockRefs(DBWorker):
+    """BlockRefs count the map files that reference each stored block,
+       and keep the map files that no version uses any more.
+
+    The 'mtime' of a block is the last time it was stored without
+    references or its reference count changed.
+
+    Reference count changes are appended to a journal, which is folded into
+    the counts by refs_fold(), so that storing maps does not lock the rows
+    of the blocks that most maps share, e.g. the block of zeros.
+
+    """
+
+    def __init__(self, **params):
+        DBWorker.__init__(self, **params)
+        try:
+            metadata = MetaData(self.engine)
+            self.block_refs = Table('block_refs', metadata, autoload=True)
+            self.released_maps = Table('released_maps', metadata,
+                                       autoload=True)
+            self.block_refs_journal = Table('block_refs_journal', metadata,
+                                            autoload=True)
+        except NoSuchTableError:
+            tables = create_tables(self.engine)
+            map(lambda t: self.__setattr__(t.name, t), tables)
+
+    def _existing(self, hashes):
+        existing = set()
+        for chunk in chunks(hashes):
+            s = select([self.block_refs.c.hash])
+            s = s.where(self.block_refs.c.hash.in_(chunk))
+            r = self.conn.execute(s)
+            existing.update(row[0] for row in r.fetchall())
+            r.close()
+        return existing
+
+    def _insert(self, rows, table=None):
+        """Insert rows, skipping those inserted concurrently."""
+
+        table = table if table is not None else self.block_refs
+        s = table.insert()
+        t = self.conn.begin_nested()
+        try:
+            self.conn.execute(s, rows).close()
+            t.commit()
+            return
+        except IntegrityError:
+            t.rollback()
+        for row in rows:
+            t = self.conn.begin_nested()
+            try:
+                self.conn.execute(s, row).close()
+                t.commit()
+            except IntegrityError:
+                t.rollback()
+
+    def refs_touch(self, sizes, mtime):
+        """Mark blocks as stored at mtime, if they have no references.
+
+        'sizes' is a dictionary from each block hash to its size. Blocks
+        with references need no mark, since their mtime is updated when
+        they lose their last reference.
+
+        """
+
+        if not sizes:
+            return
+        hashes = sorted(sizes)
+        refcounts = self.refs_get(hashes)
+        missing = [{'hash': h, 'refcount': 0, 'size': sizes[h],
+                    'first_seen': mtime, 'mtime': mtime}
+                   for h in hashes if h not in refcounts]
+        if missing:
+            self._insert(missing)
+        b = self.block_refs
+        s = b.update().where(and_(b.c.hash == bindparam('b_hash'),
+                                  b.c.refcount == 0))
+        s = s.values(mtime=mtime)
+        params = [{'b_hash': h} for h in hashes if not refcounts.get(h)]
+        if params:
+            self.conn.execute(s, params).close()
+
+    def refs_add(self, refs, mtime):
+        """Add references to blocks.
+
+        'refs' is a dictionary from each block hash to a
+        (references, size) tuple.
+
+        """
+
+        self._journal(refs, 1, mtime)
+
+    def refs_remove(self, refs, mtime):
+        """Remove references from blocks.
+
+        'refs' is a dictionary from each block hash to a
+        (references, size) tuple. Blocks left without references are kept,
+        until they are collected.
+
+        """
+
+        self._journal(refs, -1, mtime)
+
+    def _journal(self, refs, sign, mtime):
+        if not refs:
+            return
+        rows = [{'hash': h, 'refcount': sign * count, 'size': size,
+                 'mtime': mtime} for h, (count, size) in refs.iteritems()]
+        self.conn.execute(self.block_refs_journal.insert(), rows).close()
+
+    def refs_fold(self, mtime, limit=10000):
+        """Apply up to limit journaled reference count changes, oldest
+           first, and return their number.
+
+        The changed blocks get mtime, the time of the fold, since a block
+        may have been stored again for a new map, without being marked,
+        while its last references were being removed in the journal.
+        """
+
+        j = self.block_refs_journal
+        s = select([j.c.id, j.c.hash, j.c.refcount, j.c.size, j.c.mtime])
+        s = s.order_by(j.c.id).limit(limit).with_for_update()
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        if not rows:
+            return 0
+
+        # hash -> [refcount change, size, first seen]
+        changes = {}
+        for _, h, count, size, first_seen in rows:
+            if h in changes:
+                changes[h][0] += count
+                changes[h][2] = min(changes[h][2], first_seen)
+            else:
+                changes[h] = [count, size, first_seen]
+        # Lock the rows of the blocks in the same order in every transaction
+        hashes = sorted(changes)
+        existing = self._existing(hashes)
+        missing = [{'hash': h, 'refcount': 0, 'size': changes[h][1],
+                    'first_seen': changes[h][2], 'mtime': mtime}
+                   for h in hashes if h not in existing]
+        if missing:
+            self._insert(missing)
+        b = self.block_refs
+        s = b.update().where(b.c.hash == bindparam('b_hash'))
+        s = s.values(refcount=b.c.refcount + bindparam('b_count'),
+                     mtime=mtime)
+        self.conn.execute(s, [{'b_hash': h, 'b_count': changes[h][0]}
+                              for h in hashes]).close()
+        for chunk in chunks([row[0] for row in rows]):
+            self.conn.execute(j.delete().where(j.c.id.in_(chunk))).close()
+        return len(rows)
+
+    def refs_get(self, hashes):
+        """Return a dictionary from each of the known hashes
+           to its reference count.
+        """
+
+        result = {}
+        for chunk in chunks(list(hashes)):
+            s = select([self.block_refs.c.hash, self.block_refs.c.refcount])
+            s = s.where(self.block_refs.c.hash.in_(chunk))
+            r = self.conn.execute(s)
+            result.update(r.fetchall())
+            r.close()
+        return result
+
+    def refs_summary(self):
+        """Return the number of referenced blocks, their total size
+           and the total size of their references.
+        """
+
+        s = select([func.count(self.block_refs.c.hash),
+                    func.sum(self.block_refs.c.size),
+                    func.sum(self.block_refs.c.size *
+                             self.block_refs.c.refcount)])
+        s = s.where(self.block_refs.c.refcount > 0)
+        r = self.conn.execute(s)
+        count, physical, logical = r.fetchone()
+        r.close()
+        return count, long(physical or 0), long(logical or 0)
+
+    def refs_clear(self):
+        """Delete all references."""
+
+        self.conn.execute(self.block_refs_journal.delete()).close()
+        self.conn.execute(self.block_refs.delete()).close()
+
+    def refs_unreferenced(self, before, marker=None, limit=1000,
+                          for_update=False):
+        """Return up to limit (hash, size) of blocks without references
+           since before, ordered by hash, after marker.
+           With for_update, lock them until the end of the transaction.
+        """
+
+        b = self.block_refs
+        s = select([b.c.hash, b.c.size], for_update=for_update)
+        s = s.where(and_(b.c.refcount == 0, b.c.mtime <= before))
+        if marker is not None:
+            s = s.where(b.c.hash > marker)
+        s = s.order_by(b.c.hash).limit(limit)
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return [(h, long(size)) for h, size in rows]
+
+    def refs_delete(self, hashes):
+        """Delete the specified blocks, if they have no references."""
+
+        for chunk in chunks(hashes):
+            s = self.block_refs.delete().where(
+                and_(self.block_refs.c.hash.in_(chunk),
+                     self.block_refs.c.refcount == 0))
+            self.conn.execute(s).close()
+
+    def maps_release(self, mapfiles, mtime):
+        """Record map files that no version uses any more."""
+
+        if not mapfiles:
+            return
+        self._insert([{'mapfile': m, 'mtime': mtime} for m in mapfiles],
+                     self.released_maps)
+
+    def maps_released(self, before, marker=None, limit=1000,
+                      for_update=False):
+        """Return up to limit map files released since before,
+           ordered by name, after marker.
+           With for_update, lock them until the end of the transaction.
+        """
+
+        m = self.released_maps
+        s = select([m.c.mapfile], for_update=for_update)
+        s = s.where(m.c.mtime <= before)
+        if marker is not None:
+            s = s.where(m.c.mapfile > marker)
+        s = s.order_by(m.c.mapfile).limit(limit)
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return [row[0] for row in rows]
+
+    def maps_delete(self, mapfiles):
+        """Delete the specified released map files."""
+
+        for chunk in chunks(mapfiles):
+            s = self.released_maps.delete().where(
+                self.released_maps.c.mapfile.in_(chunk))
+            self.conn.execute(s).close()
@@ -65,3 +65,10 @@ class Config(DBWorker):
         inserted_primary_key = r.inserted_primary_key[0]
         r.close()
         return inserted_primary_key
+
+    def del_value(self, key):
+        """Delete a configuration entry.
+        """
+
+        s = self.config.delete().where(self.config.c.key == key)
+        self.conn.execute(s).close()
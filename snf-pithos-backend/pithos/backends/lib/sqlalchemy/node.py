@@ -14,21 +14,22 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from time import time
-from operator import itemgetter
-from itertools import groupby
 from collections import defaultdict
 
 from sqlalchemy import (Table, Integer, BigInteger, DECIMAL, Boolean,
                         Column, String, MetaData, ForeignKey)
 from sqlalchemy.schema import Index, Sequence
 from sqlalchemy.sql import (func, and_, or_, not_, select, bindparam, exists,
-                            functions)
-from sqlalchemy.sql.expression import true, literal, type_coerce
+                            functions, case, text)
+from sqlalchemy.sql.expression import (true, false, literal, type_coerce,
+                                       cast)
 from sqlalchemy.exc import NoSuchTableError, IntegrityError
 
 from dbworker import DBWorker, ESCAPE_CHAR
+from xfeatures import READ
 
-from pithos.backends.modular import MAP_AVAILABLE
+from pithos.backends.modular import (MAP_AVAILABLE, CLUSTER_NORMAL,
+                                      CLUSTER_DELETED)
 from pithos.backends.filter import parse_filters
 
 DEFAULT_DISKSPACE_RESOURCE = 'pithos.diskspace'
@@ -39,6 +40,10 @@ ROOTNODE = 0
 inf = float('inf')
 
 
+# The number of rows fetched by each query of a delimiter listing.
+LISTING_BATCH_SIZE = 1000
+
+
 def strnextling(prefix):
     """Return the first unicode string
        greater than but not starting with given prefix.
@@ -154,6 +159,7 @@ def create_tables(engine):
     Index('idx_versions_node_mtime', versions.c.node, versions.c.mtime)
     Index('idx_versions_node', versions.c.node)
     Index('idx_versions_node_uuid', versions.c.uuid)
+    Index('idx_versions_mapfile', versions.c.mapfile)
     Index('idx_versions_serial_cluster_n2', versions.c.serial,
           versions.c.cluster, postgresql_where=versions.c.cluster != 2)
     Index('idx_versions_node_cluster0', versions.c.node,
@@ -220,6 +226,7 @@ class Node(DBWorker):
     def __init__(self, **params):
         self._props = params.pop('props')
         self.mapfile_prefix = params.pop('mapfile_prefix', 'snf_file_')
+        self._xfeatures = None
         DBWorker.__init__(self, **params)
         try:
             metadata = MetaData(self.engine)
@@ -376,7 +383,9 @@ class Node(DBWorker):
                             update_statistics_ancestors_depth=None):
         """Delete all versions with the specified
            parent and cluster, and return
-           the hashes, the total size and the serials of versions deleted.
+           the hashes, the total size and the serials of versions deleted,
+           and the (mapfile, size) of the deleted versions that are not
+           snapshots.
            Clears out nodes with no remaining versions.
         """
         #update statistics
@@ -394,21 +403,26 @@ class Node(DBWorker):
         row = r.fetchone()
         r.close()
         if not row:
-            return (), 0, ()
+            return (), 0, (), ()
         nr, size = row[0], safe_long(row[1]) if row[1] else 0
         mtime = time()
         self.statistics_update(parent, -nr, -size, mtime, cluster)
         self.statistics_update_ancestors(parent, -nr, -size, mtime, cluster,
                                          update_statistics_ancestors_depth)
 
-        s = select([self.versions.c.hash, self.versions.c.serial])
+        s = select([self.versions.c.hash, self.versions.c.serial,
+                    self.versions.c.mapfile, self.versions.c.size,
+                    self.versions.c.is_snapshot])
         s = s.where(where_clause)
         r = self.conn.execute(s)
         hashes = []
         serials = []
+        mapfiles = set()
         for row in r.fetchall():
             hashes += [row[0]]
             serials += [row[1]]
+            if row[2] is not None and not row[4]:
+                mapfiles.add((row[2], safe_long(row[3])))
         r.close()
 
         #delete versions
@@ -429,13 +443,15 @@ class Node(DBWorker):
             s = self.nodes.delete().where(self.nodes.c.node.in_(nodes))
             self.conn.execute(s).close()
 
-        return hashes, size, serials
+        return hashes, size, serials, list(mapfiles)
 
     def node_purge(self, node, before=inf, cluster=0,
                    update_statistics_ancestors_depth=None):
         """Delete all versions with the specified
            node and cluster, and return
-           the hashes and size of versions deleted.
+           the hashes, the size and the serials of versions deleted,
+           and the (mapfile, size) of the deleted versions that are not
+           snapshots.
            Clears out the node if it has no remaining versions.
         """
 
@@ -453,19 +469,24 @@ class Node(DBWorker):
         nr, size = row[0], safe_long(row[1])
         r.close()
         if not nr:
-            return (), 0, ()
+            return (), 0, (), ()
         mtime = time()
         self.statistics_update_ancestors(node, -nr, -size, mtime, cluster,
                                          update_statistics_ancestors_depth)
 
-        s = select([self.versions.c.hash, self.versions.c.serial])
+        s = select([self.versions.c.hash, self.versions.c.serial,
+                    self.versions.c.mapfile, self.versions.c.size,
+                    self.versions.c.is_snapshot])
         s = s.where(where_clause)
         r = self.conn.execute(s)
         hashes = []
         serials = []
+        mapfiles = set()
         for row in r.fetchall():
             hashes += [row[0]]
             serials += [row[1]]
+            if row[2] is not None and not row[4]:
+                mapfiles.add((row[2], safe_long(row[3])))
         r.close()
 
         #delete versions
@@ -486,7 +507,7 @@ class Node(DBWorker):
             s = self.nodes.delete().where(self.nodes.c.node.in_(nodes))
             self.conn.execute(s).close()
 
-        return hashes, size, serials
+        return hashes, size, serials, list(mapfiles)
 
     def node_remove(self, node, update_statistics_ancestors_depth=None):
         """Remove the node specified.
@@ -669,34 +690,41 @@ class Node(DBWorker):
            size of objects and mtime in the node's namespace.
            May be zero or positive or negative numbers.
         """
-        s = select([self.statistics.c.population, self.statistics.c.size],
-                   and_(self.statistics.c.node == node,
-                        self.statistics.c.cluster == cluster))
-        rp = self.conn.execute(s)
-        r = rp.fetchone()
-        rp.close()
-        if not r:
-            prepopulation, presize = (0, 0)
-        else:
-            prepopulation, presize = r
-        population += prepopulation
-        population = max(population, 0)
-        size += presize
-
-        #insert or replace
-        #TODO better upsert
+        pop = self.statistics.c.population + population
         u = self.statistics.update().where(and_(
             self.statistics.c.node == node,
             self.statistics.c.cluster == cluster))
-        u = u.values(population=population, size=size, mtime=mtime)
+        u = u.values(population=case([(pop < 0, 0)], else_=pop),
+                     size=self.statistics.c.size + size,
+                     mtime=mtime)
         rp = self.conn.execute(u)
         rp.close()
         if rp.rowcount == 0:
             ins = self.statistics.insert()
-            ins = ins.values(node=node, population=population, size=size,
-                             mtime=mtime, cluster=cluster)
+            ins = ins.values(node=node, population=max(population, 0),
+                             size=size, mtime=mtime, cluster=cluster)
             self.conn.execute(ins).close()
 
+    def node_ancestors(self, node, depth=None):
+        """Return a selectable of the ancestors of node, up to and
+           including the root, or up to depth levels (if not None).
+        """
+
+        # Written out, since SQLAlchemy renders a CTE only at the top of
+        # a SELECT, and not inside the subquery of an UPDATE.
+        limit = ''
+        params = {'child': node, 'root': ROOTNODE}
+        if depth is not None:
+            limit = ' AND a.depth < :depth'
+            params['depth'] = depth
+        s = text("WITH RECURSIVE ancestors(node, depth) AS ("
+                 " SELECT parent, 1 FROM nodes WHERE node = :child"
+                 " UNION ALL"
+                 " SELECT n.parent, a.depth + 1 FROM nodes n, ancestors a"
+                 " WHERE n.node = a.node AND a.node != :root%s)"
+                 " SELECT node FROM ancestors" % limit)
+        return s.bindparams(**params).columns(node=Integer)
+
     def statistics_update_ancestors(self, node, population, size, mtime,
                                     cluster=0, recursion_depth=None):
         """Update the statistics of the given node's parent.
@@ -705,20 +733,35 @@ class Node(DBWorker):
            Population is not recursive.
         """
 
-        i = 0
-        while True:
-            if node == ROOTNODE:
-                break
-            if recursion_depth is not None and recursion_depth <= i:
-                break
-            props = self.node_get_properties(node)
-            if props is None:
-                break
-            parent, path = props
-            self.statistics_update(parent, population, size, mtime, cluster)
-            node = parent
-            population = 0  # Population isn't recursive
-            i += 1
+        if node == ROOTNODE:
+            return
+        if recursion_depth is not None and recursion_depth <= 0:
+            return
+
+        # Add the missing statistics rows first, so that one UPDATE applies
+        # the changes to all the ancestors.
+        ancestors = self.node_ancestors(node, recursion_depth).alias('a')
+        s = select([ancestors.c.node, literal(0), literal(0), literal(mtime),
+                    literal(cluster)])
+        s = s.where(not_(exists().where(and_(
+            self.statistics.c.node == ancestors.c.node,
+            self.statistics.c.cluster == cluster))))
+        ins = self.statistics.insert().from_select(
+            ['node', 'population', 'size', 'mtime', 'cluster'], s)
+        self.conn.execute(ins).close()
+
+        parent = select([self.nodes.c.parent],
+                        self.nodes.c.node == node).as_scalar()
+        pop = self.statistics.c.population + case(
+            [(self.statistics.c.node == parent, population)], else_=0)
+        u = self.statistics.update().where(and_(
+            self.statistics.c.node.in_(
+                self.node_ancestors(node, recursion_depth)),
+            self.statistics.c.cluster == cluster))
+        u = u.values(population=case([(pop < 0, 0)], else_=pop),
+                     size=self.statistics.c.size + size,
+                     mtime=mtime)
+        self.conn.execute(u).close()
 
     def statistics_latest(self, node, before=inf, except_cluster=0):
         """Return population, total size and last mtime
@@ -790,6 +833,22 @@ class Node(DBWorker):
         if count == 0:
             return (0, 0, mtime)
 
+        if before == inf and except_cluster == CLUSTER_DELETED:
+            # The latest versions that are not deleted are the ones in the
+            # normal cluster, which the statistics of each child already
+            # aggregate. Sum those instead of scanning the whole subtree.
+            children_size = safe_long(r[1]) or 0
+            s = select([func.sum(self.statistics.c.size),
+                        func.max(self.statistics.c.mtime)])
+            s = s.where(and_(self.statistics.c.node.in_(c2),
+                             self.statistics.c.cluster == CLUSTER_NORMAL))
+            rp = self.conn.execute(s)
+            r = rp.fetchone()
+            rp.close()
+            size = children_size + (safe_long(r[0]) or 0)
+            mtime = max(mtime, r[1])
+            return (count, size, mtime)
+
         # All children (get size and mtime).
         # This is why the full path is stored.
         if before != inf:
@@ -1048,6 +1107,54 @@ class Node(DBWorker):
 
         return hash, size
 
+    def mapfiles_in_use(self, mapfiles):
+        """Return the subset of the mapfiles that versions still use."""
+
+        if not mapfiles:
+            return set()
+        s = select([self.versions.c.mapfile]).distinct()
+        s = s.where(self.versions.c.mapfile.in_(mapfiles))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return set(row[0] for row in rows)
+
+    def mapfile_list(self, prefix, marker=None, limit=10000):
+        """Return the (mapfile, size) of versions that are not snapshots,
+           for mapfiles with the prefix, ordered by mapfile.
+        """
+
+        v = self.versions
+        s = select([v.c.mapfile, func.max(v.c.size)])
+        s = s.where(and_(v.c.mapfile.like(self.escape_like(prefix) + '%',
+                                          escape=ESCAPE_CHAR),
+                         v.c.is_snapshot == false()))
+        if marker is not None:
+            s = s.where(v.c.mapfile > marker)
+        s = s.group_by(v.c.mapfile).order_by(v.c.mapfile).limit(limit)
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return [(mapfile, safe_long(size)) for mapfile, size in rows]
+
+    def node_mapfiles(self, parent):
+        """Return the (mapfile, size, versions) of the versions
+           that are not snapshots, of the children of parent.
+        """
+
+        v = self.versions
+        c = select([self.nodes.c.node], self.nodes.c.parent == parent)
+        s = select([v.c.mapfile, v.c.size, func.count(v.c.serial)])
+        s = s.where(and_(v.c.node.in_(c),
+                         v.c.mapfile.isnot(None),
+                         v.c.is_snapshot == false()))
+        s = s.group_by(v.c.mapfile, v.c.size)
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return [(mapfile, safe_long(size), count)
+                for mapfile, size, count in rows]
+
     def attribute_get_domains(self, serial, node=None):
         node = node or select([self.versions.c.node],
                               self.versions.c.serial == serial)
@@ -1266,7 +1373,7 @@ class Node(DBWorker):
                          self.nodes.c.path]).where(v.c.mtime < before)
             d4 = d4.where(v.c.node.in_(d4_insub))
             d4 = d4.where(v.c.node == self.nodes.c.node)
-            d4 = d4.group_by(v.c.node, self.nodes.c.path).cte("d4")
+            d4 = d4.group_by(v.c.node, self.nodes.c.path).alias("d4")
             inner_join = \
                 d4.join(self.versions,
                         onclause=self.versions.c.serial == d4.c.vmax)
@@ -1276,7 +1383,7 @@ class Node(DBWorker):
                          self.nodes.c.latest_version]).where(
                              self.nodes.c.parent == parent)
             d4 = d4.where(and_(self.nodes.c.path > bindparam('start'),
-                               self.nodes.c.path < nextling)).cte("d4")
+                               self.nodes.c.path < nextling)).alias("d4")
 
             inner_join = \
                 d4.join(self.versions,
@@ -1284,7 +1391,7 @@ class Node(DBWorker):
         if not all_props:
             s = select([d4.c.path,
                        self.versions.c.serial],
-                       from_obj=[inner_join]).distinct()
+                       from_obj=[inner_join])
         else:
             s = select([d4.c.path,
                        self.versions.c.serial, self.versions.c.node,
@@ -1299,10 +1406,9 @@ class Node(DBWorker):
                        self.versions.c.map_check_timestamp,
                        self.versions.c.mapfile,
                        self.versions.c.is_snapshot],
-                       from_obj=[inner_join]).distinct()
+                       from_obj=[inner_join])
 
         s = s.where(self.versions.c.cluster != except_cluster)
-        s = s.where(self.versions.c.node == d4.c.node)
         conja = []
         conjb = []
         for path, match in pathq:
@@ -1370,11 +1476,21 @@ class Node(DBWorker):
         mappend = matches.append
         skip_prefix = None
         one_more = False
-
-        rp = self.conn.execute(s, start=start)
-
-        while count < limit or one_more:
-            props_many = rp.fetchmany(10000)
+        done = False
+
+        # Fetch in bounded batches, each one starting after the last path of
+        # the previous one. If a batch ends inside a common prefix, seek past
+        # the prefix by starting the next batch from strnextling(prefix),
+        # instead of reading and skipping all the paths under it.
+        # Since the query matches paths greater than start, start from the
+        # string just before the nextling, so that it is not skipped itself.
+        batch = min(limit + 1, LISTING_BATCH_SIZE)
+        s = s.limit(batch)
+
+        while not done:
+            rp = self.conn.execute(s, start=start)
+            props_many = rp.fetchall()
+            rp.close()
             if not props_many:
                 break
 
@@ -1393,6 +1509,7 @@ class Node(DBWorker):
                     if idx > 0 and idx + dz != len(path):
                         pf = path[:idx + dz]
                         pappend(pf)
+                    done = True
                     break
 
                 if idx > 0 and idx + dz != len(path):
@@ -1408,9 +1525,16 @@ class Node(DBWorker):
                         # Get one more, in case there is a path.
                         one_more = True
                     else:
+                        done = True
                         break
 
-        rp.close()
+            if len(props_many) < batch:
+                break
+            if skip_prefix is not None:
+                # The rest of the batch is inside skip_prefix
+                start = strprevling(strnextling(skip_prefix))
+            else:
+                start = props_many[-1][0]
 
         return matches, prefixes
 
@@ -1437,9 +1561,48 @@ class Node(DBWorker):
         r.close()
         return l
 
-    def domain_object_list(self, domain, paths, cluster=None):
+    def _public_exists(self, path_column):
+        """Return an EXISTS clause that is true if everyone can read the
+           path in path_column.
+        """
+
+        if self._xfeatures is None:
+            # The tables of the permissions, which share the connection.
+            metadata = MetaData(self.engine)
+            self._xfeatures = (Table('xfeatures', metadata, autoload=True),
+                               Table('xfeaturevals', metadata, autoload=True))
+        xfeatures, xfeaturevals = self._xfeatures
+        s = select([literal(1)],
+                   from_obj=[xfeatures.join(xfeaturevals)])
+        s = s.where(and_(xfeatures.c.path == path_column,
+                         xfeaturevals.c.key == READ,
+                         xfeaturevals.c.value == '*'))
+        return exists(s)
+
+    def domain_object_list(self, domain, paths, cluster=None, prefix=None,
+                           public=None, attributes=None, sizeq=None,
+                           available=None, order_by=None,
+                           order_by_attribute=None, descending=False,
+                           marker=None, limit=None):
         """Return a list of (path, property list, attribute dictionary)
            for the objects in the specific domain and cluster.
+
+           The objects can be further restricted to:
+               paths starting with prefix,
+               public (or non-public) objects, if public is not None,
+               the attributes matching the given key-value pairs,
+               the size in the range set by sizeq,
+               the given map availability.
+
+           The list is sorted by the order_by version property
+           (e.g. 'size', 'mtime', 'uuid') or by the value of the
+           order_by_attribute attribute key. If both are given, objects
+           without the attribute are sorted by the property, as a string.
+           Ties and unsorted listings are ordered by path. If marker is
+           given, the list starts after the object with this uuid. Limit
+           applies to the list returned.
+
+           :raises ValueError: if the marker object is not listed
         """
 
         v = self.versions.alias('v')
@@ -1450,27 +1613,95 @@ class Node(DBWorker):
                  v.c.source, v.c.mtime, v.c.muser, v.c.uuid, v.c.checksum,
                  v.c.cluster, v.c.available, v.c.map_check_timestamp,
                  v.c.mapfile, v.c.is_snapshot]
-        cols = props + [a.c.key, a.c.value]
 
-        s = select(cols)
+        from_obj = v.join(n, n.c.node == v.c.node)
+        if order_by_attribute is not None:
+            sa = self.attributes.alias('sa')
+            from_obj = from_obj.outerjoin(
+                sa, and_(sa.c.serial == v.c.serial,
+                         sa.c.domain == domain,
+                         sa.c.key == order_by_attribute))
+            if order_by is not None:
+                fallback = cast(v.c[order_by], String)
+            else:
+                fallback = ''
+            sort_column = func.coalesce(sa.c.value, fallback)
+        elif order_by is not None:
+            sort_column = v.c[order_by]
+        else:
+            sort_column = n.c.path
+
+        latest = select([a.c.serial]).where(and_(a.c.domain == domain,
+                                                 a.c.is_latest == true()))
+        s = select(props, from_obj=[from_obj])
+        s = s.where(v.c.serial.in_(latest))
         if cluster:
             s = s.where(v.c.cluster == cluster)
-        s = s.where(v.c.serial == a.c.serial)
-        s = s.where(a.c.domain == domain)
-        s = s.where(a.c.node == n.c.node)
-        s = s.where(a.c.is_latest == true())
         if paths:
             s = s.where(n.c.path.in_(paths))
+        if public is not None:
+            is_public = self._public_exists(n.c.path)
+            s = s.where(is_public if public else not_(is_public))
+        if prefix:
+            s = s.where(n.c.path.like(self.escape_like(prefix) + '%',
+                                      escape=ESCAPE_CHAR))
+        if sizeq and len(sizeq) == 2:
+            if sizeq[0]:
+                s = s.where(v.c.size >= sizeq[0])
+            if sizeq[1]:
+                s = s.where(v.c.size < sizeq[1])
+        if available is not None:
+            s = s.where(v.c.available == available)
+        for key, value in (attributes or {}).iteritems():
+            subs = select([1]).where(and_(
+                self.attributes.c.serial == v.c.serial,
+                self.attributes.c.domain == domain,
+                self.attributes.c.key == key,
+                self.attributes.c.value == value)).correlate(v)
+            s = s.where(exists(subs))
+
+        if marker is not None:
+            m = select([sort_column, n.c.path], from_obj=[from_obj])
+            m = m.where(v.c.serial.in_(latest))
+            m = m.where(v.c.uuid == marker)
+            r = self.conn.execute(m)
+            marker_row = r.fetchone()
+            r.close()
+            if marker_row is None:
+                raise ValueError('Marker object does not exist')
+            value, path = marker_row
+            after = (lambda x, y: x < y) if descending else \
+                (lambda x, y: x > y)
+            if sort_column is n.c.path:
+                s = s.where(after(n.c.path, path))
+            else:
+                s = s.where(or_(after(sort_column, value),
+                                and_(sort_column == value,
+                                     after(n.c.path, path))))
+
+        if descending:
+            s = s.order_by(sort_column.desc(), n.c.path.desc())
+        else:
+            s = s.order_by(sort_column, n.c.path)
+        if limit is not None:
+            s = s.limit(limit)
 
         r = self.conn.execute(s)
         rows = r.fetchall()
         r.close()
+        if not rows:
+            return []
 
-        group_by = itemgetter(slice(len(props)))
-        rows.sort(key=group_by)
-        groups = groupby(rows, group_by)
-        return [(k[0], k[1:], dict([i[len(props):] for i in data])) for
-                (k, data) in groups]
+        # Fetch the attributes of the listed versions only.
+        serials = [row[1] for row in rows]
+        s = select([a.c.serial, a.c.key, a.c.value])
+        s = s.where(and_(a.c.serial.in_(serials), a.c.domain == domain))
+        r = self.conn.execute(s)
+        attrs = defaultdict(dict)
+        for serial, key, value in r.fetchall():
+            attrs[serial][key] = value
+        r.close()
+        return [(row[0], tuple(row[1:]), attrs[row[1]]) for row in rows]
 
     def get_props(self, paths):
         inner_join = \
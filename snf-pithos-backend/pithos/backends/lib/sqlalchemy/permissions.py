@@ -16,7 +16,7 @@
 from sqlalchemy.sql import select, literal, or_, and_
 from sqlalchemy.sql.expression import join, union
 
-from xfeatures import XFeatures
+from xfeatures import XFeatures, READ, WRITE
 from groups import Groups
 from public import Public
 from node import Node
@@ -25,10 +25,6 @@ from collections import defaultdict
 from dbworker import ESCAPE_CHAR
 
 
-READ = 0
-WRITE = 1
-
-
 class Permissions(XFeatures, Groups, Public, Node):
 
     def __init__(self, **params):
@@ -13,9 +13,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import Table, Column, MetaData
-from sqlalchemy.types import BigInteger
-from sqlalchemy.sql import select
+from sqlalchemy import Table, Column, MetaData, Index
+from sqlalchemy.types import BigInteger, Integer, String, DECIMAL
+from sqlalchemy.sql import select, func, or_
 from sqlalchemy.exc import NoSuchTableError
 
 from dbworker import DBWorker
@@ -27,6 +27,18 @@ def create_tables(engine):
     columns.append(Column('serial', BigInteger, primary_key=True))
     Table('qh_serials', metadata, *columns, mysql_engine='InnoDB')
 
+    # size changes to be issued to the quotaholder, kept for a while after
+    # they are issued (when 'issued' is set)
+    columns = []
+    columns.append(Column('id', Integer, primary_key=True))
+    columns.append(Column('holder', String(256), nullable=False))
+    columns.append(Column('source', String(256), nullable=False))
+    columns.append(Column('delta', BigInteger, nullable=False))
+    columns.append(Column('issued', DECIMAL(precision=16, scale=6)))
+    qh_deltas = Table('qh_deltas', metadata, *columns, mysql_engine='InnoDB')
+    Index('idx_qh_deltas_source_holder', qh_deltas.c.source,
+          qh_deltas.c.holder)
+
     metadata.create_all(engine)
     return metadata.sorted_tables
 
@@ -40,6 +52,7 @@ class QuotaholderSerial(DBWorker):
         try:
             metadata = MetaData(self.engine)
             self.qh_serials = Table('qh_serials', metadata, autoload=True)
+            self.qh_deltas = Table('qh_deltas', metadata, autoload=True)
         except NoSuchTableError:
             tables = create_tables(self.engine)
             map(lambda t: self.__setattr__(t.name, t), tables)
@@ -91,3 +104,62 @@ class QuotaholderSerial(DBWorker):
             self.qh_serials.c.serial.in_(serials)
         )
         self.conn.execute(st).close()
+
+    def insert_delta(self, holder, source, delta):
+        """Record a size change of holder in source, to be issued later."""
+
+        s = self.qh_deltas.insert()
+        r = self.conn.execute(s, holder=holder, source=source, delta=delta)
+        r.close()
+
+    def get_delta_sum(self, holder, source, since=None):
+        """Return the total size change of holder in source
+           not yet issued, or issued after since if given,
+           or of all the holders if holder is None.
+        """
+
+        s = select([func.sum(self.qh_deltas.c.delta)])
+        s = s.where(self.qh_deltas.c.source == source)
+        if holder is not None:
+            s = s.where(self.qh_deltas.c.holder == holder)
+        if since is None:
+            s = s.where(self.qh_deltas.c.issued.is_(None))
+        else:
+            s = s.where(or_(self.qh_deltas.c.issued.is_(None),
+                            self.qh_deltas.c.issued >= since))
+        r = self.conn.execute(s)
+        row = r.fetchone()
+        r.close()
+        return row[0] or 0
+
+    def list_deltas(self, limit=None):
+        """Return up to limit (id, holder, source, delta) entries
+           not yet issued, oldest first, locking them until the end of
+           the transaction.
+        """
+
+        s = select([self.qh_deltas.c.id, self.qh_deltas.c.holder,
+                    self.qh_deltas.c.source, self.qh_deltas.c.delta])
+        s = s.where(self.qh_deltas.c.issued.is_(None))
+        s = s.order_by(self.qh_deltas.c.id)
+        if limit:
+            s = s.limit(limit)
+        s = s.with_for_update()
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return rows
+
+    def set_deltas_issued(self, ids, issued):
+        """Mark the specified entries as issued at the given time."""
+
+        if not ids:
+            return
+        st = self.qh_deltas.update().where(self.qh_deltas.c.id.in_(ids))
+        self.conn.execute(st, issued=issued).close()
+
+    def delete_issued_deltas(self, before):
+        """Delete the entries issued before the given time."""
+
+        st = self.qh_deltas.delete().where(self.qh_deltas.c.issued < before)
+        self.conn.execute(st).close()
@@ -22,6 +22,10 @@ from sqlalchemy.exc import NoSuchTableError
 from dbworker import DBWorker
 
 
+READ = 0
+WRITE = 1
+
+
 def create_tables(engine):
     metadata = MetaData()
     columns = []
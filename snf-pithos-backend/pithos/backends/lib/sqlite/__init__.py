@@ -18,7 +18,8 @@ from node import (Node, ROOTNODE, MATCH_PREFIX, MATCH_EXACT)
 from permissions import Permissions, READ, WRITE
 from config import Config
 from quotaholder_serials import QuotaholderSerial
+from block_refs import BlockRefs
 
 __all__ = ["DBWrapper", "Node", "ROOTNODE", "MATCH_PREFIX", "MATCH_EXACT",
            "Permissions", "READ", "WRITE", "Config",
-           "QuotaholderSerial"]
+           "QuotaholderSerial", "BlockRefs"]
@@ -0,0 +1,207 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from dbworker import DBWorker
+
+
+class BlockRefs(DBWorker):
+    """BlockRefs count the map files that reference each stored block,
+       and keep the map files that no version uses any more.
+
+    The 'mtime' of a block is the last time it was stored without
+    references or its reference count changed.
+
+    Reference count changes are appended to a journal, which is folded into
+    the counts by refs_fold().
+
+    """
+
+    def __init__(self, **params):
+        DBWorker.__init__(self, **params)
+        execute = self.execute
+
+        execute(""" create table if not exists block_refs
+                          ( hash       text primary key,
+                            refcount   integer not null default 0,
+                            size       integer not null default 0,
+                            first_seen integer,
+                            mtime      integer ) """)
+        execute(""" create index if not exists idx_block_refs_refcount_mtime
+                    on block_refs(refcount, mtime) """)
+        execute(""" create table if not exists released_maps
+                          ( mapfile    text primary key,
+                            mtime      integer ) """)
+        execute(""" create table if not exists block_refs_journal
+                          ( id         integer primary key,
+                            hash       text not null,
+                            refcount   integer not null,
+                            size       integer not null,
+                            mtime      integer ) """)
+
+    def refs_touch(self, sizes, mtime):
+        """Mark blocks as stored at mtime, if they have no references.
+
+        'sizes' is a dictionary from each block hash to its size.
+
+        """
+
+        hashes = sorted(sizes)
+        q = ("insert or ignore into block_refs "
+             "(hash, refcount, size, first_seen, mtime) "
+             "values (?, 0, ?, ?, ?)")
+        self.executemany(q, [(h, sizes[h], mtime, mtime) for h in hashes])
+        q = "update block_refs set mtime = ? where hash = ? and refcount = 0"
+        self.executemany(q, [(mtime, h) for h in hashes])
+
+    def refs_add(self, refs, mtime):
+        """Add references to blocks.
+
+        'refs' is a dictionary from each block hash to a
+        (references, size) tuple.
+
+        """
+
+        self._journal(refs, 1, mtime)
+
+    def refs_remove(self, refs, mtime):
+        """Remove references from blocks.
+
+        'refs' is a dictionary from each block hash to a
+        (references, size) tuple. Blocks left without references are kept,
+        until they are collected.
+
+        """
+
+        self._journal(refs, -1, mtime)
+
+    def _journal(self, refs, sign, mtime):
+        q = ("insert into block_refs_journal (hash, refcount, size, mtime) "
+             "values (?, ?, ?, ?)")
+        self.executemany(q, [(h, sign * count, size, mtime)
+                             for h, (count, size) in refs.iteritems()])
+
+    def refs_fold(self, mtime, limit=10000):
+        """Apply up to limit journaled reference count changes, oldest
+           first, and return their number. The changed blocks get mtime.
+        """
+
+        q = ("select id, hash, refcount, size, mtime "
+             "from block_refs_journal order by id limit ?")
+        self.execute(q, (limit,))
+        rows = self.fetchall()
+        changes = {}
+        for _, h, count, size, first_seen in rows:
+            if h in changes:
+                changes[h][0] += count
+                changes[h][2] = min(changes[h][2], first_seen)
+            else:
+                changes[h] = [count, size, first_seen]
+        hashes = sorted(changes)
+        q = ("insert or ignore into block_refs "
+             "(hash, refcount, size, first_seen, mtime) "
+             "values (?, 0, ?, ?, ?)")
+        self.executemany(q, [(h, changes[h][1], changes[h][2], mtime)
+                             for h in hashes])
+        q = ("update block_refs set refcount = refcount + ?, mtime = ? "
+             "where hash = ?")
+        self.executemany(q, [(changes[h][0], mtime, h) for h in hashes])
+        q = "delete from block_refs_journal where id = ?"
+        self.executemany(q, [(row[0],) for row in rows])
+        return len(rows)
+
+    def refs_get(self, hashes):
+        """Return a dictionary from each of the known hashes
+           to its reference count.
+        """
+
+        hashes = list(hashes)
+        result = {}
+        for i in xrange(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            q = ("select hash, refcount from block_refs "
+                 "where hash in (%s)" % placeholders)
+            self.execute(q, chunk)
+            result.update(self.fetchall())
+        return result
+
+    def refs_summary(self):
+        """Return the number of referenced blocks, their total size
+           and the total size of their references.
+        """
+
+        q = ("select count(hash), sum(size), sum(size * refcount) "
+             "from block_refs where refcount > 0")
+        self.execute(q)
+        count, physical, logical = self.fetchone()
+        return count, physical or 0, logical or 0
+
+    def refs_clear(self):
+        """Delete all references."""
+
+        self.execute("delete from block_refs_journal")
+        self.execute("delete from block_refs")
+
+    def refs_unreferenced(self, before, marker=None, limit=1000,
+                          for_update=False):
+        """Return up to limit (hash, size) of blocks without references
+           since before, ordered by hash, after marker.
+        """
+
+        q = ("select hash, size from block_refs "
+             "where refcount = 0 and mtime <= ? ")
+        args = [before]
+        if marker is not None:
+            q += "and hash > ? "
+            args.append(marker)
+        q += "order by hash limit ?"
+        args.append(limit)
+        self.execute(q, args)
+        return self.fetchall()
+
+    def refs_delete(self, hashes):
+        """Delete the specified blocks, if they have no references."""
+
+        q = "delete from block_refs where hash = ? and refcount = 0"
+        self.executemany(q, [(h,) for h in hashes])
+
+    def maps_release(self, mapfiles, mtime):
+        """Record map files that no version uses any more."""
+
+        q = ("insert or ignore into released_maps (mapfile, mtime) "
+             "values (?, ?)")
+        self.executemany(q, [(m, mtime) for m in mapfiles])
+
+    def maps_released(self, before, marker=None, limit=1000,
+                      for_update=False):
+        """Return up to limit map files released since before,
+           ordered by name, after marker.
+        """
+
+        q = "select mapfile from released_maps where mtime <= ? "
+        args = [before]
+        if marker is not None:
+            q += "and mapfile > ? "
+            args.append(marker)
+        q += "order by mapfile limit ?"
+        args.append(limit)
+        self.execute(q, args)
+        return [r[0] for r in self.fetchall()]
+
+    def maps_delete(self, mapfiles):
+        """Delete the specified released map files."""
+
+        q = "delete from released_maps where mapfile = ?"
+        self.executemany(q, [(m,) for m in mapfiles])
@@ -47,3 +47,10 @@ class Config(DBWorker):
         q = "insert into config (key, value) values (?, ?)"
         id = self.execute(q, (key, value)).lastrowid
         return id
+
+    def del_value(self, key):
+        """Delete a configuration entry.
+        """
+
+        q = "delete from config where key = ?"
+        self.execute(q, (key,))
@@ -18,6 +18,7 @@ from operator import itemgetter
 from itertools import groupby
 
 from dbworker import DBWorker
+from xfeatures import READ
 
 from pithos.backends.modular import MAP_AVAILABLE
 from pithos.backends.filter import parse_filters
@@ -148,6 +149,8 @@ class Node(DBWorker):
                     on versions(node) """)
         execute(""" create index if not exists idx_versions_node_uuid
                     on versions(uuid) """)
+        execute(""" create index if not exists idx_versions_mapfile
+                    on versions(mapfile) """)
 
         execute(""" create table if not exists attributes
                           ( serial      integer,
@@ -271,7 +274,9 @@ class Node(DBWorker):
                             update_statistics_ancestors_depth=None):
         """Delete all versions with the specified
            parent and cluster, and return
-           the hashes, the size and the serials of versions deleted.
+           the hashes, the size and the serials of versions deleted,
+           and the (mapfile, size) of the deleted versions that are not
+           snapshots.
            Clears out nodes with no remaining versions.
         """
 
@@ -286,13 +291,13 @@ class Node(DBWorker):
         execute(q, args)
         nr, size = self.fetchone()
         if not nr:
-            return (), 0, ()
+            return (), 0, (), ()
         mtime = time()
         self.statistics_update(parent, -nr, -size, mtime, cluster)
         self.statistics_update_ancestors(parent, -nr, -size, mtime, cluster,
                                          update_statistics_ancestors_depth)
 
-        q = ("select hash, serial from versions "
+        q = ("select hash, serial, mapfile, size, is_snapshot from versions "
              "where node in (select node "
              "from nodes "
              "where parent = ?) "
@@ -301,9 +306,12 @@ class Node(DBWorker):
         execute(q, args)
         hashes = []
         serials = []
+        mapfiles = set()
         for r in self.fetchall():
             hashes += [r[0]]
             serials += [r[1]]
+            if r[2] is not None and not r[4]:
+                mapfiles.add((r[2], r[3]))
 
         q = ("delete from versions "
              "where node in (select node "
@@ -319,13 +327,15 @@ class Node(DBWorker):
              "where node = n.node) = 0 "
              "and parent = ?)")
         execute(q, (parent,))
-        return hashes, size, serials
+        return hashes, size, serials, list(mapfiles)
 
     def node_purge(self, node, before=inf, cluster=0,
                    update_statistics_ancestors_depth=None):
         """Delete all versions with the specified
            node and cluster, and return
-           the hashes, the size and the serials of versions deleted.
+           the hashes, the size and the serials of versions deleted,
+           and the (mapfile, size) of the deleted versions that are not
+           snapshots.
            Clears out the node if it has no remaining versions.
         """
 
@@ -338,21 +348,24 @@ class Node(DBWorker):
         execute(q, args)
         nr, size = self.fetchone()
         if not nr:
-            return (), 0, ()
+            return (), 0, (), ()
         mtime = time()
         self.statistics_update_ancestors(node, -nr, -size, mtime, cluster,
                                          update_statistics_ancestors_depth)
 
-        q = ("select hash, serial from versions "
+        q = ("select hash, serial, mapfile, size, is_snapshot from versions "
              "where node = ? "
              "and cluster = ? "
              "and mtime <= ?")
         execute(q, args)
         hashes = []
         serials = []
+        mapfiles = set()
         for r in self.fetchall():
             hashes += [r[0]]
             serials += [r[1]]
+            if r[2] is not None and not r[4]:
+                mapfiles.add((r[2], r[3]))
 
         q = ("delete from versions "
              "where node = ? "
@@ -366,7 +379,7 @@ class Node(DBWorker):
              "where node = n.node) = 0 "
              "and node = ?)")
         execute(q, (node,))
-        return hashes, size, serials
+        return hashes, size, serials, list(mapfiles)
 
     def node_remove(self, node, update_statistics_ancestors_depth=None):
         """Remove the node specified.
@@ -757,6 +770,45 @@ class Node(DBWorker):
             self.nodes_set_latest_version(node, props[0])
         return hash, size
 
+    def mapfiles_in_use(self, mapfiles):
+        """Return the subset of the mapfiles that versions still use."""
+
+        if not mapfiles:
+            return set()
+        placeholders = ','.join('?' for _ in mapfiles)
+        q = ("select distinct mapfile from versions "
+             "where mapfile in (%s)" % placeholders)
+        self.execute(q, list(mapfiles))
+        return set(r[0] for r in self.fetchall())
+
+    def mapfile_list(self, prefix, marker=None, limit=10000):
+        """Return the (mapfile, size) of versions that are not snapshots,
+           for mapfiles with the prefix, ordered by mapfile.
+        """
+
+        q = ("select mapfile, max(size) from versions "
+             "where mapfile like ? escape '\\' and is_snapshot = 0 ")
+        args = [self.escape_like(prefix) + '%']
+        if marker is not None:
+            q += "and mapfile > ? "
+            args.append(marker)
+        q += "group by mapfile order by mapfile limit ?"
+        args.append(limit)
+        self.execute(q, args)
+        return self.fetchall()
+
+    def node_mapfiles(self, parent):
+        """Return the (mapfile, size, versions) of the versions
+           that are not snapshots, of the children of parent.
+        """
+
+        q = ("select mapfile, size, count(serial) from versions "
+             "where node in (select node from nodes where parent = ?) "
+             "and mapfile is not null and is_snapshot = 0 "
+             "group by mapfile, size")
+        self.execute(q, (parent,))
+        return self.fetchall()
+
     def attribute_get_domains(self, serial, node=None):
         q = ("select distinct domain from attributes "
              "where serial = ? ")
@@ -1154,9 +1206,30 @@ class Node(DBWorker):
         self.execute(q, args)
         return self.fetchone()
 
-    def domain_object_list(self, domain, paths, cluster=None):
+    def domain_object_list(self, domain, paths, cluster=None, prefix=None,
+                           public=None, attributes=None, sizeq=None,
+                           available=None, order_by=None,
+                           order_by_attribute=None, descending=False,
+                           marker=None, limit=None):
         """Return a list of (path, property list, attribute dictionary)
            for the objects in the specific domain and cluster.
+
+           The objects can be further restricted to:
+               paths starting with prefix,
+               public (or non-public) objects, if public is not None,
+               the attributes matching the given key-value pairs,
+               the size in the range set by sizeq,
+               the given map availability.
+
+           The list is sorted by the order_by version property
+           (e.g. 'size', 'mtime', 'uuid') or by the value of the
+           order_by_attribute attribute key. If both are given, objects
+           without the attribute are sorted by the property, as a string.
+           Ties and unsorted listings are ordered by path. If marker is
+           given, the list starts after the object with this uuid. Limit
+           applies to the list returned.
+
+           :raises ValueError: if the marker object is not listed
         """
 
         props = ('n.path', 'v.serial', 'v.node', 'v.hash', 'v.size', 'v.type',
@@ -1173,6 +1246,25 @@ class Node(DBWorker):
         if paths:
             q += ("and path in (%s) " % ','.join('?' for _ in paths))
             map(args.append, paths)
+        if public is not None:
+            q += ("and %sexists (select 1 from xfeatures f, xfeaturevals fv "
+                  "where f.feature_id = fv.feature_id and f.path = n.path "
+                  "and fv.key = ? and fv.value = '*') " %
+                  ('' if public else 'not '))
+            args += [READ]
+        if prefix:
+            q += "and path like ? escape '\\' "
+            args += [self.escape_like(prefix) + '%']
+        if sizeq and len(sizeq) == 2:
+            if sizeq[0]:
+                q += "and v.size >= ? "
+                args += [sizeq[0]]
+            if sizeq[1]:
+                q += "and v.size < ? "
+                args += [sizeq[1]]
+        if available is not None:
+            q += "and v.available = ? "
+            args += [available]
         if cluster is not None:
             q += "and v.cluster = ?"
             args += [cluster]
@@ -1183,8 +1275,38 @@ class Node(DBWorker):
         group_by = itemgetter(slice(len(props)))
         rows.sort(key=group_by)
         groups = groupby(rows, group_by)
-        return [(k[0], k[1:], dict([i[len(props):] for i in data])) for
-                (k, data) in groups]
+        objects = [(k[0], k[1:], dict([i[len(props):] for i in data])) for
+                   (k, data) in groups]
+
+        def sort_key(o):
+            if order_by_attribute is not None:
+                if order_by is not None:
+                    fallback = str(o[1][self._props[order_by]])
+                else:
+                    fallback = ''
+                return (o[2].get(order_by_attribute, fallback), o[0])
+            elif order_by is not None:
+                return (o[1][self._props[order_by]], o[0])
+            return o[0]
+
+        if marker is not None:
+            markers = [sort_key(o) for o in objects
+                       if o[1][self.UUID] == marker]
+            if not markers:
+                raise ValueError('Marker object does not exist')
+            if descending:
+                objects = [o for o in objects if sort_key(o) < markers[0]]
+            else:
+                objects = [o for o in objects if sort_key(o) > markers[0]]
+        if attributes:
+            objects = [o for o in objects
+                       if all(o[2].get(k) == v for k, v in
+                              attributes.iteritems())]
+
+        objects.sort(key=sort_key, reverse=descending)
+        if limit is not None:
+            objects = objects[:limit]
+        return objects
 
     def get_props(self, paths):
         q = ("select distinct n.path, v.type "
@@ -13,17 +13,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from xfeatures import XFeatures
+from xfeatures import XFeatures, READ, WRITE
 from groups import Groups
 from public import Public
 from node import Node
 from collections import defaultdict
 
 
-READ = 0
-WRITE = 1
-
-
 class Permissions(XFeatures, Groups, Public, Node):
 
     def __init__(self, **params):
@@ -25,6 +25,14 @@ class QuotaholderSerial(DBWorker):
 
         execute(""" create table if not exists qh_serials
                           ( serial bigint primary key) """)
+        execute(""" create table if not exists qh_deltas
+                          ( id     integer primary key,
+                            holder text not null,
+                            source text not null,
+                            delta  bigint not null,
+                            issued decimal(16,6) ) """)
+        execute(""" create index if not exists idx_qh_deltas_source_holder
+                    on qh_deltas(source, holder) """)
 
     def get_lower(self, serial):
         """Return entries lower than serial."""
@@ -60,3 +68,55 @@ class QuotaholderSerial(DBWorker):
         placeholders = ','.join('?' for _ in serials)
         q = "delete from qh_serials where serial in (%s)" % placeholders
         self.conn.execute(q, serials)
+
+    def insert_delta(self, holder, source, delta):
+        """Record a size change of holder in source, to be issued later."""
+
+        q = "insert into qh_deltas (holder, source, delta) values (?, ?, ?)"
+        self.execute(q, (holder, source, delta))
+
+    def get_delta_sum(self, holder, source, since=None):
+        """Return the total size change of holder in source
+           not yet issued, or issued after since if given,
+           or of all the holders if holder is None.
+        """
+
+        q = "select sum(delta) from qh_deltas where source = ?"
+        args = [source]
+        if holder is not None:
+            q += " and holder = ?"
+            args.append(holder)
+        if since is None:
+            q += " and issued is null"
+        else:
+            q += " and (issued is null or issued >= ?)"
+            args.append(since)
+        self.execute(q, args)
+        return self.fetchone()[0] or 0
+
+    def list_deltas(self, limit=None):
+        """Return up to limit (id, holder, source, delta) entries
+           not yet issued, oldest first.
+        """
+
+        q = ("select id, holder, source, delta from qh_deltas"
+             " where issued is null order by id")
+        if limit:
+            q += " limit %d" % limit
+        self.execute(q)
+        return self.fetchall()
+
+    def set_deltas_issued(self, ids, issued):
+        """Mark the specified entries as issued at the given time."""
+
+        if not ids:
+            return
+        placeholders = ','.join('?' for _ in ids)
+        q = "update qh_deltas set issued = ? where id in (%s)" % placeholders
+        self.conn.execute(q, [issued] + list(ids))
+
+    def delete_issued_deltas(self, before):
+        """Delete the entries issued before the given time."""
+
+        q = "delete from qh_deltas where issued < ?"
+        self.execute(q, (before,))
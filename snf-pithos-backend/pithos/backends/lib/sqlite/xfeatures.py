@@ -18,6 +18,10 @@ from collections import defaultdict
 from dbworker import DBWorker
 
 
+READ = 0
+WRITE = 1
+
+
 class XFeatures(DBWorker):
     """XFeatures are path properties that allow non-nested
        inheritance patterns. Currently used for storing permissions.
@@ -25,9 +25,13 @@ from traceback import format_exc
 from time import time
 
 from pithos.workers import glue
-from archipelago.common import Segment, Xseg_ctx
 from objpool import ObjectPool
 
+try:
+    from archipelago.common import Segment, Xseg_ctx
+except ImportError:
+    Segment = Xseg_ctx = None
+
 try:
     from astakosclient import AstakosClient
 except ImportError:
@@ -119,6 +123,15 @@ DEFAULT_RESOURCE_MAX_METADATA = 32
 DEFAULT_ACC_MAX_GROUPS = 32
 DEFAULT_ACC_MAX_GROUP_MEMBERS = 32
 
+DEFAULT_QUOTA_CACHE_TIMEOUT = 60  # set to 60 secs
+DEFAULT_COMMISSION_BATCH_SIZE = 10000
+DEFAULT_BLOCK_REFS_BATCH_SIZE = 1000
+DEFAULT_BLOCK_REFS_FOLD_SIZE = 10000
+DEFAULT_GC_GRACE = 24 * 3600  # blocks are kept for a day after their release
+
+# Config key set when the block references have been rebuilt from all maps.
+BLOCK_REFS_BUILT = 'block_refs_built'
+
 logger = logging.getLogger(__name__)
 
 _propnames = ('serial', 'node', 'hash', 'size', 'type', 'source', 'mtime',
@@ -247,7 +260,10 @@ class ModularBackend(object):
                  mapfile_prefix=DEFAULT_MAPFILE_PREFIX,
                  resource_max_metadata=DEFAULT_RESOURCE_MAX_METADATA,
                  acc_max_groups=DEFAULT_ACC_MAX_GROUPS,
-                 acc_max_group_members=DEFAULT_ACC_MAX_GROUP_MEMBERS):
+                 acc_max_group_members=DEFAULT_ACC_MAX_GROUP_MEMBERS,
+                 batch_commissions=False,
+                 quota_cache_timeout=DEFAULT_QUOTA_CACHE_TIMEOUT,
+                 track_block_refs=True):
 
         not_nullable = ('block_size', 'hash_algorithm',
                         'public_url_security', 'public_url_alphabet',
@@ -280,6 +296,11 @@ class ModularBackend(object):
         self.resource_max_metadata = resource_max_metadata
         self.acc_max_groups = acc_max_groups
         self.acc_max_group_members = acc_max_group_members
+        self.batch_commissions = batch_commissions
+        self.quota_cache_timeout = quota_cache_timeout
+        self.track_block_refs = track_block_refs
+        self._quota_cache = {}
+        self._project_quota_cache = {}
 
         def load_module(m):
             __import__(m)
@@ -290,6 +311,7 @@ class ModularBackend(object):
         params = {'wrapper': self.wrapper}
         self.config = self.db_module.Config(**params)
         self.commission_serials = self.db_module.QuotaholderSerial(**params)
+        self.block_refs = self.db_module.BlockRefs(**params)
         for x in ['READ', 'WRITE']:
             setattr(self, x, getattr(self.db_module, x))
         params.update({'mapfile_prefix': self.mapfile_prefix,
@@ -303,12 +325,18 @@ class ModularBackend(object):
 
         self.ALLOWED = ['read', 'write']
 
-        glue.WorkerGlue.setupXsegPool(ObjectPool, Segment, Xseg_ctx,
-                                      cfile=archipelago_conf_file,
-                                      pool_size=xseg_pool_size)
+        self.block_module = load_module(block_module)
+        # Block modules that do not go through Archipelago (e.g. the local
+        # filestore) declare so, and need no xseg segment to be set up.
+        if getattr(self.block_module, 'REQUIRES_XSEG', True):
+            if Segment is None:
+                raise ImportError("Block module '%s' requires Archipelago"
+                                  % block_module)
+            glue.WorkerGlue.setupXsegPool(ObjectPool, Segment, Xseg_ctx,
+                                          cfile=archipelago_conf_file,
+                                          pool_size=xseg_pool_size)
 
         self.ioctx_pool = glue.WorkerGlue.ioctx_pool
-        self.block_module = load_module(block_module)
         self.block_params = block_params
         params = {'block_size': self.block_size,
                   'hash_algorithm': self.hash_algorithm,
@@ -816,7 +844,14 @@ class ModularBackend(object):
                 (from_project, to_project, 'pithos.diskspace'): usage
                 }
 
-            if self.using_external_quotaholder:
+            if self.batch_commissions:
+                # Size changes not yet issued are charged to the project
+                # they were recorded for, so move the usage the same way.
+                self._report_size_change(user, account, -usage, from_project,
+                                         name=path)
+                self._report_size_change(user, account, usage, to_project,
+                                         name=path)
+            elif self.using_external_quotaholder:
                 serial = self.astakosclient.issue_resource_reassignment(
                     holder=account, provisions=provisions)
                 self.serials.append(serial)
@@ -872,13 +907,13 @@ class ModularBackend(object):
         project = self._get_project(node)
 
         if until is not None:
-            hashes, size, _ = self.node.node_purge_children(
+            _, size, _, mapfiles = self.node.node_purge_children(
                 node, until, CLUSTER_HISTORY,
                 update_statistics_ancestors_depth=0)
-            for h in hashes:
-                self.store.map_delete(h)
-            self.node.node_purge_children(node, until, CLUSTER_DELETED,
-                                          update_statistics_ancestors_depth=0)
+            mapfiles += self.node.node_purge_children(
+                node, until, CLUSTER_DELETED,
+                update_statistics_ancestors_depth=0)[3]
+            self._release_mapfiles(mapfiles)
             if not self.free_versioning:
                 self._report_size_change(
                     user, account, -size, project, name=path)
@@ -887,14 +922,14 @@ class ModularBackend(object):
         if not delimiter:
             if self._get_statistics(node)[0] > 0:
                 raise ContainerNotEmpty("Container is not empty")
-            hashes, size, _ = self.node.node_purge_children(
+            _, size, _, mapfiles = self.node.node_purge_children(
                 node, inf, CLUSTER_HISTORY,
                 update_statistics_ancestors_depth=0)
-            for h in hashes:
-                self.store.map_delete(h)
-            self.node.node_purge_children(node, inf, CLUSTER_DELETED,
-                                          update_statistics_ancestors_depth=0)
+            mapfiles += self.node.node_purge_children(
+                node, inf, CLUSTER_DELETED,
+                update_statistics_ancestors_depth=0)[3]
             self.node.node_remove(node, update_statistics_ancestors_depth=0)
+            self._release_mapfiles(mapfiles)
             if not self.free_versioning:
                 self._report_size_change(
                     user, account, -size, project, name=path)
@@ -1611,6 +1646,8 @@ class ModularBackend(object):
             hashmap = [self.put_block('')]
         map_ = HashMap(self.block_size, self.hash_algorithm)
         map_.extend([self._unhexlify_hash(x) for x in hashmap])
+        if size != 0:
+            self._touch_map(hashmap, size)
         missing = self.store.block_search(map_)
         if missing:
             ie = IndexError()
@@ -1624,7 +1661,7 @@ class ModularBackend(object):
             user, account, container, name, size, type, hexlified, checksum,
             domain, meta, replace_meta, permissions, is_snapshot=False)
         if size != 0:
-            self.store.map_put(mapfile, hashmap, size, self.block_size)
+            self._put_map(mapfile, hashmap, size)
         return dest_version_id, hexlified
 
     @debug_method
@@ -1726,7 +1763,11 @@ class ModularBackend(object):
                 raise NotAllowedError("Copy is not permitted: failed to get "
                                       "source object's mapfile: %s" %
                                       src_mapfile)
-            self.store.map_put(dest_mapfile, hashmap, size, self.block_size)
+            if is_snapshot:
+                self.store.map_put(dest_mapfile, hashmap, size,
+                                   self.block_size)
+            else:
+                self._put_map(dest_mapfile, hashmap, size)
 
         dest_versions.append(dest_version_id)
         occupied_space += size_delta
@@ -1863,21 +1904,23 @@ class ModularBackend(object):
         if until is not None:
             if node is None:
                 return
-            hashes = []
             size = 0
-            h, s, _ = self.node.node_purge(node, until, CLUSTER_NORMAL,
-                                           update_statistics_ancestors_depth=1)
-            hashes += h
+            mapfiles = []
+            _, s, _, m = self.node.node_purge(
+                node, until, CLUSTER_NORMAL,
+                update_statistics_ancestors_depth=1)
             size += s
-            h, s, _ = self.node.node_purge(node, until, CLUSTER_HISTORY,
-                                           update_statistics_ancestors_depth=1)
-            hashes += h
+            mapfiles += m
+            _, s, _, m = self.node.node_purge(
+                node, until, CLUSTER_HISTORY,
+                update_statistics_ancestors_depth=1)
             if not self.free_versioning:
                 size += s
-            for h in hashes:
-                self.store.map_delete(h)
-            self.node.node_purge(node, until, CLUSTER_DELETED,
-                                 update_statistics_ancestors_depth=1)
+            mapfiles += m
+            mapfiles += self.node.node_purge(
+                node, until, CLUSTER_DELETED,
+                update_statistics_ancestors_depth=1)[3]
+            self._release_mapfiles(mapfiles)
             try:
                 self._get_version(node)
             except NameError:
@@ -2064,25 +2107,76 @@ class ModularBackend(object):
         self._can_read_object(user, account, container, name)
         return (account, container, name)
 
-    def get_block(self, hash):
+    def get_block(self, hash, padded=True):
         """Return a block's data.
 
+        If padded is False, the block is returned as stored, which may be
+        shorter than the block size; the missing trailing bytes are zeros.
+
         Raises:
             ItemNotExists: Block does not exist
         """
 
         logger.debug("get_block: %s", hash)
-        block = self.store.block_get_archipelago(hash)
-        if not block:
+        block = self.store.block_get_archipelago(hash, padded)
+        if block is None or (padded and not block):
             raise ItemNotExists("Block does not exist")
         return block
 
+    @backend_method
     def put_block(self, data):
         """Store a block and return the hash."""
 
         logger.debug("put_block: %s", len(data))
-        return binascii.hexlify(self.store.block_put(data))
+        hashes = self._touch_blocks((data,))
+        return self.store_blocks((data,), hashes)[0]
+
+    @backend_method
+    def put_blocks(self, blocks):
+        """Store a list of blocks in one batch and return their hashes."""
+
+        logger.debug("put_blocks: %s", len(blocks))
+        hashes = self._touch_blocks(blocks)
+        return self.store_blocks(blocks, hashes)
+
+    def hash_blocks(self, blocks):
+        """Return the hashes of a list of blocks, without storing them.
+
+        This does not use the database, so it may be called from any thread.
+        """
+
+        return [hashlib.new(self.hash_algorithm,
+                            data.rstrip('\x00')).hexdigest()
+                for data in blocks]
+
+    @backend_method
+    def touch_blocks(self, hashes, sizes):
+        """Mark blocks as stored now, before storing them with
+           store_blocks().
+        """
+
+        logger.debug("touch_blocks: %s", len(hashes))
+        if not self._check_track_block_refs():
+            return
+        self.block_refs.refs_touch(dict(zip(hashes, sizes)), time())
+
+    def store_blocks(self, blocks, hashes=None):
+        """Store a list of blocks in one batch and return their hashes.
+
+        Unlike put_blocks(), this does not use the database, so it may be
+        called from any thread, but the blocks must first be marked with
+        touch_blocks(), or they may be collected before a map references
+        them. The hashes returned by hash_blocks() for the blocks may be
+        given, so that the blocks are not hashed again.
+        """
+
+        logger.debug("store_blocks: %s", len(blocks))
+        if hashes is not None:
+            hashes = [self._unhexlify_hash(h) for h in hashes]
+        return [binascii.hexlify(h)
+                for h in self.store.block_put_many(blocks, hashes)]
 
+    @backend_method
     def update_block(self, hash, data, offset=0, is_snapshot=False):
         """Update a known block and return the hash.
 
@@ -2097,8 +2191,19 @@ class ModularBackend(object):
                 'Cannot update an Archipelago volume block.')
         if offset == 0 and len(data) == self.block_size:
             return self.put_block(data)
-        h = self.store.block_update(self._unhexlify_hash(hash), offset, data)
-        return binascii.hexlify(h)
+        if offset >= self.block_size or not data:
+            raise IndexError('Offset or data outside block limits')
+        # Build the new block here, instead of with store.block_update(), so
+        # that it is touched before it is stored, as in put_block().
+        block = self.store.block_get(self._unhexlify_hash(hash))
+        if block is None:
+            raise ItemNotExists('Block does not exist')
+        newblock = block[:offset] + data
+        if len(newblock) > self.block_size:
+            newblock = newblock[:self.block_size]
+        elif len(newblock) < self.block_size:
+            newblock += block[len(newblock):]
+        return self.put_block(newblock)
 
     # Path functions.
 
@@ -2390,12 +2495,394 @@ class ModularBackend(object):
         if not self.using_external_quotaholder:
             return
 
+        if self.batch_commissions:
+            if size > 0:
+                self._check_quota_limit(account, source, size)
+            self.commission_serials.insert_delta(account, source, size)
+            return
+
         serial = self.astakosclient.issue_one_commission(
             holder=account,
             provisions={(source, 'pithos.diskspace'): size},
             name=name)
         self.serials.append(serial)
 
+    def _get_cached_quotas(self, cache, key, fetch):
+        """Return the (time fetched, quotas) of key, fetching them
+           if not cached or if cached longer than the cache timeout.
+        """
+
+        now = time()
+        cached = cache.get(key)
+        if cached is None or now - cached[0] > self.quota_cache_timeout:
+            cached = (now, fetch())
+            cache[key] = cached
+        return cached
+
+    def _get_quota(self, account, source):
+        """Return the (limit, usage, time fetched) of the account's disk
+           space in source and the (limit, usage, time fetched) of the disk
+           space of project source, as last fetched from the quotaholder.
+           The usage includes the pending commissions.
+        """
+
+        def fetch_user():
+            quotas = self.astakosclient.service_get_quotas(user=account)
+            return quotas.get(account, {})
+
+        def fetch_project():
+            quotas = self.astakosclient.service_get_project_quotas(
+                project_id=source)
+            return quotas.get(source, {})
+
+        user_fetched, user_quotas = self._get_cached_quotas(
+            self._quota_cache, account, fetch_user)
+        project_fetched, project_quotas = self._get_cached_quotas(
+            self._project_quota_cache, source, fetch_project)
+        result = []
+        for fetched, quota in ((user_fetched, user_quotas.get(source, {})),
+                               (project_fetched, project_quotas)):
+            quota = quota.get(DEFAULT_DISKSPACE_RESOURCE)
+            if quota is None:
+                result.append((0, 0, fetched))
+            else:
+                result.append((quota['limit'],
+                               quota['usage'] + quota.get('pending', 0),
+                               fetched))
+        return result
+
+    def _check_quota_limit(self, account, source, size):
+        """Check that increasing the account's usage in source by size
+           exceeds neither its limit in the project nor the limit of the
+           project.
+
+        The size changes issued after the quotas were fetched, possibly by
+        another process, are not included in the fetched usage, so they are
+        added to it along with the changes not yet issued.
+
+        Raises: QuotaError
+        """
+
+        (limit, usage, fetched), \
+            (project_limit, project_usage, project_fetched) = \
+            self._get_quota(account, source)
+        usage += self.commission_serials.get_delta_sum(account, source,
+                                                       fetched)
+        if usage + size > limit:
+            raise QuotaError(
+                'Project quota exceeded: limit: %s, usage: %s, '
+                'requested: %s' % (limit, usage, size))
+        project_usage += self.commission_serials.get_delta_sum(
+            None, source, project_fetched)
+        if project_usage + size > project_limit:
+            raise QuotaError(
+                'Project total quota exceeded: limit: %s, usage: %s, '
+                'requested: %s' % (project_limit, project_usage, size))
+
+    @debug_method
+    @backend_method
+    def issue_pending_commissions(self, limit=DEFAULT_COMMISSION_BATCH_SIZE):
+        """Issue the recorded size changes to the quotaholder.
+
+        Sum up to limit recorded size changes per (account, project) and
+        issue them as one commission, registered in self.serials to be
+        accepted on post_exec. Return the number of size changes issued.
+
+        The issued changes are kept for quota_cache_timeout seconds, since
+        the quotas cached until then by any process do not include them.
+
+        Raises: AstakosClientException
+        """
+
+        self.commission_serials.delete_issued_deltas(
+            time() - self.quota_cache_timeout)
+        rows = self.commission_serials.list_deltas(limit)
+        if not rows:
+            return 0
+        user_provisions = defaultdict(int)
+        project_provisions = defaultdict(int)
+        for _, holder, source, delta in rows:
+            user_provisions[
+                (holder, source, DEFAULT_DISKSPACE_RESOURCE)] += delta
+            project_provisions[(source, DEFAULT_DISKSPACE_RESOURCE)] += delta
+        user_provisions = dict((k, v) for k, v in user_provisions.iteritems()
+                               if v != 0)
+        project_provisions = dict(
+            (k, v) for k, v in project_provisions.iteritems() if v != 0)
+        if user_provisions or project_provisions:
+            # Limits have been checked when the changes were recorded.
+            serial = self.astakosclient.issue_commission_generic(
+                user_provisions, project_provisions,
+                name='pithos: batched size changes', force=True)
+            self.serials.append(serial)
+        # Mark the changes after issuing them, so that quotas fetched in the
+        # meantime count them twice rather than not at all.
+        self.commission_serials.set_deltas_issued([row[0] for row in rows],
+                                                  time())
+        return len(rows)
+
+    # Block reference functions.
+
+    def _map_refs(self, hashmap, size):
+        """Return the block references of a map, as a dictionary from
+           each block hash to a (references, block size) tuple.
+        """
+
+        refs = {}
+        last = len(hashmap) - 1
+        for i, h in enumerate(hashmap):
+            if i < last:
+                block_size = self.block_size
+            else:
+                block_size = size - last * self.block_size
+            h = h.lower()
+            count = refs[h][0] if h in refs else 0
+            refs[h] = (count + 1, block_size)
+        return refs
+
+    def _put_map(self, mapfile, hashmap, size):
+        """Store a new map file and reference its blocks."""
+
+        self.store.map_put(mapfile, hashmap, size, self.block_size)
+        if self._check_track_block_refs():
+            self.block_refs.refs_add(self._map_refs(hashmap, size), time())
+
+    def _touch_blocks(self, blocks):
+        """Mark blocks as stored now, so that they are not collected
+           before the map that will reference them is stored.
+
+        This must precede storing the blocks: a block being collected stays
+        locked until it is deleted, and is then stored again. Return the
+        hashes of the blocks.
+        """
+
+        hashes = self.hash_blocks(blocks)
+        self.touch_blocks(hashes, [len(data) for data in blocks])
+        return hashes
+
+    def _touch_map(self, hashmap, size):
+        """Mark the blocks of a map as stored now, so that they are not
+           collected between checking for them and storing the map.
+        """
+
+        if not self._check_track_block_refs():
+            return
+        refs = self._map_refs(hashmap, size)
+        self.block_refs.refs_touch(
+            dict((h, s) for h, (_, s) in refs.iteritems()), time())
+
+    def _release_mapfiles(self, mapfiles):
+        """Release the blocks of the map files that no version uses.
+
+        'mapfiles' are the (mapfile, size) of removed versions. Only the map
+        files created by Pithos reference blocks.
+
+        """
+
+        mapfiles = dict((m, s) for m, s in mapfiles
+                        if m.startswith(self.mapfile_prefix))
+        if not mapfiles:
+            return
+        in_use = self.node.mapfiles_in_use(mapfiles.keys())
+        now = time()
+        self.block_refs.maps_release(
+            [m for m in mapfiles if m not in in_use], now)
+        if not self._check_track_block_refs():
+            return
+        for mapfile, size in mapfiles.iteritems():
+            if mapfile in in_use:
+                continue
+            try:
+                hashmap = self.store.map_get(mapfile, size)
+            except Exception as e:
+                # Keep the references, the blocks will never be collected.
+                logger.warning("Cannot release the blocks of map file %s:"
+                               " %s", mapfile, e)
+                continue
+            self.block_refs.refs_remove(self._map_refs(hashmap, size), now)
+
+    def _check_track_block_refs(self):
+        """Return whether block references are tracked.
+
+        Otherwise, the references become stale, so they must be rebuilt
+        before any block is collected.
+        """
+
+        if not self.track_block_refs:
+            self.config.del_value(BLOCK_REFS_BUILT)
+        return self.track_block_refs
+
+    def _fold_block_refs(self):
+        """Apply all the journaled block reference changes."""
+
+        now = time()
+        limit = DEFAULT_BLOCK_REFS_FOLD_SIZE
+        while self.block_refs.refs_fold(now, limit) == limit:
+            pass
+
+    @debug_method
+    @backend_method
+    def rebuild_block_refs(self, marker=None,
+                           limit=DEFAULT_BLOCK_REFS_BATCH_SIZE):
+        """Rebuild the block references from the map files of all versions.
+
+        Each call references the blocks of up to limit map files after
+        marker and returns the marker of the next call, or None when all
+        map files have been processed. The first call, with no marker,
+        clears all references.
+
+        Pithos must not be serving requests while the references are
+        rebuilt, or the references of the maps stored or removed meanwhile
+        may be lost or counted twice.
+        """
+
+        if marker is None:
+            self.config.del_value(BLOCK_REFS_BUILT)
+            self.block_refs.refs_clear()
+        mapfiles = self.node.mapfile_list(self.mapfile_prefix, marker, limit)
+        now = time()
+        for mapfile, size in mapfiles:
+            if not size:
+                continue
+            hashmap = self.store.map_get(mapfile, size)
+            self.block_refs.refs_add(self._map_refs(hashmap, size), now)
+        self._fold_block_refs()
+        if len(mapfiles) < limit:
+            self.config.set_value(BLOCK_REFS_BUILT, str(now))
+            return None
+        return mapfiles[-1][0]
+
+    @debug_method
+    @backend_method
+    def get_block_stats(self, account=None, container=None):
+        """Return deduplication statistics of the stored blocks.
+
+        Without an account, return a dictionary with the number of blocks,
+        the 'physical' size of the blocks and the 'logical' size of all their
+        references. For an account, return a list with a dictionary per
+        container, followed by the totals of the account, with:
+            'name': The container name, or None for the account totals
+            'versions': The number of versions with data
+            'logical': The total size of the versions
+            'physical': The size of the distinct blocks of the versions
+            'exclusive': The size of the blocks referenced by no other
+                         account or container
+
+        Raises:
+            ItemNotExists: Account or container does not exist
+        """
+
+        self._fold_block_refs()
+        if account is None:
+            count, physical, logical = self.block_refs.refs_summary()
+            return {'blocks': count, 'physical': physical,
+                    'logical': logical,
+                    'built': self.config.get_value(BLOCK_REFS_BUILT)}
+
+        if container is None:
+            if self._lookup_account(account, False)[1] is None:
+                raise ItemNotExists("Account does not exist")
+            names = self.list_containers(account, account)
+        else:
+            names = [container]
+        containers = [(name, self._lookup_container(account, name)[1])
+                      for name in names]
+
+        stats = []
+        account_refs = {}
+        account_versions = account_logical = 0
+        for name, node in containers:
+            refs = {}
+            versions = logical = 0
+            for mapfile, size, count in self.node.node_mapfiles(node):
+                versions += count
+                logical += count * size
+                if not mapfile.startswith(self.mapfile_prefix):
+                    continue
+                hashmap = self.store.map_get(mapfile, size)
+                for h, (c, block_size) in self._map_refs(
+                        hashmap, size).iteritems():
+                    refs[h] = (refs[h][0] + c if h in refs else c,
+                               block_size)
+            stats.append(self._block_stats(name, versions, logical, refs))
+            account_versions += versions
+            account_logical += logical
+            for h, (c, block_size) in refs.iteritems():
+                account_refs[h] = (account_refs[h][0] + c
+                                   if h in account_refs else c, block_size)
+        if container is None:
+            stats.append(self._block_stats(None, account_versions,
+                                           account_logical, account_refs))
+        return stats
+
+    def _check_collect(self):
+        if not hasattr(self.store, 'block_delete'):
+            raise NotAllowedError("The block store does not support"
+                                  " deleting blocks")
+        if not self.track_block_refs:
+            raise NotAllowedError("The block references are not tracked")
+        if self.config.get_value(BLOCK_REFS_BUILT) is None:
+            raise NotAllowedError("The block references have not been"
+                                  " rebuilt")
+
+    @debug_method
+    @backend_method
+    def collect_maps(self, grace=DEFAULT_GC_GRACE, marker=None,
+                     limit=DEFAULT_BLOCK_REFS_BATCH_SIZE, dry_run=False):
+        """Delete up to limit map files, after marker, that no version
+           has used for grace seconds. Return their names, ordered by name.
+           If dry_run is True, nothing is deleted.
+
+        Raises:
+            NotAllowedError: The block store does not delete blocks or the
+                             block references have not been rebuilt
+        """
+
+        self._check_collect()
+        mapfiles = self.block_refs.maps_released(
+            time() - grace, marker, limit, for_update=not dry_run)
+        if not dry_run:
+            for mapfile in mapfiles:
+                self.store.map_delete(mapfile)
+            self.block_refs.maps_delete(mapfiles)
+        return mapfiles
+
+    @debug_method
+    @backend_method
+    def collect_blocks(self, grace=DEFAULT_GC_GRACE, marker=None,
+                       limit=DEFAULT_BLOCK_REFS_BATCH_SIZE, dry_run=False):
+        """Delete up to limit blocks, after marker, that no map file has
+           referenced for grace seconds. Return their (hash, size), ordered
+           by hash. If dry_run is True, nothing is deleted.
+
+        The grace period also protects the blocks uploaded for maps that
+        have not been stored yet.
+
+        Raises:
+            NotAllowedError: The block store does not delete blocks or the
+                             block references have not been rebuilt
+        """
+
+        self._check_collect()
+        self._fold_block_refs()
+        blocks = self.block_refs.refs_unreferenced(
+            time() - grace, marker, limit, for_update=not dry_run)
+        if not dry_run:
+            for h, _ in blocks:
+                self.store.block_delete(self._unhexlify_hash(h))
+            self.block_refs.refs_delete([h for h, _ in blocks])
+        return blocks
+
+    def _block_stats(self, name, versions, logical, refs):
+        refcounts = self.block_refs.refs_get(refs.keys())
+        physical = exclusive = 0
+        for h, (count, block_size) in refs.iteritems():
+            physical += block_size
+            if refcounts.get(h, 0) <= count:
+                exclusive += block_size
+        return {'name': name, 'versions': versions, 'logical': logical,
+                'physical': physical, 'exclusive': exclusive}
+
     # Policy functions.
 
     def _check_project(self, value):
@@ -2475,9 +2962,12 @@ class ModularBackend(object):
         versioning = self._get_policy(
             node, is_account_policy=False)[VERSIONING_POLICY]
         if versioning != 'auto':
+            mapfile, is_snapshot = self.node.version_get_properties(
+                version_id, keys=('mapfile', 'is_snapshot'))
             hash, size = self.node.version_remove(
                 version_id, update_statistics_ancestors_depth)
-            self.store.map_delete(hash)
+            if mapfile is not None and not is_snapshot:
+                self._release_mapfiles([(mapfile, size)])
             return size
         elif self.free_versioning:
             return self.node.version_get_properties(
@@ -2652,18 +3142,34 @@ class ModularBackend(object):
 
     @debug_method
     @backend_method
-    def get_domain_objects(self, domain, user=None, check_permissions=True):
+    def get_domain_objects(self, domain, user=None, check_permissions=True,
+                           account=None, public=None, meta=None,
+                           size_range=None, available=None, sort_key=None,
+                           sort_meta=None, descending=False, marker=None,
+                           limit=None):
         """List objects having metadata in the specific domain
 
            If user is provided list only objects accessible to the user.
            Otherwise list all the objects for the specific domain
            ignoring permissions (check_permissions should be False)
 
+           The listing can be restricted to the objects of an account,
+           to public (or non-public) objects, to the objects whose
+           domain metadata match the meta dictionary, to a size_range
+           (min inclusive, max exclusive) and to a map availability.
+
+           The objects are sorted by the sort_key property (e.g. 'size',
+           'mtime', 'uuid') or the sort_meta metadata key, falling back to
+           the sort_key property if both are given, and a page of
+           at most limit objects starting after the object with the marker
+           uuid is returned.
+
            Raises:
                NotAllowedError: if check_permissions is True and user has not
                                 access to the object
                AssertionError: if check_permissions is True but user
                                is provided
+               ValueError: if the marker object is not listed
         """
         if check_permissions:
             allowed_paths = self.permissions.access_list_paths(
@@ -2676,8 +3182,13 @@ class ModularBackend(object):
                                      'if user is provided '
                                      'permission check should be enforced.')
             allowed_paths = None
+        prefix = account + '/' if account is not None else None
         obj_list = self.node.domain_object_list(
-            domain, allowed_paths, CLUSTER_NORMAL)
+            domain, allowed_paths, CLUSTER_NORMAL, prefix=prefix,
+            public=public, attributes=meta, sizeq=size_range,
+            available=available, order_by=sort_key,
+            order_by_attribute=sort_meta, descending=descending,
+            marker=marker, limit=limit)
         return [(path,
                  self._build_metadata(props, user_defined_meta),
                  self.permissions.access_get(path)) for
@@ -13,7 +13,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from pithos.backends.test import common, quota, uuid_methods, snapshots
+from pithos.backends.test import (common, quota, uuid_methods, snapshots,
+                                  statistics)
+from pithos.backends.test.filestore import TestFileStore
+from pithos.backends.test.batch_commissions import TestBatchCommissions
+from pithos.backends.test.block_refs import TestBlockRefs
 
 from sqlalchemy import create_engine
 
@@ -22,7 +26,8 @@ import time
 
 
 class TestSQLAlchemyBackend(common.CommonMixin, uuid_methods.TestUUIDMixin,
-                            quota.TestQuotaMixin, snapshots.TestSnapshotsMixin):
+                            quota.TestQuotaMixin, snapshots.TestSnapshotsMixin,
+                            statistics.TestStatisticsMixin):
     db_module = 'pithos.backends.lib.sqlalchemy'
     db_connection_str = \
         '%(scheme)s://%(user)s:%(pwd)s@%(host)s:%(port)s/%(name)s'
@@ -60,7 +65,8 @@ class TestSQLAlchemyBackend(common.CommonMixin, uuid_methods.TestUUIDMixin,
 
 
 class TestSQLiteBackend(common.CommonMixin, uuid_methods.TestUUIDMixin,
-                        quota.TestQuotaMixin, snapshots.TestSnapshotsMixin):
+                        quota.TestQuotaMixin, snapshots.TestSnapshotsMixin,
+                        statistics.TestStatisticsMixin):
     db_module = 'pithos.backends.lib.sqlite'
     db_connection = location = '/tmp/test_pithos_backend.db'
     mapfile_prefix = 'snf_test_pithos_backend_sqlite_%s_' % \
@@ -0,0 +1,147 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from mock import MagicMock
+
+from pithos.backends.exceptions import QuotaError
+from pithos.backends.test.util import get_random_data, get_random_name
+from pithos.backends.util import connect_backend
+
+import os
+import unittest
+
+
+class TestBatchCommissions(unittest.TestCase):
+    block_size = 1024
+    account = 'user'
+
+    def setUp(self):
+        self.path = mkdtemp(prefix='pithos-batch-commissions-')
+        self.b = self.connect_backend()
+        self.container = get_random_name()
+        self.b.put_container(self.account, self.account, self.container)
+
+    def connect_backend(self):
+        b = connect_backend(
+            db_module='pithos.backends.lib.sqlite',
+            db_connection=os.path.join(self.path, 'backend.db'),
+            block_module='pithos.backends.lib.filestore',
+            block_params={'block_path': os.path.join(self.path, 'data')},
+            block_size=self.block_size,
+            batch_commissions=True)
+        b.astakosclient = MagicMock()
+        b.astakosclient.service_get_quotas.return_value = {
+            self.account: {self.account: {'pithos.diskspace': {
+                'limit': 2 * self.block_size + 100, 'usage': 0, 'pending': 0}}}}
+        b.astakosclient.service_get_project_quotas.return_value = {
+            self.account: {'pithos.diskspace': {
+                'limit': 10 * self.block_size, 'usage': 0, 'pending': 0}}}
+        b.astakosclient.issue_commission_generic.return_value = 42
+        b.astakosclient.resolve_commissions.return_value = {
+            'accepted': [42], 'rejected': [], 'failed': []}
+        return b
+
+    def tearDown(self):
+        self.b.close()
+        rmtree(self.path)
+
+    def upload_object(self, name, length):
+        data = get_random_data(length)
+        hashmap = [self.b.put_block(data)]
+        # Run in a transaction of its own, like an API request
+        self.b.pre_exec()
+        success = False
+        try:
+            self.b.update_object_hashmap(
+                self.account, self.account, self.container, name, length,
+                'application/octet-stream', hashmap, checksum='',
+                domain='pithos')
+            success = True
+        finally:
+            self.b.post_exec(success)
+
+    def test_size_changes_are_batched(self):
+        a = self.account
+        self.upload_object('obj1', 100)
+        self.upload_object('obj2', 200)
+        self.b.delete_object(a, a, self.container, 'obj1')
+        self.assertFalse(self.b.astakosclient.issue_one_commission.called)
+        self.assertFalse(self.b.astakosclient.resolve_commissions.called)
+
+        self.assertEqual(self.b.issue_pending_commissions(), 3)
+        self.b.astakosclient.issue_commission_generic.assert_called_once_with(
+            {(a, a, 'pithos.diskspace'): 200}, {(a, 'pithos.diskspace'): 200},
+            name='pithos: batched size changes', force=True)
+        self.b.astakosclient.resolve_commissions.assert_called_once_with(
+            accept_serials=[42], reject_serials=[])
+
+        self.assertEqual(self.b.issue_pending_commissions(), 0)
+        self.assertEqual(
+            self.b.astakosclient.issue_commission_generic.call_count, 1)
+
+    def test_quota_limit(self):
+        self.upload_object('obj1', self.block_size)
+        self.upload_object('obj2', self.block_size)
+        self.assertRaises(QuotaError, self.upload_object, 'obj3', 101)
+        self.upload_object('obj4', 100)
+        self.assertRaises(QuotaError, self.upload_object, 'obj5', 1)
+        # The quotas are fetched once and then served from the cache.
+        self.assertEqual(
+            self.b.astakosclient.service_get_quotas.call_count, 1)
+        self.assertEqual(
+            self.b.astakosclient.service_get_project_quotas.call_count, 1)
+
+    def test_project_quota_limit(self):
+        project_quota = self.b.astakosclient.service_get_project_quotas. \
+            return_value[self.account]['pithos.diskspace']
+        project_quota['usage'] = 8 * self.block_size
+        project_quota['pending'] = self.block_size
+        self.upload_object('obj1', self.block_size)
+        self.assertRaises(QuotaError, self.upload_object, 'obj2', 1)
+
+    def test_flush_by_other_backend(self):
+        other = self.connect_backend()
+        self.addCleanup(other.close)
+        self.upload_object('obj1', self.block_size)
+        self.assertEqual(other.issue_pending_commissions(), 1)
+        # The quotas cached by self.b do not include the issued change,
+        # which is still counted.
+        self.upload_object('obj2', self.block_size)
+        self.assertRaises(QuotaError, self.upload_object, 'obj3', 101)
+        self.assertEqual(
+            self.b.astakosclient.service_get_quotas.call_count, 1)
+        # Once refetched, the quotas include the issued change.
+        self.b.quota_cache_timeout = 0
+        user_quota = self.b.astakosclient.service_get_quotas.return_value[
+            self.account][self.account]['pithos.diskspace']
+        user_quota['usage'] = self.block_size
+        self.upload_object('obj4', 100)
+        self.assertRaises(QuotaError, self.upload_object, 'obj5', 1)
+
+    def test_issued_changes_expire(self):
+        self.upload_object('obj1', self.block_size)
+        self.b.issue_pending_commissions()
+        serials = self.b.commission_serials
+        self.assertEqual(serials.get_delta_sum(self.account, self.account),
+                         0)
+        self.assertEqual(
+            serials.get_delta_sum(self.account, self.account, 0),
+            self.block_size)
+        self.b.quota_cache_timeout = 0
+        self.b.issue_pending_commissions()
+        self.assertEqual(
+            serials.get_delta_sum(self.account, self.account, 0), 0)
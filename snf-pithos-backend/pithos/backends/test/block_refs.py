@@ -0,0 +1,213 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from binascii import hexlify
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from pithos.backends.exceptions import ItemNotExists, NotAllowedError
+from pithos.backends.test.util import get_random_data, get_random_name
+from pithos.backends.util import connect_backend
+from mock import patch
+
+import os
+import unittest
+
+
+class TestBlockRefs(unittest.TestCase):
+    block_size = 1024
+    account = 'user'
+
+    def setUp(self):
+        self.path = mkdtemp(prefix='pithos-block-refs-')
+        self.b = connect_backend(
+            db_module='pithos.backends.lib.sqlite',
+            db_connection=os.path.join(self.path, 'backend.db'),
+            block_module='pithos.backends.lib.filestore',
+            block_params={'block_path': os.path.join(self.path, 'data')},
+            block_size=self.block_size)
+        self.container = get_random_name()
+        self.b.put_container(self.account, self.account, self.container)
+
+    def tearDown(self):
+        self.b.close()
+        rmtree(self.path)
+
+    def upload_object(self, name, data):
+        blocks = [data[i:i + self.block_size]
+                  for i in xrange(0, len(data), self.block_size)]
+        self.b.update_object_hashmap(
+            self.account, self.account, self.container, name, len(data),
+            'application/octet-stream', self.b.put_blocks(blocks),
+            checksum='', domain='pithos')
+
+    def get_summary(self):
+        stats = self.b.get_block_stats()
+        return stats['blocks'], stats['logical'], stats['physical']
+
+    def test_refs(self):
+        a, c = self.account, self.container
+        data = get_random_data(self.block_size + 500)
+        self.upload_object('obj1', data)
+        self.assertEqual(self.get_summary(), (2, 1524, 1524))
+
+        # A copy stores a new map of the same blocks
+        self.b.copy_object(a, a, c, 'obj1', a, c, 'obj2',
+                           'application/octet-stream', 'pithos')
+        self.assertEqual(self.get_summary(), (2, 3048, 1524))
+
+        # Deleted objects keep their versions, until they are purged
+        self.b.delete_object(a, a, c, 'obj2')
+        self.assertEqual(self.get_summary(), (2, 3048, 1524))
+        self.b.delete_object(a, a, c, 'obj2', until=time())
+        self.assertEqual(self.get_summary(), (2, 1524, 1524))
+
+        # A new version with the same first block
+        self.upload_object('obj1', data[:self.block_size])
+        self.assertEqual(self.get_summary(), (2, 2548, 1524))
+        self.b.delete_object(a, a, c, 'obj1', until=time())
+        self.assertEqual(self.get_summary(), (0, 0, 0))
+
+    def test_account_stats(self):
+        a, c = self.account, self.container
+        data = get_random_data(2 * self.block_size)
+        self.upload_object('obj1', data)
+        self.upload_object('obj2', data[:self.block_size] * 2)
+        other = get_random_name()
+        self.b.put_container(a, a, other)
+        self.b.copy_object(a, a, c, 'obj1', a, other, 'obj1',
+                           'application/octet-stream', 'pithos')
+
+        stats = dict((s['name'], s) for s in self.b.get_block_stats(a))
+        self.assertEqual(stats[c]['versions'], 2)
+        self.assertEqual(stats[c]['logical'], 4 * self.block_size)
+        self.assertEqual(stats[c]['physical'], 2 * self.block_size)
+        self.assertEqual(stats[c]['exclusive'], 0)
+        self.assertEqual(stats[other]['physical'], 2 * self.block_size)
+        self.assertEqual(stats[other]['exclusive'], 0)
+        self.assertEqual(stats[None]['logical'], 6 * self.block_size)
+        self.assertEqual(stats[None]['physical'], 2 * self.block_size)
+        self.assertEqual(stats[None]['exclusive'], 2 * self.block_size)
+
+    def test_rebuild(self):
+        data = get_random_data(3 * self.block_size)
+        self.upload_object('obj1', data)
+        self.upload_object('obj2', data)
+        summary = self.get_summary()
+        self.assertEqual(self.b.get_block_stats()['built'], None)
+
+        marker = None
+        while True:
+            marker = self.b.rebuild_block_refs(marker, limit=1)
+            if marker is None:
+                break
+        self.assertEqual(self.get_summary(), summary)
+        self.assertNotEqual(self.b.get_block_stats()['built'], None)
+
+    def test_collect(self):
+        a, c = self.account, self.container
+        data = get_random_data(2 * self.block_size)
+        self.upload_object('obj1', data)
+        self.assertRaises(NotAllowedError, self.b.collect_blocks, grace=0)
+        self.b.rebuild_block_refs()
+
+        # A block uploaded for a map that was never stored
+        orphan = self.b.put_block(get_random_data(self.block_size))
+        self.assertEqual(self.b.collect_blocks(), [])
+        self.assertEqual(self.b.collect_blocks(grace=0, dry_run=True),
+                         [(orphan, self.block_size)])
+        self.assertEqual(self.b.collect_blocks(grace=0),
+                         [(orphan, self.block_size)])
+        self.assertRaises(ItemNotExists, self.b.get_block, orphan)
+        self.assertEqual(self.b.collect_blocks(grace=0), [])
+
+        # The map and blocks of a purged object
+        hashmap = self.b.get_object_hashmap(a, a, c, 'obj1')[2]
+        self.b.delete_object(a, a, c, 'obj1', until=time())
+        mapfiles = self.b.collect_maps(grace=0)
+        self.assertEqual(len(mapfiles), 1)
+        self.assertEqual(self.b.collect_maps(grace=0), [])
+        blocks = self.b.collect_blocks(grace=0, limit=1)
+        blocks += self.b.collect_blocks(grace=0, marker=blocks[0][0])
+        self.assertEqual(sorted(h for h, _ in blocks), sorted(hashmap))
+        self.assertEqual(self.get_summary(), (0, 0, 0))
+
+    def test_journal(self):
+        data = get_random_data(2 * self.block_size)
+        self.upload_object('obj1', data)
+        hashes = self.b.hash_blocks([data[:self.block_size],
+                                     data[self.block_size:]])
+        # The blocks are marked when stored, and referenced in the journal
+        self.assertEqual(self.b.block_refs.refs_get(hashes),
+                         dict((h, 0) for h in hashes))
+        self.assertEqual(self.get_summary(), (2, 2048, 2048))
+        self.assertEqual(self.b.block_refs.refs_get(hashes),
+                         dict((h, 1) for h in hashes))
+        self.assertEqual(self.b.block_refs.refs_fold(time()), 0)
+
+    def test_no_tracking(self):
+        self.b.rebuild_block_refs()
+        self.b.track_block_refs = False
+        self.upload_object('obj1', get_random_data(self.block_size))
+        self.assertEqual(self.get_summary(), (0, 0, 0))
+        self.assertEqual(self.b.get_block_stats()['built'], None)
+        self.assertRaises(NotAllowedError, self.b.collect_blocks, grace=0)
+        self.b.track_block_refs = True
+        self.assertRaises(NotAllowedError, self.b.collect_blocks, grace=0)
+        self.b.rebuild_block_refs()
+        self.assertEqual(self.get_summary(), (1, 1024, 1024))
+
+    def test_store_blocks(self):
+        self.b.rebuild_block_refs()
+        blocks = [get_random_data(self.block_size), get_random_data(10)]
+        hashes = self.b.hash_blocks(blocks)
+        self.b.touch_blocks(hashes, [len(b) for b in blocks])
+        self.assertEqual(self.b.store_blocks(blocks), hashes)
+        self.assertEqual(sorted(h for h, _ in self.b.collect_blocks(grace=0)),
+                         sorted(hashes))
+        # The hashes of hash_blocks() are used as given
+        self.b.touch_blocks(hashes, [len(b) for b in blocks])
+        self.assertEqual(self.b.store_blocks(blocks, hashes), hashes)
+        self.assertEqual(self.b.get_block(hashes[1]),
+                         blocks[1] + '\x00' * (self.block_size - 10))
+
+    def test_update_block(self):
+        data = get_random_data(self.block_size)
+        delta = get_random_data(100)
+        updated = data[:200] + delta + data[300:]
+        hash = self.b.put_block(data)
+
+        calls = []
+        touch_blocks = self.b.touch_blocks
+        block_put_many = self.b.store.block_put_many
+
+        def touch(hashes, sizes):
+            calls.append(('touch', hashes))
+            return touch_blocks(hashes, sizes)
+
+        def put(blocks, hashes=None):
+            calls.append(('put', [hexlify(h) for h in hashes]))
+            return block_put_many(blocks, hashes)
+
+        with patch.object(self.b, 'touch_blocks', side_effect=touch):
+            with patch.object(self.b.store, 'block_put_many',
+                              side_effect=put):
+                new_hash = self.b.update_block(hash, delta, offset=200)
+        # The block is marked before it is stored, and is not hashed again
+        # to be stored
+        self.assertEqual(calls, [('touch', [new_hash]), ('put', [new_hash])])
+        self.assertEqual(self.b.get_block(new_hash), updated)
+        self.assertRaises(IndexError, self.b.update_block, hash, delta,
+                          offset=self.block_size)
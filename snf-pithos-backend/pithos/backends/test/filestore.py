@@ -0,0 +1,85 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from binascii import hexlify
+from hashlib import sha256
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from pithos.backends.lib.filestore import Store
+from pithos.backends.test.util import get_random_data
+
+import unittest
+
+
+class TestFileStore(unittest.TestCase):
+    block_size = 1024
+
+    def setUp(self):
+        self.path = mkdtemp(prefix='pithos-filestore-')
+        self.store = Store(block_size=self.block_size,
+                           hash_algorithm='sha256',
+                           archipelago_cfile=None,
+                           block_path=self.path)
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def test_block_put_get(self):
+        data = get_random_data(self.block_size / 2)
+        h = self.store.block_put(data)
+        self.assertEqual(h, sha256(data).digest())
+        block = self.store.block_get(h)
+        self.assertEqual(len(block), self.block_size)
+        self.assertEqual(block.rstrip('\x00'), data)
+        self.assertEqual(self.store.block_get_archipelago(hexlify(h)), block)
+
+    def test_block_get_missing(self):
+        self.assertEqual(self.store.block_get(sha256('x').digest()), None)
+        self.assertEqual(self.store.block_get_archipelago('xyz'), None)
+
+    def test_empty_block(self):
+        h = self.store.block_put('')
+        self.assertEqual(self.store.block_get(h), '\x00' * self.block_size)
+        self.assertEqual(self.store.block_search([h]), [])
+
+    def test_block_search(self):
+        stored = [self.store.block_put(get_random_data(10))
+                  for i in xrange(10)]
+        missing = [sha256(str(i)).digest() for i in xrange(5)]
+        hashes = stored + missing + missing
+        self.assertEqual(self.store.block_search(hashes), missing)
+
+    def test_block_put_many(self):
+        blocks = [get_random_data(10) for i in xrange(5)]
+        hashes = self.store.block_put_many(blocks + blocks[:2])
+        self.assertEqual(hashes, [sha256(b).digest()
+                                  for b in blocks + blocks[:2]])
+        self.assertEqual(self.store.block_search(hashes), [])
+
+    def test_block_update(self):
+        data = get_random_data(self.block_size)
+        h = self.store.block_put(data)
+        h2 = self.store.block_update(h, 10, 'abc')
+        self.assertEqual(self.store.block_get(h2),
+                         data[:10] + 'abc' + data[13:])
+        self.assertEqual(self.store.block_get(h), data)
+
+    def test_map_put_get(self):
+        hashes = [hexlify(self.store.block_put(get_random_data(10)))
+                  for i in xrange(3)]
+        self.store.map_put('snf_file_1', hashes, 30, self.block_size)
+        self.assertEqual(self.store.map_get('snf_file_1', 30), hashes)
+        self.assertRaises(IOError, self.store.map_get, 'snf_file_2', 30)
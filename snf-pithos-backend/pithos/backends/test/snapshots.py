@@ -194,3 +194,51 @@ class TestSnapshotsMixin(object):
                           domain='test',
                           user='somebody_else',
                           check_permissions=False)
+
+    def test_get_domain_objects_filtered(self):
+        uuids = {}
+        for name, size, meta in (('snf-snap-2-1', 100, {'foo': 'a'}),
+                                 ('snf-snap-2-2', 300, {'foo': 'b'}),
+                                 ('snf-snap-2-3', 200, {'foo': 'a'})):
+            t = [self.account, self.account, 'snapshots', name]
+            uuids[name] = self.b.register_object_map(
+                *t, domain='test', size=size,
+                type='application/octet-stream',
+                mapfile='archip:%s' % name, meta=meta)
+        self.b.update_object_permissions(self.account, self.account,
+                                         'snapshots', 'snf-snap-2-2',
+                                         {'read': ['*']})
+
+        def list_uuids(**kw):
+            return [meta['uuid'] for _, meta, _ in
+                    self.b.get_domain_objects(domain='test',
+                                              user=self.account, **kw)]
+
+        self.assertEqual(list_uuids(meta={'foo': 'a'}, sort_key='size'),
+                         [uuids['snf-snap-2-1'], uuids['snf-snap-2-3']])
+        self.assertEqual(list_uuids(size_range=(150, 300)),
+                         [uuids['snf-snap-2-3']])
+        self.assertEqual(list_uuids(public=True),
+                         [uuids['snf-snap-2-2']])
+        self.assertEqual(list_uuids(public=False, sort_key='size',
+                                    descending=True),
+                         [uuids['snf-snap-2-3'], uuids['snf-snap-2-1']])
+        self.assertEqual(list_uuids(account='somebody_else'), [])
+
+        # Paginate by size
+        self.assertEqual(list_uuids(sort_key='size', limit=2),
+                         [uuids['snf-snap-2-1'], uuids['snf-snap-2-3']])
+        self.assertEqual(list_uuids(sort_key='size',
+                                    marker=uuids['snf-snap-2-3']),
+                         [uuids['snf-snap-2-2']])
+        self.assertEqual(list_uuids(sort_meta='foo', descending=True,
+                                    limit=1),
+                         [uuids['snf-snap-2-2']])
+        self.assertRaises(ValueError, list_uuids, marker='unknown')
+
+        # Sort by a metadata key, falling back to a property
+        self.b.update_object_meta(self.account, self.account, 'snapshots',
+                                  'snf-snap-2-2', 'test', {'bar': '150'})
+        self.assertEqual(list_uuids(sort_meta='bar', sort_key='size'),
+                         [uuids['snf-snap-2-1'], uuids['snf-snap-2-2'],
+                          uuids['snf-snap-2-3']])
@@ -0,0 +1,74 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import partial
+
+from mock import patch, PropertyMock
+
+from pithos.backends.random_word import get_random_word
+
+get_random_name = partial(get_random_word, length=8)
+
+
+class TestStatisticsMixin(object):
+    def _get_usage(self, container=None):
+        account = self.account
+        if container is None:
+            # With an external quotaholder, the account bytes are its usage,
+            # so read the statistics of the backend instead.
+            with patch.object(type(self.b), 'using_external_quotaholder',
+                              new_callable=PropertyMock, return_value=False):
+                meta = self.b.get_account_meta(account, account,
+                                               include_user_defined=False)
+        else:
+            meta = self.b.get_container_meta(account, account, container,
+                                             include_user_defined=False)
+        return meta['count'], meta['bytes']
+
+    def test_container_statistics(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        self.assertEqual(self._get_usage(container), (0, 0))
+
+        self.upload_object(account, account, container, 'a', length=10)
+        self.upload_object(account, account, container, 'a/b', length=20)
+        self.assertEqual(self._get_usage(container), (2, 30))
+
+        # Overwriting moves the previous version to the history cluster.
+        self.upload_object(account, account, container, 'a', length=5)
+        self.assertEqual(self._get_usage(container), (2, 25))
+
+        self.b.delete_object(account, account, container, 'a/b')
+        self.assertEqual(self._get_usage(container), (1, 5))
+
+    def test_account_statistics(self):
+        account = self.account
+        count, bytes = self._get_usage()
+
+        container1 = get_random_name()
+        container2 = get_random_name()
+        self.b.put_container(account, account, container1)
+        self.b.put_container(account, account, container2)
+        self.assertEqual(self._get_usage(), (count + 2, bytes))
+
+        self.upload_object(account, account, container1, 'a', length=10)
+        self.upload_object(account, account, container2, 'a', length=20)
+        self.upload_object(account, account, container2, 'b', length=30)
+        self.assertEqual(self._get_usage(), (count + 2, bytes + 60))
+
+        self.upload_object(account, account, container2, 'b', length=1)
+        self.b.delete_object(account, account, container1, 'a')
+        self.assertEqual(self._get_usage(), (count + 2, bytes + 21))
@@ -13,14 +13,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
 from django.utils.encoding import smart_str
+from django.utils.http import http_date
 
 import gd
+import json
 import os
 import os.path
+import re
+import uuid
 
 from cStringIO import StringIO
+from functools import partial
+from time import time
 
 import rrdtool
 
@@ -31,6 +37,7 @@ from hashlib import sha256
 from synnefo_stats import settings
 
 from snf_django.lib.api import faults, api_method
+from snf_django.lib.api.parsedate import parse_http_date_safe
 
 from logging import getLogger
 log = getLogger(__name__)
@@ -47,8 +54,35 @@ def read_file(filepath):
     return data
 
 
+def write_file(filepath, data):
+    f = open(filepath, "w")
+
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def cpu_rrd_files(fname):
+    return [os.path.join(fname, "cpu", "virt_cpu_total.rrd")]
+
+
+def net_rrd_files(fname):
+    dname = os.path.join(fname, "interface")
+
+    if not os.path.isdir(dname):
+        raise faults.ItemNotFound("VM has no attached NICs")
+
+    fnames = [os.path.join(dname, rrdfile) for rrdfile in os.listdir(dname)]
+
+    if not fnames:
+        raise faults.ItemNotFound("VM has no attached NICs")
+
+    return fnames
+
+
 def draw_cpu_bar(fname, outfname=None):
-    fname = os.path.join(fname, "cpu", "virt_cpu_total.rrd")
+    fname = cpu_rrd_files(fname)[0]
 
     try:
         values = rrdtool.fetch(fname, "AVERAGE")[2][-20:]
@@ -95,15 +129,7 @@ def draw_cpu_bar(fname, outfname=None):
 
 
 def draw_net_bar(fname, outfname=None):
-    dname = os.path.join(fname, "interface")
-
-    if not os.path.isdir(dname):
-        raise faults.ItemNotFound("VM has no attached NICs")
-
-    fnames = [os.path.join(dname, rrdfile) for rrdfile in os.listdir(dname)]
-
-    if not fnames:
-        raise faults.ItemNotFound("VM has no attached NICs")
+    fnames = net_rrd_files(fname)
 
     rx_value = 0
     tx_value = 0
@@ -158,11 +184,10 @@ def draw_net_bar(fname, outfname=None):
     return data
 
 
-def draw_cpu_ts(fname, outfname):
-    fname = os.path.join(fname, "cpu", "virt_cpu_total.rrd")
-    outfname += "-cpu.png"
+def draw_cpu_ts(fname, outfname, end):
+    fname = cpu_rrd_files(fname)[0]
 
-    rrdtool.graph(outfname, "-s", "-1d", "-e", "-20s",
+    rrdtool.graph(outfname, "-s", "end-1d", "-e", "%d" % end,
                   # "-t", "CPU usage",
                   "-v", "%",
                   # "--lazy",
@@ -172,11 +197,10 @@ def draw_cpu_ts(fname, outfname):
     return read_file(outfname)
 
 
-def draw_cpu_ts_w(fname, outfname):
-    fname = os.path.join(fname, "cpu", "virt_cpu_total.rrd")
-    outfname += "-cpu-weekly.png"
+def draw_cpu_ts_w(fname, outfname, end):
+    fname = cpu_rrd_files(fname)[0]
 
-    rrdtool.graph(outfname, "-s", "-1w", "-e", "-20s",
+    rrdtool.graph(outfname, "-s", "end-1w", "-e", "%d" % end,
                   # "-t", "CPU usage",
                   "-v", "%",
                   # "--lazy",
@@ -186,18 +210,8 @@ def draw_cpu_ts_w(fname, outfname):
     return read_file(outfname)
 
 
-def draw_net_ts(fname, outfname):
-    outfname += "-net.png"
-
-    dname = os.path.join(fname, "interface")
-
-    if not os.path.isdir(dname):
-        raise faults.ItemNotFound("VM has no attached NICs")
-
-    fnames = [os.path.join(dname, rrdfile) for rrdfile in os.listdir(dname)]
-
-    if not fnames:
-        raise faults.ItemNotFound("VM has no attached NICs")
+def draw_net_ts(fname, outfname, end):
+    fnames = net_rrd_files(fname)
 
     args = ["DEF:rx%d=%s:rx:AVERAGE" % t for t in enumerate(fnames)]
     args += ["DEF:tx%d=%s:tx:AVERAGE" % t for t in enumerate(fnames)]
@@ -218,7 +232,7 @@ def draw_net_ts(fname, outfname):
              "LINE1:txbits#0000ff:Outgoing",
              "GPRINT:txbits:AVERAGE:\t%4.0lf%sbps\\n"]
 
-    rrdtool.graph(outfname, "-s", "-1d", "-e", "-20s",
+    rrdtool.graph(outfname, "-s", "end-1d", "-e", "%d" % end,
                   "--units", "si",
                   "-v", "Bits/s",
                   "COMMENT:\t\t\tAverage network traffic\\n",
@@ -227,18 +241,8 @@ def draw_net_ts(fname, outfname):
     return read_file(outfname)
 
 
-def draw_net_ts_w(fname, outfname):
-    outfname += "-net-weekly.png"
-
-    dname = os.path.join(fname, "interface")
-
-    if not os.path.isdir(dname):
-        raise faults.ItemNotFound("VM has no attached NICs")
-
-    fnames = [os.path.join(dname, rrdfile) for rrdfile in os.listdir(dname)]
-
-    if not fnames:
-        raise faults.ItemNotFound("VM has no attached NICs")
+def draw_net_ts_w(fname, outfname, end):
+    fnames = net_rrd_files(fname)
 
     args = ["DEF:rx%d=%s:rx:AVERAGE" % t for t in enumerate(fnames)]
     args += ["DEF:tx%d=%s:tx:AVERAGE" % t for t in enumerate(fnames)]
@@ -259,7 +263,7 @@ def draw_net_ts_w(fname, outfname):
              "LINE1:txbits#0000ff:Outgoing",
              "GPRINT:txbits:AVERAGE:\t%4.0lf%sbps\\n"]
 
-    rrdtool.graph(outfname, "-s", "-1w", "-e", "-20s",
+    rrdtool.graph(outfname, "-s", "end-1w", "-e", "%d" % end,
                   "--units", "si",
                   "-v", "Bits/s",
                   "COMMENT:\t\t\tAverage network traffic\\n",
@@ -276,18 +280,8 @@ def decrypt(secret):
     return aes.decrypt(urlsafe_b64decode(secret)).rstrip('\x00')
 
 
-available_graph_types = {'cpu-bar': draw_cpu_bar,
-                         'net-bar': draw_net_bar,
-                         'cpu-ts': draw_cpu_ts,
-                         'net-ts': draw_net_ts,
-                         'cpu-ts-w': draw_cpu_ts_w,
-                         'net-ts-w': draw_net_ts_w
-                         }
-
-
-@api_method(http_method='GET', token_required=False, user_required=False,
-            format_allowed=False, logger=log)
-def grapher(request, graph_type, hostname):
+def get_rrd_dir(hostname):
+    """Return the RRD directory of an encrypted virtual server name."""
     try:
         hostname = decrypt(smart_str(hostname))
     except (ValueError, TypeError):
@@ -295,12 +289,250 @@ def grapher(request, graph_type, hostname):
     fname = smart_str(os.path.join(settings.RRD_PREFIX, hostname))
     if not os.path.isdir(fname):
         raise faults.ItemNotFound('No such instance')
+    return hostname, fname
+
+
+def get_mtime(fnames):
+    """Return the last modification time of the RRD files, in seconds,
+    or None if any of them is missing.
+    """
+    try:
+        return max(int(os.path.getmtime(f)) for f in fnames)
+    except OSError:
+        return None
+
+
+def get_window_end(now=None):
+    """Return the end of the time window of the time series graphs.
+
+    The window moves in steps of GRAPH_TS_STEP seconds, so that the graphs
+    drawn within a step are the same and can be cached.
+    """
+    if now is None:
+        now = time()
+    # Leave out the last seconds, which collectd may not have written yet
+    return int(now - 20) // settings.GRAPH_TS_STEP * settings.GRAPH_TS_STEP
+
+
+# The draw function, the RRD files and whether the graph is a time series,
+# whose time window moves with the time, of each graph type
+available_graph_types = {'cpu-bar': (draw_cpu_bar, cpu_rrd_files, False),
+                         'net-bar': (draw_net_bar, net_rrd_files, False),
+                         'cpu-ts': (draw_cpu_ts, cpu_rrd_files, True),
+                         'net-ts': (draw_net_ts, net_rrd_files, True),
+                         'cpu-ts-w': (draw_cpu_ts_w, cpu_rrd_files, True),
+                         'net-ts-w': (draw_net_ts_w, net_rrd_files, True)
+                         }
+
+# The names of the cached graphs, '<hostname>-<graph type>.png' or, for the
+# time series, '<hostname>-<graph type>-<window end>.png'
+cached_graph_re = re.compile(
+    r"^(?P<hostname>.+)-(?P<graph_type>%s)(-(?P<end>\d+))?\.png$" %
+    "|".join(sorted(available_graph_types, key=len, reverse=True)))
 
-    outfname = smart_str(os.path.join(settings.GRAPH_PREFIX, hostname))
-    draw_func = available_graph_types[graph_type]
 
-    response = HttpResponse(draw_func(fname, outfname),
+def get_graph_path(hostname, graph_type, end=None):
+    """Return the path of the cached graph of a virtual server."""
+    name = "%s-%s" % (hostname, graph_type)
+    if end is not None:
+        name += "-%d" % end
+    return smart_str(os.path.join(settings.GRAPH_PREFIX, name + ".png"))
+
+
+def render_graph(draw_func, fname, outfname, mtime):
+    """Return a rendered graph, drawing it only if its RRD files have been
+    modified since it was last rendered.
+
+    Rendered graphs are kept in outfname, with the modification time of
+    the RRD files they have been drawn from.
+    """
+    cache = settings.GRAPH_CACHE and mtime is not None
+    if cache:
+        try:
+            if int(os.path.getmtime(outfname)) == mtime:
+                return read_file(outfname)
+        except (IOError, OSError):
+            pass
+
+    tmpfname = "%s.%s.tmp" % (outfname, uuid.uuid4().hex)
+    try:
+        data = draw_func(fname, tmpfname)
+        if cache:
+            try:
+                if not os.path.exists(tmpfname):
+                    write_file(tmpfname, data)
+                os.utime(tmpfname, (mtime, mtime))
+                os.rename(tmpfname, outfname)
+            except (IOError, OSError) as e:
+                log.warning("Cannot cache graph %s: %s", outfname, e)
+        return data
+    finally:
+        if os.path.exists(tmpfname):
+            os.unlink(tmpfname)
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        return etag in [t.strip() for t in if_none_match.split(",")]
+    if_modified_since = request.META.get("HTTP_IF_MODIFIED_SINCE")
+    if if_modified_since is not None:
+        if_modified_since = parse_http_date_safe(if_modified_since)
+        return if_modified_since is not None and mtime <= if_modified_since
+    return False
+
+
+@api_method(http_method='GET', token_required=False, user_required=False,
+            format_allowed=False, logger=log)
+def grapher(request, graph_type, hostname):
+    hostname, fname = get_rrd_dir(hostname)
+    draw_func, rrd_files, time_series = available_graph_types[graph_type]
+
+    # Graphs change only when their RRD files do or, for the time series,
+    # when their time window moves
+    mtime = get_mtime(rrd_files(fname))
+    end = None
+    if time_series:
+        end = get_window_end()
+        draw_func = partial(draw_func, end=end)
+    etag = None
+    if mtime is not None:
+        modified = mtime
+        etag = "%s-%d" % (graph_type, mtime)
+        if end is not None:
+            modified = max(mtime, end)
+            etag += "-%d" % end
+        etag = '"%s"' % etag
+        if not_modified(request, etag, modified):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            response.override_serialization = True
+            return response
+
+    outfname = get_graph_path(hostname, graph_type, end)
+    response = HttpResponse(render_graph(draw_func, fname, outfname, mtime),
                             status=200, content_type="image/png")
+    if etag is not None:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+    response.override_serialization = True
+
+    return response
+
+
+def prune_graph_cache(now=None):
+    """Delete the cached graphs that will not be used again.
+
+    These are the graphs of the virtual servers that no longer have RRD
+    files and the time series graphs of past time windows. Return the number
+    of deleted files.
+    """
+    end = get_window_end(now)
+    pruned = 0
+    for name in os.listdir(settings.GRAPH_PREFIX):
+        match = cached_graph_re.match(name)
+        if match is None:
+            continue
+        if match.group("end") is None or int(match.group("end")) >= end:
+            rrd_dir = os.path.join(settings.RRD_PREFIX,
+                                   match.group("hostname"))
+            if os.path.isdir(rrd_dir):
+                continue
+        try:
+            os.unlink(os.path.join(settings.GRAPH_PREFIX, name))
+        except OSError as e:
+            log.warning("Cannot delete cached graph %s: %s", name, e)
+            continue
+        pruned += 1
+    return pruned
+
+
+def fetch_series(fnames, start):
+    """Return the start, step and values of the sum of the AVERAGE series of
+    the RRD files. Each value is a tuple with a sum per data source, or None
+    for each data source without data.
+    """
+    result = None
+    for fname in fnames:
+        (first, last, step), names, rows = \
+            rrdtool.fetch(fname, "AVERAGE", "-s", start, "-e", "-20s")
+        if result is None:
+            result = (first, step, [list(row) for row in rows])
+            continue
+        for total, row in zip(result[2], rows):
+            for i, value in enumerate(row):
+                if value is None:
+                    continue
+                total[i] = value if total[i] is None else total[i] + value
+    return result
+
+
+def get_cpu_series(fname, start):
+    try:
+        first, step, rows = fetch_series(cpu_rrd_files(fname), start)
+    except rrdtool.error:
+        return None
+    return {"start": first, "step": step,
+            "values": [row[0] for row in rows]}
+
+
+def get_net_series(fname, start):
+    try:
+        first, step, rows = fetch_series(net_rrd_files(fname), start)
+    except (faults.ItemNotFound, rrdtool.error):
+        return None
+
+    def bits(value):
+        return None if value is None else value * 8
+
+    return {"start": first, "step": step,
+            "rx": [bits(row[0]) for row in rows],
+            "tx": [bits(row[1]) for row in rows]}
+
+
+available_series_types = {'cpu': get_cpu_series,
+                          'net': get_net_series}
+
+available_series_periods = {'day': "-1d",
+                            'week': "-1w"}
+
+
+@api_method(http_method='GET', token_required=False, user_required=False,
+            format_allowed=False, logger=log)
+def series(request):
+    """Return the time series of several virtual servers in one response.
+
+    The encrypted names of the servers are given by the 'server' parameters,
+    the series by the 'type' parameters (all by default) and the time span
+    by the 'period' parameter. Servers without data are mapped to null.
+    """
+    servers = request.GET.getlist("server")
+    if not servers:
+        raise faults.BadRequest("No virtual servers specified")
+    if len(servers) > settings.SERIES_MAX_SERVERS:
+        raise faults.BadRequest("Too many virtual servers, the limit is %d"
+                                % settings.SERIES_MAX_SERVERS)
+    types = request.GET.getlist("type") or sorted(available_series_types)
+    for t in types:
+        if t not in available_series_types:
+            raise faults.BadRequest("Invalid series type '%s'" % t)
+    period = request.GET.get("period", "day")
+    if period not in available_series_periods:
+        raise faults.BadRequest("Invalid period '%s'" % period)
+    start = available_series_periods[period]
+
+    result = {}
+    for server in set(servers):
+        try:
+            fname = get_rrd_dir(server)[1]
+        except faults.ItemNotFound:
+            result[server] = None
+            continue
+        result[server] = dict((t, available_series_types[t](fname, start))
+                              for t in types)
+
+    response = HttpResponse(json.dumps({"servers": result}), status=200,
+                            content_type="application/json")
     response.override_serialization = True
 
     return response
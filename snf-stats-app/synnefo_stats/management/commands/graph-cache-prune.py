@@ -0,0 +1,35 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import CommandError
+
+from snf_django.management.commands import SynnefoCommand
+from synnefo_stats.grapher import prune_graph_cache
+
+
+class Command(SynnefoCommand):
+    help = """Delete the cached graphs that will not be used again
+
+These are the graphs of the VMs that no longer have RRD files in RRD_PREFIX
+and the daily and weekly graphs of past time windows. The command can be run
+at any time, e.g. periodically from cron.
+"""
+
+    def handle(self, **options):
+        try:
+            pruned = prune_graph_cache()
+        except OSError as e:
+            raise CommandError("Cannot list GRAPH_PREFIX: %s" % e)
+        self.stdout.write("Deleted %d cached graphs\n" % pruned)
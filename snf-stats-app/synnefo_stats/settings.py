@@ -12,6 +12,17 @@ HEIGHT = getattr(settings, 'HEIGHT', 10)
 RRD_PREFIX = getattr(settings, 'RRD_PREFIX', "/var/lib/collectd/rrd/")
 GRAPH_PREFIX = getattr(settings, 'GRAPH_PREFIX', "/var/cache/snf-stats-app/")
 
+# Keep the rendered graphs in GRAPH_PREFIX and draw them again only when
+# their RRD files change
+GRAPH_CACHE = getattr(settings, 'GRAPH_CACHE', True)
+
+# Seconds by which the time window of the daily and weekly graphs moves.
+# These graphs are drawn again at least this often.
+GRAPH_TS_STEP = getattr(settings, 'GRAPH_TS_STEP', 300)
+
+# Maximum number of virtual servers in a single time series request
+SERIES_MAX_SERVERS = getattr(settings, 'SERIES_MAX_SERVERS', 100)
+
 # Font settings
 FONT = getattr(settings, 'FONT',
                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
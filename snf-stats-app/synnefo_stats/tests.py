@@ -0,0 +1,292 @@
+# Copyright (C) 2010-2017 GRNET S.A. and individual contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+from django.test.client import RequestFactory
+from django.utils.http import http_date
+
+from mock import patch, Mock
+
+from synnefo_stats import grapher
+from synnefo_stats.grapher import settings
+
+NOW = 1500000150
+# The end of the time window of the time series graphs at NOW
+END = 1500000000
+
+
+class RRDError(Exception):
+    pass
+
+
+class GrapherTestCase(SimpleTestCase):
+    def setUp(self):
+        self.rrd_prefix = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.rrd_prefix)
+        self.graph_prefix = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.graph_prefix)
+        self.now = NOW
+        patchers = [
+            patch.object(settings, "RRD_PREFIX", self.rrd_prefix),
+            patch.object(settings, "GRAPH_PREFIX", self.graph_prefix),
+            patch.object(settings, "GRAPH_CACHE", True),
+            patch.object(settings, "GRAPH_TS_STEP", 300),
+            # The names of the servers are not encrypted in the tests
+            patch("synnefo_stats.grapher.decrypt", side_effect=lambda s: s),
+            patch("synnefo_stats.grapher.time", side_effect=lambda: self.now),
+            patch("synnefo_stats.grapher.rrdtool")]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.rrdtool = grapher.rrdtool
+        self.rrdtool.error = RRDError
+        self.rrdtool.graph.side_effect = self.draw_graph
+        self.factory = RequestFactory()
+
+    def draw_graph(self, outfname, *args):
+        grapher.write_file(outfname, " ".join(args[:4]))
+
+    def add_rrd(self, hostname, path, mtime=NOW - 600):
+        fname = os.path.join(self.rrd_prefix, hostname, path)
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        open(fname, "w").close()
+        os.utime(fname, (mtime, mtime))
+
+    def get_graph(self, graph_type="cpu-ts", hostname="snf-1", **headers):
+        request = self.factory.get("/%s/%s" % (graph_type, hostname),
+                                   **headers)
+        return grapher.grapher(request, graph_type, hostname)
+
+
+class GraphTest(GrapherTestCase):
+    def setUp(self):
+        super(GraphTest, self).setUp()
+        self.add_rrd("snf-1", "cpu/virt_cpu_total.rrd")
+
+    def test_cache_hit(self):
+        response = self.get_graph()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content,
+                         "-s end-1d -e %d" % END)
+        self.assertEqual(response["ETag"], '"cpu-ts-%d-%d"'
+                         % (NOW - 600, END))
+        self.assertEqual(response["Last-Modified"], http_date(END))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.graph_prefix, "snf-1-cpu-ts-%d.png" % END)))
+        # Later, within the same time window
+        self.now += 100
+        cached = self.get_graph()
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached["ETag"], response["ETag"])
+        self.assertEqual(self.rrdtool.graph.call_count, 1)
+
+    def test_rrd_changed(self):
+        response = self.get_graph()
+        self.add_rrd("snf-1", "cpu/virt_cpu_total.rrd", mtime=NOW - 100)
+        changed = self.get_graph()
+        self.assertEqual(self.rrdtool.graph.call_count, 2)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+        self.assertEqual(changed["Last-Modified"], http_date(NOW - 100))
+
+    def test_window_moved(self):
+        response = self.get_graph()
+        # The RRD files have not changed, but the time window has moved
+        self.now += 300
+        moved = self.get_graph()
+        self.assertEqual(self.rrdtool.graph.call_count, 2)
+        self.assertEqual(moved.content, "-s end-1d -e %d" % (END + 300))
+        self.assertNotEqual(moved["ETag"], response["ETag"])
+        self.assertEqual(moved["Last-Modified"], http_date(END + 300))
+
+    def test_bar_graph(self):
+        with patch.dict(grapher.available_graph_types,
+                        {"cpu-bar": (Mock(return_value="bar"),
+                                     grapher.cpu_rrd_files, False)}):
+            draw = grapher.available_graph_types["cpu-bar"][0]
+            response = self.get_graph("cpu-bar")
+            self.assertEqual(response["ETag"], '"cpu-bar-%d"' % (NOW - 600))
+            self.assertTrue(os.path.exists(os.path.join(
+                self.graph_prefix, "snf-1-cpu-bar.png")))
+            # Bars do not depend on the time window
+            self.now += 3600
+            cached = self.get_graph("cpu-bar")
+        self.assertEqual(cached.content, "bar")
+        self.assertEqual(cached["ETag"], response["ETag"])
+        self.assertEqual(draw.call_count, 1)
+
+    def test_no_cache(self):
+        with patch.object(settings, "GRAPH_CACHE", False):
+            self.get_graph()
+            self.get_graph()
+        self.assertEqual(self.rrdtool.graph.call_count, 2)
+        self.assertEqual(os.listdir(self.graph_prefix), [])
+
+    def test_missing_rrd(self):
+        os.unlink(os.path.join(self.rrd_prefix, "snf-1", "cpu",
+                               "virt_cpu_total.rrd"))
+        response = self.get_graph(HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+        self.assertEqual(os.listdir(self.graph_prefix), [])
+
+    def test_unknown_server(self):
+        response = self.get_graph(hostname="snf-2")
+        self.assertEqual(response.status_code, 404)
+
+    def test_if_none_match(self):
+        etag = self.get_graph()["ETag"]
+        response = self.get_graph(HTTP_IF_NONE_MATCH='"other", ' + etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.rrdtool.graph.call_count, 1)
+        self.now += 300
+        response = self.get_graph(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        modified = self.get_graph()["Last-Modified"]
+        response = self.get_graph(HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.rrdtool.graph.call_count, 1)
+        response = self.get_graph(
+            HTTP_IF_MODIFIED_SINCE=http_date(NOW - 600))
+        self.assertEqual(response.status_code, 200)
+        response = self.get_graph(HTTP_IF_MODIFIED_SINCE="invalid date")
+        self.assertEqual(response.status_code, 200)
+
+
+class NotModifiedTest(SimpleTestCase):
+    def test_not_modified(self):
+        factory = RequestFactory()
+        etag = '"cpu-ts-10-20"'
+        cases = [({}, False),
+                 ({"HTTP_IF_NONE_MATCH": etag}, True),
+                 ({"HTTP_IF_NONE_MATCH": '"a", %s' % etag}, True),
+                 ({"HTTP_IF_NONE_MATCH": '"cpu-ts-10-10"'}, False),
+                 # If-None-Match takes precedence over If-Modified-Since
+                 ({"HTTP_IF_NONE_MATCH": '"a"',
+                   "HTTP_IF_MODIFIED_SINCE": http_date(20)}, False),
+                 ({"HTTP_IF_MODIFIED_SINCE": http_date(20)}, True),
+                 ({"HTTP_IF_MODIFIED_SINCE": http_date(19)}, False),
+                 ({"HTTP_IF_MODIFIED_SINCE": "invalid"}, False)]
+        for headers, expected in cases:
+            request = factory.get("/", **headers)
+            self.assertEqual(grapher.not_modified(request, etag, 20),
+                             expected, headers)
+
+
+class RenderGraphTest(GrapherTestCase):
+    def test_render_graph(self):
+        outfname = os.path.join(self.graph_prefix, "graph.png")
+        draw = Mock(return_value="graph")
+        self.assertEqual(grapher.render_graph(draw, "fname", outfname, 10),
+                         "graph")
+        self.assertEqual(grapher.read_file(outfname), "graph")
+        self.assertEqual(int(os.path.getmtime(outfname)), 10)
+        self.assertEqual(grapher.render_graph(draw, "fname", outfname, 10),
+                         "graph")
+        self.assertEqual(draw.call_count, 1)
+        # Unknown modification times are never cached
+        grapher.render_graph(draw, "fname", outfname, None)
+        self.assertEqual(draw.call_count, 2)
+        draw.return_value = "newer"
+        self.assertEqual(grapher.render_graph(draw, "fname", outfname, 20),
+                         "newer")
+        self.assertEqual(grapher.read_file(outfname), "newer")
+        # No temporary files are left behind
+        self.assertEqual(os.listdir(self.graph_prefix), ["graph.png"])
+
+
+class PruneTest(GrapherTestCase):
+    def test_prune(self):
+        self.add_rrd("snf-1", "cpu/virt_cpu_total.rrd")
+        end = grapher.get_window_end()
+        names = ["snf-1-cpu-bar.png",
+                 "snf-1-cpu-ts-w-%d.png" % end,
+                 "snf-1-net-ts-%d.png" % (end - 300),
+                 "snf-2-cpu-bar.png",
+                 "snf-2-cpu-ts-%d.png" % end,
+                 "other"]
+        for name in names:
+            grapher.write_file(os.path.join(self.graph_prefix, name), "")
+        self.assertEqual(grapher.prune_graph_cache(), 3)
+        self.assertEqual(sorted(os.listdir(self.graph_prefix)),
+                         ["other", "snf-1-cpu-bar.png",
+                          "snf-1-cpu-ts-w-%d.png" % end])
+
+
+class SeriesTest(GrapherTestCase):
+    def setUp(self):
+        super(SeriesTest, self).setUp()
+        self.add_rrd("snf-1", "cpu/virt_cpu_total.rrd")
+        self.add_rrd("snf-1", "interface/if_octets-tap0.rrd")
+        self.add_rrd("snf-1", "interface/if_octets-tap1.rrd")
+        self.add_rrd("snf-2", "cpu/virt_cpu_total.rrd")
+        rows = {"cpu": [(1.0,), (None,)],
+                "tap0": [(1.0, 2.0), (None, 3.0)],
+                "tap1": [(4.0, None), (None, 5.0)]}
+
+        def fetch(fname, *args):
+            name = [key for key in rows
+                    if key in os.path.basename(fname)][0]
+            return (100, 120, 10), ["rx", "tx"], rows[name]
+
+        self.rrdtool.fetch.side_effect = fetch
+
+    def get_series(self, data):
+        request = self.factory.get("/series", data)
+        return grapher.series(request)
+
+    def test_fetch_series(self):
+        fnames = grapher.net_rrd_files(os.path.join(self.rrd_prefix,
+                                                    "snf-1"))
+        self.assertEqual(grapher.fetch_series(fnames, "-1d"),
+                         (100, 10, [[5.0, 2.0], [None, 8.0]]))
+
+    def test_series(self):
+        response = self.get_series({"server": ["snf-1", "snf-2", "snf-3"],
+                                    "period": "week"})
+        self.assertEqual(response.status_code, 200)
+        servers = json.loads(response.content)["servers"]
+        self.assertEqual(servers["snf-1"], {
+            "cpu": {"start": 100, "step": 10, "values": [1.0, None]},
+            "net": {"start": 100, "step": 10, "rx": [40.0, None],
+                    "tx": [16.0, 64.0]}})
+        # The server has no NICs
+        self.assertEqual(servers["snf-2"]["net"], None)
+        self.assertEqual(servers["snf-3"], None)
+        for call in self.rrdtool.fetch.call_args_list:
+            self.assertEqual(call[0][3], "-1w")
+
+    def test_series_type(self):
+        response = self.get_series({"server": "snf-1", "type": "cpu"})
+        servers = json.loads(response.content)["servers"]
+        self.assertEqual(servers["snf-1"].keys(), ["cpu"])
+
+    def test_bad_request(self):
+        with patch.object(settings, "SERIES_MAX_SERVERS", 1):
+            for data in [{},
+                         {"server": ["snf-1", "snf-2"]},
+                         {"server": "snf-1", "type": "disk"},
+                         {"server": "snf-1", "period": "year"}]:
+                response = self.get_series(data)
+                self.assertEqual(response.status_code, 400, data)
+        self.assertFalse(self.rrdtool.fetch.called)
@@ -39,5 +39,20 @@ APPEND_SLASH = False
 # Serve requests for the hosts/domains specified. A value of '*' matches anything.
 ALLOWED_HOSTS = ['*']
 
+# Seconds for which the user info of a valid authentication token is cached
+# by the services, unless the token expires earlier. Set to 0 to validate
+# every token with Astakos.
+AUTH_CACHE_TTL = 0
+# Seconds for which an invalid authentication token is cached.
+AUTH_CACHE_NEGATIVE_TTL = 0
+# Number of tokens cached in each process.
+AUTH_CACHE_SIZE = 1000
+# Name of a cache in 'CACHES' that is shared by all processes and hosts of
+# the services, e.g. a memcached one. Set to None to only use the cache of
+# each process.
+# Renewed tokens are revoked through the shared cache. Without it, the other
+# processes accept a renewed token for up to 'AUTH_CACHE_TTL' seconds.
+AUTH_CACHE_BACKEND = None
+
 # Silence invalid django warnings
 SILENCED_SYSTEM_CHECKS = ["1_6.W002"]